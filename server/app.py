@@ -1,31 +1,124 @@
-from flask import Flask, render_template, request, redirect, url_for
-from werkzeug.utils import secure_filename
-import os
-from pipelineQT.Tagger import Tagger 
-from pipelineQT import visualizor
-from pipelineQT.Processor import Processor
-from pipelineQT.Extractor import Extractor
-from pipelineQT.Translator import Translator
+from flask import Flask, render_template, request, redirect, url_for, jsonify, abort, Response
+import os, json, gzip, queue
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+# The pipeline modules (calamancy, pandas, plotly, requests...) are imported by the
+# handlers that use them, so the server starts fast and workers load only what they use
+from pipelineQT.Cache import ArtifactCache, DatasetCache, ResultCache
+from pipelineQT.Progress import bus as progress_bus
+from pipelineQT.Batcher import MicroBatcher
+from pipelineQT.Store import ResultsStore
+from pipelineQT import Warmup, Metrics
+from pipelineQT.Profiler import StageProfiler
+from jobs import JobQueue, QueueFullError, DONE, FAILED
+from ingest import IngestRequest, ingest, release, MAX_FILE_BYTES
 
 app = Flask(__name__)
+# Uploads are hashed and size-checked while they are received (see ingest.py)
+app.request_class = IngestRequest
 
 # CONFIGURATION
 UPLOAD_FOLDER = '../uploaded_4_analysis' 
 UPLOAD_TRANSLATE_FOLDER = '../uploaded_4_translate'
+MAX_CONTENT_LENGTH = 4 * MAX_FILE_BYTES + 1024 ** 2 # one file per dataset plus the form fields
+ARTIFACT_CACHE_FOLDER = '../cache/artifacts'
+ARTIFACT_CACHE_MAX_BYTES = 2 * 1024 ** 3 # 2GB of cleaned datasets
+DATASET_CACHE_FOLDER = '../cache/datasets'
+RESULT_CACHE_FOLDER = '../cache/results'
+RESULT_CACHE_MAX_BYTES = 256 * 1024 ** 2 # 256MB of /upload results on disk
+RESULT_CACHE_MEMORY_BYTES = 64 * 1024 ** 2 # the most recent ones also in memory
+OFFLINE = os.environ.get('QT_OFFLINE', '0') == '1' # Serve /getdata from the dataset cache only
+JOBS_DB = '../cache/jobs.sqlite3'
+RESULTS_DB = '../cache/results.sqlite3'
+JOB_WORKERS = int(os.environ.get('QT_JOB_WORKERS', 2)) # Pipeline jobs running at the same time
+PROGRESS_KEEPALIVE = 15 # Seconds between SSE comments so proxies keep the stream open
+TAG_MAX_BATCH = int(os.environ.get('QT_TAG_MAX_BATCH', 64)) # /api/tag sentences run through the model at once
+TAG_MAX_WAIT_MS = float(os.environ.get('QT_TAG_MAX_WAIT_MS', 5)) # how long a batch waits to fill up
+TAG_MAX_SENTENCES = 1000 # per /api/tag request
+TAG_TIMEOUT = 60 # seconds an /api/tag request waits for its batch
+TAG_RETRY_AFTER = 5 # seconds clients are asked to wait when it timed out
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['UPLOAD_TRANSLATE_FOLDER'] = UPLOAD_TRANSLATE_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+app.config['ARTIFACT_CACHE_FOLDER'] = ARTIFACT_CACHE_FOLDER
+app.config['DATASET_CACHE_FOLDER'] = DATASET_CACHE_FOLDER
+app.config['RESULT_CACHE_FOLDER'] = RESULT_CACHE_FOLDER
+app.config['OFFLINE'] = OFFLINE
+app.config['JOBS_DB'] = JOBS_DB
+app.config['RESULTS_DB'] = RESULTS_DB
 
 # Create the folder immediately if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(UPLOAD_TRANSLATE_FOLDER, exist_ok=True)
 
+# Cleaned datasets are reused across /getdata submissions with the same source, config and seed
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_FOLDER, max_bytes=ARTIFACT_CACHE_MAX_BYTES)
+# Raw downloads are revalidated with ETag/Last-Modified and shared between local paths
+dataset_cache = DatasetCache(DATASET_CACHE_FOLDER)
+# Tagger counts and charts of /upload, keyed by the uploaded content and the tagger version
+result_cache = ResultCache(RESULT_CACHE_FOLDER, max_bytes=RESULT_CACHE_MAX_BYTES, max_memory_bytes=RESULT_CACHE_MEMORY_BYTES)
+# Counts of every tagging run, for comparisons across engines and datasets
+results_store = ResultsStore(RESULTS_DB)
+# Uploads, downloads and translations run here instead of in the request thread,
+# their progress is published on a channel named after the job id
+job_queue = JobQueue(JOBS_DB, max_workers=JOB_WORKERS, on_finish=progress_bus.close)
+# and kept in the jobs database for the other server processes (gunicorn workers)
+progress_bus.add_sink(job_queue.record_progress)
+
+# plotly.js served from /assets, (raw, gzipped) once requested
+plotly_js_version = None
+plotly_js = None
+
+def _plotly_js_version():
+    global plotly_js_version
+    if plotly_js_version is None:
+        from plotly.offline import get_plotlyjs_version
+        plotly_js_version = get_plotlyjs_version()
+    return plotly_js_version
+
+# Sentences from concurrent /api/tag requests are tagged together
+api_tagger = None
+
+def _tag_batch(sentences):
+    global api_tagger
+    if api_tagger is None:
+        # Only the batcher thread gets here
+        from pipelineQT.Tagger import Tagger
+        api_tagger = Tagger()
+    return api_tagger.get_forms(sentences, batch_size=TAG_MAX_BATCH)
+
+tag_batcher = MicroBatcher(_tag_batch, max_batch_size=TAG_MAX_BATCH, max_wait=TAG_MAX_WAIT_MS / 1000, name="tag")
+
+
+def _submit(kind, fn, *args):
+    """Queue a pipeline job, answer with its id (JSON clients) or its status page (browsers)."""
+    try:
+        job_id = job_queue.submit(kind, fn, *args)
+    except QueueFullError as e:
+        return str(e), 503
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(
+            job_id=job_id,
+            status_url=url_for('job_status', job_id=job_id),
+            progress_url=url_for('job_progress', job_id=job_id),
+        ), 202
+    return redirect(url_for('job_page', job_id=job_id))
+
+@app.errorhandler(413)
+@app.errorhandler(415)
+def upload_rejected(e):
+    # Plain message so the forms can show it in their overlay
+    return e.description, e.code
+
 @app.route('/')
 def index():
     return render_template("landing.html")
 
 @app.route("/quantify")
 def quantify():
-    return render_template("quantify.html")
+    # Tiers alone, the Tagger module would import pandas and numpy into a page view
+    from pipelineQT import Tiers
+    return render_template("quantify.html", tiers=Tiers.installed_tiers())
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
@@ -33,53 +126,151 @@ def upload_files():
     if 'file' not in request.files:
         return 'No file part in the request', 400
 
-    # 2. Get the list of ALL files selected (not just the first one)
-    files = request.files.getlist('file')
-
-    # 3. Loop through them and save
-    keys = []
-    saved_files = []
-    full_path = []
-    for file in files:
-        # Check if user submitted an empty part
-        if file.filename == '':
-            continue
-            
-        if file:
-            # secure_filename cleans the name (e.g., converts "My File.pdf" to "My_File.pdf")
-            # preventing security issues like directory traversal
-            filename = secure_filename(file.filename)
-            
-            # Save to the defined folder
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            full_path.append(file_path)
-            file.save(file_path)
-            
-            saved_files.append(filename)
-            print(f"Saved: {filename}")
-            keys.append(filename)
-    
-    tagger = Tagger()
-
-    print(full_path)
-    files_dict = {
-        path.split("_")[-1].split(".")[0]: path
-        for path in full_path
+    # 2. Get the list of ALL files selected (not just the first one), hashed and
+    # size-checked while they were received and stored under their content hash
+    files_dict = ingest(request.files.getlist('file'), app.config['UPLOAD_FOLDER'])
+    if not files_dict:
+        return 'No file selected', 400
+
+    from pipelineQT.Tagger import Tagger
+
+    # Model tier of this job: md for exploratory runs up to trf for final numbers.
+    # Only installed models, a missing one would be downloaded in the middle of the job
+    tier = request.form.get('tier') or Tagger.TIER
+    tiers = Tagger.installed_tiers()
+    if not tiers:
+        release(files_dict)
+        return "No tagger model is installed on this server.", 503
+    if tier not in tiers:
+        release(files_dict)
+        return f"Tagger model '{tier}' is not available on this server. Accepted: {', '.join(tiers)}", 400
+
+    # Counts estimated from a sample, to an interval width (0.02 = ±1%), instead of tagging every row
+    estimate_width = request.form.get('estimate_width') or None
+    if estimate_width is not None:
+        try:
+            estimate_width = float(estimate_width)
+        except ValueError:
+            estimate_width = 0.0
+        if not 0 < estimate_width < 1:
+            release(files_dict)
+            return "estimate_width must be a proportion between 0 and 1, e.g. 0.02 for ±1%.", 400
+
+    # The same files analyzed before (e.g. a shared result link), skip the tagger
+    result_inputs = {
+        'files': {key: buffer.sha256 for key, buffer in files_dict.items()},
+        'model': Tagger.model_of(tier),
+        'rules': Tagger.RULE_VERSION,
     }
-    print(files_dict)
-    tagger_results = tagger(True, **files_dict)
+    if estimate_width is not None:
+        result_inputs['estimate_width'] = estimate_width
+    result_key = result_cache.make_key(**result_inputs)
+    if result_cache.get(result_key) is not None:
+        release(files_dict)
+        result_url = url_for('cached_result', result_key=result_key)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(result_url=result_url)
+        return redirect(result_url)
+
+    return _submit('upload', _run_upload, files_dict, result_key, result_inputs, tier, estimate_width)
+
+def _run_upload(job_id, files_dict, result_key, result_inputs, tier, estimate_width=None):
+    from pipelineQT.Tagger import Tagger
+    from pipelineQT import visualizor
+
+    # With QT_PROFILE=1 the memory of every dataset tagged is written to ../cache/profiles/<job id>.json
+    profiler = StageProfiler.from_env(job_id)
+    try:
+        # The tagger reads the uploaded buffers directly
+        tagger = Tagger(channel=job_id, store=results_store, profiler=profiler, tier=tier,
+                        estimate_width=estimate_width)
+        tagger_results = tagger(True, **files_dict)
+    finally:
+        release(files_dict)
+        if profiler is not None:
+            profiler.write()
 
     figures_dict = visualizor.generate_charts(tagger_results)
 
-
-    charts_html = {}
-    for name, fig in figures_dict.items():
-        # include_plotlyjs='cdn' ensures the charts work without downloading extra files
-        charts_html[name] = fig.to_html(full_html=False, include_plotlyjs='cdn')
-
-    # 6. Render the Results Page
-    return render_template('results.html', charts=charts_html)
-    # return "kim"
+    # JSON specs drawn by the page with one shared plotly.js (see /assets/plotly-<version>.min.js)
+    result = {'tags': tagger_results, 'figures': visualizor.figure_specs(figures_dict),
+              'tagger': {'tier': tier, 'model': result_inputs['model'], 'rules': result_inputs['rules']}}
+    if tagger.estimates:
+        result['estimates'] = tagger.estimates
+    result_cache.put(result_key, result_inputs, result)
+    return result
+
+def _render_results(result):
+    # Results stored before the JSON specs carry pre-rendered HTML 'charts'
+    return render_template('results.html', figures=result.get('figures'), charts=result.get('charts'),
+                           tagger=result.get('tagger'), estimates=result.get('estimates'), plotly_version=_plotly_js_version())
+
+@app.route('/results/<result_key>')
+def cached_result(result_key):
+    result = result_cache.get(result_key)
+    if result is None:
+        abort(404)
+    return _render_results(result)
+
+@app.route('/compare')
+def compare():
+    """Cross-engine charts from the results store, e.g. /compare?dataset=paws&engine=google&engine=deepl"""
+    from pipelineQT import visualizor
+
+    figures = visualizor.generate_engine_charts(
+        results_store,
+        datasets=request.args.getlist('dataset') or None,
+        engines=request.args.getlist('engine') or None,
+    )
+    return _render_results({'figures': visualizor.figure_specs(figures)})
+
+@app.route('/assets/plotly-<version>.min.js')
+def plotly_bundle(version):
+    """The plotly.js of the installed plotly package, so the charts work offline and without a CDN."""
+    if version != _plotly_js_version():
+        return redirect(url_for('plotly_bundle', version=_plotly_js_version()))
+
+    global plotly_js
+    if plotly_js is None:
+        # Built once per process, gzip too since the bundle is several MB
+        from plotly.offline import get_plotlyjs
+        source = get_plotlyjs().encode('utf-8')
+        plotly_js = (source, gzip.compress(source, 9))
+
+    compressed = 'gzip' in request.accept_encodings
+    response = Response(plotly_js[1] if compressed else plotly_js[0], mimetype='application/javascript')
+    if compressed:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    # The URL changes with the version, so browsers can keep it forever
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(f'plotly-{_plotly_js_version()}-{"gz" if compressed else "raw"}')
+    return response.make_conditional(request)
+
+@app.route('/api/tag', methods=['POST'])
+def api_tag():
+    """{"sentences": [...]} -> {"forms": [...]}, 0 = DKA, 1 = KA, 2 = ambiguous."""
+    payload = request.get_json(silent=True) or {}
+    sentences = payload.get('sentences')
+    if not isinstance(sentences, list) or not all(isinstance(s, str) for s in sentences):
+        return jsonify(error='Send {"sentences": ["...", ...]}'), 400
+    if len(sentences) > TAG_MAX_SENTENCES:
+        return jsonify(error=f'At most {TAG_MAX_SENTENCES} sentences per request'), 413
+
+    from pipelineQT.Tagger import Tagger
+
+    try:
+        forms = tag_batcher(sentences, timeout=TAG_TIMEOUT)
+    except FuturesTimeoutError:
+        # The batcher is saturated, the sentences are still tagged but nobody waits for them
+        response = jsonify(error=f'The tagger is busy, no result within {TAG_TIMEOUT}s. Try again later.')
+        response.headers['Retry-After'] = str(TAG_RETRY_AFTER)
+        return response, 503
+    return jsonify(forms=forms, tier=Tagger.TIER, model=Tagger.MODEL, rules=Tagger.RULE_VERSION)
+
+@app.route('/api/tag/stats')
+def api_tag_stats():
+    return jsonify(tag_batcher.stats())
 
 @app.route("/getdata", methods=['GET', 'POST'])
 def get_data():
@@ -129,47 +320,44 @@ def get_data():
         print(f"Configuration: {config}")
         
 
-        datasets = list(config.keys())
+        stream = request.form.get('stream') == 'on' and not app.config['OFFLINE']
+        return _submit('getdata', _run_getdata, local_path, random_seed, config, stream)
 
-        # Extract the data
-        extractor = Extractor(local_path)
-        extractor.extract(*datasets)
+def _run_getdata(job_id, local_path, random_seed, config, stream):
+    from pipelineQT.Processor import Processor
+    from pipelineQT.Extractor import Extractor
 
-        # Get the config dictionary
-        paws_path = ""
-        bcopa_path = ""
-        xnli_path = ""
-        xlsum_path = ""
-        
-        paths_list = os.listdir(local_path)
-
-        for path in paths_list:
-            if "paws" in path:
-                paws_path = os.path.join(local_path, path)
-            elif "copa" in path:
-                bcopa_path = os.path.join(local_path, path)
-            elif "xnli" in path:
-                xnli_path = os.path.join(local_path, path)
-            else:
-                xlsum_path = os.path.join(local_path, path)
-        
-        for key, values in config.items():
-            if key == "paws":
-                values['path'] = paws_path
-            elif key == "bcopa":
-                values['path'] = bcopa_path
-            elif key == "xnli":
-                values['path'] = xnli_path
-            else:
-                values['path'] = xlsum_path
-            
-        # Transform and Load
-        Processor.random_seed = random_seed
-        processor = Processor(local_path)   
-        processor.process(**config)
+    datasets = list(config.keys())
+    profiler = StageProfiler.from_env(job_id)
+    processor = Processor(local_path, cache=artifact_cache, channel=job_id, profiler=profiler)
+    # Per instance so concurrent jobs don't share a seed
+    processor.random_seed = random_seed
 
+    try:
+        if stream:
+            # Download and clean in one pass, the raw files never touch the disk
+            report = processor.stream(**config)
+        else:
+            # Extract the data
+            extractor = Extractor(local_path, cache=dataset_cache, offline=app.config['OFFLINE'], channel=job_id)
+            downloaded = extractor.extract(*datasets)
 
-        return redirect(url_for('translate'))
+            # Datasets that failed to download keep an empty path and are reported by the processor
+            for key, values in config.items():
+                values['path'] = downloaded.get(key, "")
+
+            # Transform and Load
+            report = processor.process(parallel=True, **config)
+    finally:
+        if profiler is not None:
+            profiler.write()
+    print(f"Processing report: {report}")
+
+    failed = {key: status['error'] for key, status in report.items() if status['status'] == 'failed'}
+    if failed:
+        raise RuntimeError(f'Failed to process: {failed}')
+
+    return {'report': report}
 
 @app.route("/translate", methods=['GET', 'POST'])
 def translate():
@@ -179,35 +367,9 @@ def translate():
         if 'file' not in request.files:
             return 'No file part in the request', 400
         
-        files = request.files.getlist('file')
-
-        keys = []
-        saved_files = []
-        full_path = []
-        for file in files:
-            # Check if user submitted an empty part
-            if file.filename == '':
-                continue
-                
-            if file:
-                # preventing security issues like directory traversal
-                filename = secure_filename(file.filename)
-                
-                # Save to the defined folder
-                file_path = os.path.join(app.config['UPLOAD_TRANSLATE_FOLDER'], filename)
-                full_path.append(file_path)
-                file.save(file_path)
-                
-                saved_files.append(filename)
-                print(f"Saved: {filename}")
-                keys.append(filename)
-
-            print(full_path)
-            files_dict = {
-                path.split("_")[-1].split(".")[0]: path
-                for path in full_path
-            }
-            print(files_dict)
+        files_dict = ingest(request.files.getlist('file'), app.config['UPLOAD_TRANSLATE_FOLDER'])
+        if not files_dict:
+            return 'No file selected', 400
 
         local_path = request.form.get("local_path")
         machine_translator = request.form.get("model")
@@ -215,9 +377,18 @@ def translate():
         azure_region = request.form.get("azure_region", "")
         azure_endpoint = request.form.get("azure_endpoint", "")
 
-        # Initialize an object
-        translator = Translator(local_path)
+        return _submit('translate', _run_translate, local_path, machine_translator,
+                       api_key, azure_region, azure_endpoint, files_dict)
+
+def _run_translate(job_id, local_path, machine_translator, api_key, azure_region, azure_endpoint, files_dict):
+    from pipelineQT.Translator import Translator
 
+    # Initialize an object
+    profiler = StageProfiler.from_env(job_id)
+    translator = Translator(local_path, channel=job_id, profiler=profiler)
+
+    # The translator reads the uploaded buffers directly
+    try:
         if machine_translator == "opus":
             translator.opus_translate(**files_dict)
 
@@ -235,10 +406,127 @@ def translate():
 
         else:
             translator.deepl_translate(key=api_key, **files_dict)
-        
-        return redirect(url_for('quantify'))
+    finally:
+        release(files_dict)
+        if profiler is not None:
+            profiler.write()
+
+    return {}
+
+@app.route("/jobs/<job_id>")
+def job_page(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    return render_template("job.html", job=job)
+
+@app.route("/jobs/<job_id>/status")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+
+    # The result can be large, fetch it from /jobs/<id>/result
+    job.pop('result')
+    job['result_url'] = url_for('job_result', job_id=job_id) if job['status'] == DONE else None
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/progress")
+def job_progress(job_id):
+    """Server-sent events with the live progress of a job, ends with an 'end' event."""
+    if job_queue.get(job_id) is None:
+        abort(404)
+
+    def events():
+        subscriber = progress_bus.subscribe(job_id)
+        try:
+            # The job may have finished before we subscribed
+            job = job_queue.get(job_id)
+            if job['status'] in (DONE, FAILED):
+                yield f"data: {json.dumps({'type': 'end', 'stage': None, 'status': job['status']})}\n\n"
+                return
+
+            # With several server processes the job may run in another one, its
+            # events never reach this bus: read them from the jobs database instead
+            remote = job['pid'] != os.getpid()
+            seen = 0.0
+            idle = 0
+            while True:
+                try:
+                    event = subscriber.get(timeout=1)
+                except queue.Empty:
+                    if remote:
+                        for seen, event in job_queue.progress(job_id, since=seen):
+                            idle = 0
+                            yield f"data: {json.dumps(event)}\n\n"
+                    job = job_queue.get(job_id)
+                    if job['status'] in (DONE, FAILED):
+                        yield f"data: {json.dumps({'type': 'end', 'stage': None, 'status': job['status']})}\n\n"
+                        return
+                    idle += 1
+                    if idle >= PROGRESS_KEEPALIVE:
+                        idle = 0
+                        yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+                if event['type'] == 'end':
+                    return
+        finally:
+            progress_bus.unsubscribe(job_id, subscriber)
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # Don't let nginx buffer the stream
+    })
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    if job['status'] == FAILED:
+        return f"Job failed: {job['error']}", 500
+    if job['status'] != DONE:
+        return redirect(url_for('job_page', job_id=job_id))
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job['result'])
+
+    # Each kind of job continues where its form used to lead
+    if job['kind'] == 'upload':
+        return _render_results(job['result'])
+    if job['kind'] == 'getdata':
+        return redirect(url_for('translate'))
+    return redirect(url_for('quantify'))
 
+@app.route("/healthz")
+def healthz():
+    """200 once the models are loaded and warmed up in this process (see wsgi.py), 503 until then."""
+    status = Warmup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus exposition of pipelineQT/Metrics.py, merged across gunicorn workers."""
+    body, content_type = Metrics.export()
+    return Response(body, content_type=content_type)
+
+
+
+@app.before_request
+def _warmup_dev_server():
+    # Under gunicorn the master warmed up before forking (wsgi.py) and this is a no-op.
+    # Dev servers (python app.py, flask run) warm up in the background on their first
+    # request at the latest, /healthz reports 503 until it's done
+    if not Warmup.is_ready():
+        Warmup.start()
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    from werkzeug.serving import is_running_from_reloader
+
+    # Start warming up at once, except in the reloader's parent process, which never serves
+    use_reloader = os.environ.get("QT_RELOAD", "1") == "1"
+    if not use_reloader or is_running_from_reloader():
+        Warmup.start()
+    app.run(debug=True, use_reloader=use_reloader)
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Benchmark matrix of the cleaning backends.
+
+Generates synthetic raw files of increasing size for every dataset, cleans
+each one with every available backend and prints the seconds taken.
+
+    cd server
+    python -m benchmarks.bench_backends --rows 10000 100000 1000000
+"""
+import argparse, csv, json, os, random, tempfile, time
+from pipelineQT.Backends import SPECS, PandasBackend, PolarsBackend, SparkBackend, select_backend
+from pipelineQT.Processor import Processor
+
+WORDS = "the a of to and in is was for on that with as by at from it his an were are which this be".split()
+
+
+def _sentence(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 60))).capitalize() + "."
+
+
+def write_raw(key, rows, directory, seed=0):
+    """Write a synthetic raw file shaped like the released dataset."""
+    rng = random.Random(seed)
+    path = os.path.join(directory, f"{key}_{rows}.{SPECS[key]['extension']}")
+
+    if key == "xlsum":
+        with open(path, "w", encoding="utf-8") as f:
+            for i in range(rows):
+                f.write(json.dumps({"id": str(i), "summary": _sentence(rng), "text": _sentence(rng) * 3}) + "\n")
+        return path
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if key == "paws":
+            writer = csv.writer(f)
+            writer.writerow(["id", "sentence1", "sentence2", "label"])
+            for i in range(rows):
+                writer.writerow([i, _sentence(rng), _sentence(rng), rng.randint(0, 1)])
+        elif key == "bcopa":
+            writer = csv.writer(f)
+            writer.writerow(["id", "premise", "choice1", "choice2", "question", "label", "mirrored"])
+            for i in range(rows):
+                writer.writerow([i, _sentence(rng), _sentence(rng), _sentence(rng),
+                                 rng.choice(["cause", "effect"]), rng.randint(1, 2), rng.randint(0, 1)])
+        else:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["language", "gold_label", "sentence1", "sentence2"])
+            for i in range(rows):
+                writer.writerow([rng.choice(["en", "tl", "fr"]), rng.choice(["neutral", "contradiction", "entailment"]),
+                                 _sentence(rng), _sentence(rng)])
+    return path
+
+
+def _config(key):
+    return {sample_key: 200 for sample_key in SPECS[key]["samples"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--datasets", nargs="+", default=list(SPECS))
+    parser.add_argument("--backends", nargs="+", default=["pandas", "polars", "spark"])
+    args = parser.parse_args()
+
+    processor = Processor(tempfile.mkdtemp())
+    backends = {"pandas": PandasBackend(), "polars": PolarsBackend(), "spark": SparkBackend(processor._get_spark)}
+    if "spark" in args.backends and processor._check_pyspark_requirements():
+        print("Spark is unavailable, skipping it.")
+        args.backends.remove("spark")
+
+    print(f"| dataset | rows | MB | {' | '.join(args.backends)} | auto |")
+    print(f"|---|---|---|{'---|' * len(args.backends)}---|")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for key in args.datasets:
+            for rows in args.rows:
+                source_path = write_raw(key, rows, directory)
+                destination_path = os.path.join(directory, f"cleaned_{key}.csv")
+
+                timings = []
+                for name in args.backends:
+                    start = time.perf_counter()
+                    try:
+                        backends[name].clean(SPECS[key], source_path, destination_path, _config(key), 42)
+                        timings.append(f"{time.perf_counter() - start:.2f}s")
+                    except MemoryError:
+                        timings.append("OOM")
+
+                size = os.path.getsize(source_path) / 1024 ** 2
+                print(f"| {key} | {rows:,} | {size:.0f} | {' | '.join(timings)} | {select_backend(source_path)} |")
+                os.remove(source_path)
+
+
+if __name__ == "__main__":
+    main()
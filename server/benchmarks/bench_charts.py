@@ -0,0 +1,133 @@
+"""
+Page weight of the results page: per-chart HTML fragments vs JSON figure specs.
+
+Builds tagger aggregates for every dataset x engine, renders results.html
+both ways and reports the HTML size (raw and gzipped), the script tags on
+the page, the JavaScript fetched on a first and a repeat visit and the time
+spent building the chart payload on the server. With --browser (needs
+playwright and its chromium) the page is also loaded headless and the time
+until every chart is drawn is measured; the 'html' mode then needs internet
+access for the CDN.
+
+    cd server
+    python -m benchmarks.bench_charts --engines google,azure,deepl,opus
+"""
+import argparse, gzip, os, random, re, threading, time
+from flask import Flask, Response, render_template
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+from werkzeug.serving import make_server
+from pipelineQT import visualizor
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEGMENTS = {
+    "bcopa": ["tags_premise", "tags_choice1", "tags_choice2"],
+    "paws": ["tags_sentence_1", "tags_sentence_2"],
+    "xnli": ["tags_sentence_1", "tags_sentence_2"],
+    "xlsum": ["tags_text", "tags_summary"],
+}
+
+
+def make_results(engines, seed=0):
+    rng = random.Random(seed)
+    return {
+        f"{engine}_{dataset}": {
+            segment: {
+                "di_karaniwang_ayos": rng.randint(0, 500),
+                "karaniwang_ayos": rng.randint(0, 500),
+                "ambiguous": rng.randint(0, 50),
+            }
+            for segment in segments
+        }
+        for engine in engines
+        for dataset, segments in SEGMENTS.items()
+    }
+
+
+def make_app(pages):
+    app = Flask(__name__, template_folder=os.path.join(SERVER_DIR, "templates"),
+                static_folder=os.path.join(SERVER_DIR, "static"))
+    bundle = get_plotlyjs().encode("utf-8")
+
+    @app.route("/assets/plotly-<version>.min.js")
+    def plotly_bundle(version):
+        return Response(bundle, mimetype="application/javascript")
+
+    @app.route("/page/<mode>")
+    def page(mode):
+        return pages[mode]
+
+    return app, bundle
+
+
+def render_page(app, mode, figures):
+    start = time.perf_counter()
+    if mode == "html":
+        charts = {name: fig.to_html(full_html=False, include_plotlyjs="cdn") for name, fig in figures.items()}
+        payload = {"charts": charts}
+    else:
+        payload = {"figures": visualizor.figure_specs(figures)}
+    build_seconds = time.perf_counter() - start
+
+    with app.test_request_context():
+        html = render_template("results.html", figures=payload.get("figures"), charts=payload.get("charts"),
+                               plotly_version=get_plotlyjs_version())
+    return html, build_seconds
+
+
+def browser_render_ms(base_url, mode, charts):
+    from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch()
+        page = browser.new_page()
+        start = time.perf_counter()
+        page.goto(f"{base_url}/page/{mode}")
+        page.wait_for_function(f"document.querySelectorAll('.main-svg').length >= {charts}", timeout=60000)
+        elapsed = (time.perf_counter() - start) * 1000
+        browser.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", default="google,azure,deepl,opus")
+    parser.add_argument("--browser", action="store_true", help="measure time-to-render in headless chromium")
+    args = parser.parse_args()
+
+    figures = visualizor.generate_charts(make_results(args.engines.split(",")))
+    pages = {}
+    app, bundle = make_app(pages)
+    bundle_gz = len(gzip.compress(bundle, 9))
+
+    rows = []
+    for mode in ["html", "json"]:
+        html, build_seconds = render_page(app, mode, figures)
+        pages[mode] = html
+        scripts = len(re.findall(r"<script", html))
+        # Both load one plotly.js on a first visit; the local bundle is immutable
+        # and cached, the CDN one depends on the CDN headers and network
+        first_visit_js = bundle_gz
+        repeat_visit_js = "CDN cache" if mode == "html" else 0
+        rows.append([mode, len(figures), len(html), len(gzip.compress(html.encode("utf-8"), 9)), scripts,
+                     first_visit_js, repeat_visit_js, f"{build_seconds * 1000:.1f}"])
+
+    if args.browser:
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        for row in rows:
+            row.append(f"{browser_render_ms(base_url, row[0], len(figures)):.0f}")
+        server.shutdown()
+
+    header = ["mode", "charts", "HTML bytes", "HTML gzip bytes", "script tags",
+              "JS gzip bytes (first visit)", "JS bytes (repeat visit)", "server build ms"]
+    if args.browser:
+        header.append("time-to-render ms")
+    print("| " + " | ".join(header) + " |")
+    print("|" + "---|" * len(header))
+    for row in rows:
+        print("| " + " | ".join(str(value) for value in row) + " |")
+
+
+if __name__ == "__main__":
+    main()
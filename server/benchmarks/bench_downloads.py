@@ -0,0 +1,138 @@
+"""
+Download benchmark against a local stand-in for the GitHub release server.
+
+The stand-in serves synthetic xlsum.jsonl / xnli.tsv files with an ETag,
+supports Range and If-Range requests, caps the bandwidth of every
+connection and drops the first `--drops` responses of every file part-way
+through. It compares the old
+download loop (one file at a time, 1KB blocks, restart from zero after a
+disconnect) with DownloadManager (concurrent, 1MB blocks, Range resume,
+sha256 verified against a manifest).
+
+    cd server
+    python -m benchmarks.bench_downloads --size-mb 64 --drops 2
+"""
+import argparse, hashlib, json, os, random, tempfile, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from pipelineQT.Downloader import DownloadManager, sha256sum
+
+FILES = ["xlsum.jsonl", "xnli.tsv"]
+
+
+def make_handler(files, drops, rate):
+    served = {name: 0 for name in files}
+    lock = threading.Lock()
+    rng = random.Random(0)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            name = self.path.lstrip("/")
+            if name not in files:
+                self.send_error(404)
+                return
+            body = files[name]
+            etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+
+            start = 0
+            # A Range is only honoured while If-Range still names this version of the file
+            if "Range" in self.headers and self.headers.get("If-Range", etag) == etag:
+                start = int(self.headers["Range"].split("=")[1].split("-")[0])
+                if start >= len(body):
+                    self.send_response(416)
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            else:
+                self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body) - start))
+            self.end_headers()
+
+            with lock:
+                served[name] += 1
+                drop_at = start + rng.randint(1, len(body) - start) if served[name] <= drops else None
+
+            # Send in 64KB pieces at `rate` bytes per second
+            position = start
+            while position < len(body):
+                end = min(position + 64 * 1024, len(body))
+                if drop_at is not None and end >= drop_at:
+                    self.wfile.write(body[position:drop_at])
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(body[position:end])
+                position = end
+                time.sleep((64 * 1024) / rate)
+
+    return Handler
+
+
+def naive_download(url, output_path):
+    """The download loop Extractor used to have, retrying from zero on a disconnect."""
+    while True:
+        try:
+            response = requests.get(url, stream=True)
+            response.raise_for_status()
+            total_size = int(response.headers.get("content-length", 0))
+            with open(output_path, "wb") as file:
+                for data in response.iter_content(1024):
+                    file.write(data)
+            if os.path.getsize(output_path) >= total_size:
+                return output_path
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--drops", type=int, default=2, help="dropped responses per file and run")
+    parser.add_argument("--rate-mb", type=float, default=32, help="bandwidth per connection in MB/s")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    files = {name: rng.randbytes(args.size_mb * 1024 ** 2) for name in FILES}
+    expected = {name: hashlib.sha256(body).hexdigest() for name, body in files.items()}
+
+    results = {}
+    for label in ["naive", "manager"]:
+        # Fresh server per run so both see the same disconnects
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(files, args.drops, args.rate_mb * 1024 ** 2))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        with tempfile.TemporaryDirectory() as directory:
+            jobs = [(f"{base_url}/{name}", os.path.join(directory, name)) for name in FILES]
+
+            start = time.perf_counter()
+            if label == "naive":
+                for url, output_path in jobs:
+                    naive_download(url, output_path)
+            else:
+                manifest = os.path.join(directory, "checksums.json")
+                with open(manifest, "w", encoding="utf-8") as f:
+                    json.dump(expected, f)
+                errors = DownloadManager(backoff=0, manifest=manifest).download_all(*jobs)
+                assert not any(errors.values()), errors
+            results[label] = time.perf_counter() - start
+
+            for name in FILES:
+                assert sha256sum(os.path.join(directory, name)) == expected[name], f"{name} is corrupted"
+
+        server.shutdown()
+
+    print("| mode | seconds |")
+    print("|---|---|")
+    for label, seconds in results.items():
+        print(f"| {label} | {seconds:.2f} |")
+    print(f"Saved {results['naive'] - results['manager']:.2f}s ({1 - results['manager'] / results['naive']:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Sampled form estimates against tagging every row.
+
+The text columns of a dataset are repeated --scale times to stand in for
+a large corpus. That corpus is tagged in full once, for the exact counts,
+then estimated with FormEstimator once per seed. For each run it reports
+the fraction of rows tagged, the time against the full tagging, the
+largest error of the estimated proportions and whether every exact
+proportion fell in its interval. Over many seeds, the share of runs
+with every interval covering should be close to the confidence or above.
+
+    cd server
+    python -m benchmarks.bench_estimator --scale 1000 --width 0.02 --runs 20
+"""
+import argparse, tempfile, time
+import numpy as np
+from pipelineQT.Tagger import Tagger
+from pipelineQT.Estimator import FormEstimator
+from pipelineQT.Schema import read_dataset, TEXT_COLUMNS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="../datasets/labeled/google/google_labeled_paws.csv")
+    parser.add_argument("--scale", type=int, default=100, help="times every row is repeated")
+    parser.add_argument("--width", type=float, default=0.02)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    df = read_dataset(args.dataset)
+    columns = [column for column in df.columns if column in TEXT_COLUMNS]
+    texts = [text for column in columns for text in df[column].tolist()] * args.scale
+
+    tmp = tempfile.mkdtemp()
+    tagger = Tagger(tag_dir=tmp, log_file=f"{tmp}/tagger.log")
+    start = time.perf_counter()
+    exact = np.bincount(tagger.get_forms(texts, batch_size=256), minlength=3)[:3] / len(texts)
+    full_seconds = time.perf_counter() - start
+
+    print(f"{len(texts)} rows tagged in full in {full_seconds:.2f}s\n")
+    print("| seed | tagged | seconds | speedup | max error | all covered |")
+    print("|---|---|---|---|---|---|")
+    covered = 0
+    for seed in range(args.runs):
+        result = FormEstimator(tagger, width=args.width, confidence=args.confidence, seed=seed).estimate(texts)
+        estimate = np.array(list(result["proportions"].values()))
+        intervals = np.array(list(result["proportion_intervals"].values()))
+        all_covered = bool(((intervals[:, 0] <= exact) & (exact <= intervals[:, 1])).all())
+        covered += all_covered
+        print(f"| {seed} | {result['tagged']} ({result['fraction_tagged']:.2%}) | {result['seconds']:.2f} "
+              f"| {full_seconds / result['seconds']:.0f}x | {np.abs(estimate - exact).max():.4f} | {all_covered} |")
+    print(f"\nEvery interval covered the exact proportion in {covered}/{args.runs} runs")
+
+
+if __name__ == "__main__":
+    main()
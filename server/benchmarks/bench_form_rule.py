@@ -0,0 +1,75 @@
+"""
+Cost of the sentence-form rule once the model has run.
+
+The sentences of a dataset are parsed once, then the rule is timed
+alone over the same Docs in several ways:
+- tuples: a (word, (POS, tag)) list per sentence fed to _form, the
+  per-sentence path before the rule read Doc arrays
+- tokens: _form over a generator of Token attributes, the batch path
+  before
+- doc_form: _doc_form per Doc, its ORTH/POS array (the /upload path)
+- doc_forms: _doc_forms over the whole batch (the /api/tag path)
+
+Every way must give the same forms. It reports the µs per sentence of
+the best of --repeat passes.
+
+    cd server
+    python -m benchmarks.bench_form_rule --dataset ../datasets/labeled/google/google_labeled_paws.csv
+"""
+import argparse, time
+from pipelineQT.Tagger import Tagger
+from pipelineQT.Schema import read_dataset, TEXT_COLUMNS
+
+
+def tuples(docs):
+    return [Tagger._form((word, pos) for word, (pos, _) in [(token.text, (token.pos_, token.tag_)) for token in doc])
+            for doc in docs]
+
+
+def tokens(docs):
+    return [Tagger._form((token.text, token.pos_) for token in doc) for doc in docs]
+
+
+def doc_form(docs):
+    return [Tagger._doc_form(doc) for doc in docs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="../datasets/labeled/google/google_labeled_paws.csv")
+    parser.add_argument("--tier", choices=list(Tagger.TIERS), default=Tagger.TIER)
+    parser.add_argument("--sentences", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    df = read_dataset(args.dataset)
+    columns = [column for column in df.columns if column in TEXT_COLUMNS]
+    sentences = [text for column in columns for text in df[column].dropna().tolist()][:args.sentences]
+
+    nlp, _ = Tagger.load_model(Tagger.model_of(args.tier))
+    docs = list(nlp.pipe(sentences, batch_size=64))
+    tokens_count = sum(len(doc) for doc in docs)
+
+    ways = [("tuples", tuples), ("tokens", tokens), ("doc_form", doc_form), ("doc_forms", Tagger._doc_forms)]
+    reference = tuples(docs)
+    for name, fn in ways:
+        assert fn(docs) == reference, f"{name} disagrees with _form"
+
+    timings = {name: [] for name, _ in ways}
+    for _ in range(args.repeat):
+        for name, fn in ways:
+            start = time.perf_counter()
+            fn(docs)
+            timings[name].append(time.perf_counter() - start)
+
+    base = min(timings["tuples"])
+    print(f"{len(docs)} sentences, {tokens_count / len(docs):.1f} tokens each on average\n")
+    print("| rule | µs/sentence | speedup |")
+    print("|---|---|---|")
+    for name, _ in ways:
+        best = min(timings[name])
+        print(f"| {name} | {best / len(docs) * 1e6:.2f} | {base / best:.1f}x |")
+
+
+if __name__ == "__main__":
+    main()
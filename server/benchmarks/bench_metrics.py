@@ -0,0 +1,60 @@
+"""
+Overhead of the Prometheus instrumentation in the tagging loop.
+
+Tags the sentences of a translated dataset twice with the same Tagger:
+once through _get_sentence_form, which times every model call and counts
+the sentences, and once with the bare model call and form rule. Reports
+the time per sentence both ways and the overhead. Passes alternate so
+caches and CPU frequency affect both alike.
+
+    cd server
+    python -m benchmarks.bench_metrics --dataset ../datasets/labeled/google/google_labeled_paws.csv
+"""
+import argparse, tempfile, time
+from pipelineQT.Tagger import Tagger
+from pipelineQT.Schema import read_dataset, TEXT_COLUMNS
+
+
+def instrumented(tagger, sentences):
+    for text in sentences:
+        tagger._get_sentence_form(text)
+    tagger._tagged_sentences.inc(len(sentences))
+
+
+def bare(tagger, sentences):
+    for text in sentences:
+        tagger._doc_form(tagger.nlp(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="../datasets/labeled/google/google_labeled_paws.csv")
+    parser.add_argument("--sentences", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    df = read_dataset(args.dataset)
+    columns = [column for column in df.columns if column in TEXT_COLUMNS]
+    sentences = [text for column in columns for text in df[column].dropna().tolist()][:args.sentences]
+
+    tmp = tempfile.mkdtemp()
+    tagger = Tagger(tag_dir=tmp, log_file=f"{tmp}/tagger.log")
+    bare(tagger, sentences[:20]) # warm up
+
+    timings = {"bare": [], "instrumented": []}
+    for _ in range(args.repeat):
+        for name, fn in (("bare", bare), ("instrumented", instrumented)):
+            start = time.perf_counter()
+            fn(tagger, sentences)
+            timings[name].append(time.perf_counter() - start)
+
+    base = min(timings["bare"]) / len(sentences)
+    measured = min(timings["instrumented"]) / len(sentences)
+    print("| sentences | bare µs/sentence | instrumented µs/sentence | added µs/sentence | overhead |")
+    print("|---|---|---|---|---|")
+    print(f"| {len(sentences)} | {base * 1e6:.1f} | {measured * 1e6:.1f} | {(measured - base) * 1e6:.2f} "
+          f"| {(measured - base) / base:.2%} |")
+
+
+if __name__ == "__main__":
+    main()
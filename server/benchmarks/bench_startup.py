@@ -0,0 +1,70 @@
+"""
+Import time and memory of the server and of every pipelineQT module.
+
+Each module is imported in a fresh interpreter (from server/, like the
+app), `--repeat` times, and the median import time is reported with the
+process RSS after the import and the heavy third-party packages that got
+loaded along the way.
+
+    cd server
+    python -m benchmarks.bench_startup --repeat 5
+"""
+import argparse, json, os, statistics, subprocess, sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "app",
+    "pipelineQT.Tagger",
+    "pipelineQT.Translator",
+    "pipelineQT.Processor",
+    "pipelineQT.Extractor",
+    "pipelineQT.Downloader",
+    "pipelineQT.Backends",
+    "pipelineQT.Schema",
+    "pipelineQT.visualizor",
+    "pipelineQT.Cache",
+    "pipelineQT.Store",
+    "pipelineQT.Pipeline",
+]
+HEAVY = ["calamancy", "spacy", "transformers", "torch", "pyspark", "pandas", "polars",
+         "pyarrow", "numpy", "plotly", "requests", "tqdm", "psutil"]
+
+PROBE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+import psutil
+rss = psutil.Process().memory_info().rss
+heavy = json.loads(sys.argv[2])
+print(json.dumps({"seconds": seconds, "rss": rss, "heavy": [name for name in heavy if name in sys.modules]}))
+"""
+
+
+def probe(module):
+    # psutil itself is imported after the timing, so it's never reported as loaded by the module
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, module, json.dumps([name for name in HEAVY if name != "psutil"])],
+        cwd=SERVER_DIR, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    print("| module | import ms | RSS MB | heavy packages loaded |")
+    print("|---|---|---|---|")
+    for module in args.modules:
+        runs = [probe(module) for _ in range(args.repeat)]
+        seconds = statistics.median(run["seconds"] for run in runs)
+        rss = statistics.median(run["rss"] for run in runs)
+        print(f"| {module} | {seconds * 1000:.0f} | {rss / 1024 ** 2:.0f} | {', '.join(runs[0]['heavy']) or '-'} |")
+
+
+if __name__ == "__main__":
+    main()
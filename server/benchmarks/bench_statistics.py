@@ -0,0 +1,95 @@
+"""
+Paired bootstrap between engines: multinomial draws against resampled rows.
+
+Builds synthetic form codes for --rows source sentences and every engine,
+with different DKA rates that are correlated row by row like real
+translations of the same sentences. Then it times Statistics.bootstrap,
+which draws every resample as one multinomial over the form combinations,
+against the textbook loop that resamples row indices for every resample
+(in chunks, to bound memory). It checks that both give the same intervals
+up to Monte Carlo noise. The chi-square test is timed too.
+
+    cd server
+    python -m benchmarks.bench_statistics --rows 100000 --resamples 10000
+"""
+import argparse, time
+import numpy as np
+from pipelineQT import Statistics
+
+RATES = {"google": 0.40, "deepl": 0.41, "azure": 0.40, "opus": 0.45}
+
+
+def make_forms(rows, engines, seed=0):
+    rng = np.random.default_rng(seed)
+    # One latent per sentence shared by the engines, so their forms are correlated
+    latent = rng.random(rows)
+    forms = {}
+    for engine in engines:
+        noisy = np.clip(latent + rng.normal(0, 0.1, rows), 0, 1)
+        forms[engine] = np.where(noisy < RATES[engine], 0, np.where(rng.random(rows) < 0.02, 2, 1)).astype(np.int8)
+    return forms
+
+
+def index_bootstrap(forms, resamples, confidence=0.95, seed=42, chunk=100):
+    """The same intervals by resampling row indices, `chunk` resamples at a time."""
+    engines = list(forms)
+    has_form = np.stack([forms[engine] == 0 for engine in engines], axis=1).astype(np.float32)
+    rows = len(has_form)
+    rng = np.random.default_rng(seed)
+    samples = np.empty((resamples, len(engines)))
+    for start in range(0, resamples, chunk):
+        size = min(chunk, resamples - start)
+        indices = rng.integers(0, rows, size=(size, rows))
+        samples[start:start + size] = has_form[indices].mean(axis=1)
+    return np.quantile(samples, [(1 - confidence) / 2, (1 + confidence) / 2], axis=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--resamples", type=int, default=10000)
+    parser.add_argument("--engines", default="google,deepl,azure,opus")
+    parser.add_argument("--skip-index", action="store_true", help="only time the multinomial bootstrap")
+    args = parser.parse_args()
+
+    engines = args.engines.split(",")
+    forms = make_forms(args.rows, engines)
+
+    start = time.perf_counter()
+    result = Statistics.bootstrap(forms, resamples=args.resamples)
+    multinomial_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counts = {engine: dict(zip(Statistics.FORMS, np.bincount(codes, minlength=3).tolist()))
+              for engine, codes in forms.items()}
+    chi = Statistics.chi_square(counts)
+    chi_seconds = time.perf_counter() - start
+
+    print(f"{args.rows} rows x {len(engines)} engines, {args.resamples} resamples\n")
+    print("| method | seconds |")
+    print("|---|---|")
+    print(f"| multinomial bootstrap | {multinomial_seconds:.3f} |")
+    if not args.skip_index:
+        start = time.perf_counter()
+        low, high = index_bootstrap(forms, args.resamples)
+        index_seconds = time.perf_counter() - start
+        print(f"| index bootstrap | {index_seconds:.3f} |")
+    print(f"| chi-square | {chi_seconds:.4f} |")
+
+    print("\n| engine | DKA rate | multinomial interval | index interval |")
+    print("|---|---|---|---|")
+    for k, engine in enumerate(engines):
+        lo, hi = result["intervals"][engine]
+        index = "-" if args.skip_index else f"{low[k]:.4f} to {high[k]:.4f}"
+        print(f"| {engine} | {result['rates'][engine]:.4f} | {lo:.4f} to {hi:.4f} | {index} |")
+
+    print("\n| engines | difference | interval | p |")
+    print("|---|---|---|---|")
+    for pair, difference in result["differences"].items():
+        lo, hi = difference["interval"]
+        print(f"| {pair} | {difference['difference']:+.4f} | {lo:+.4f} to {hi:+.4f} | {difference['p_value']:.4f} |")
+    print(f"\nchi-square {chi['statistic']:.1f} (df {chi['df']}), p = {chi['p_value']:.3g}")
+
+
+if __name__ == "__main__":
+    main()
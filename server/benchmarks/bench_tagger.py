@@ -0,0 +1,207 @@
+"""
+Tagger throughput and accuracy against the hand-labeled datasets.
+
+Every tagging mode is run over every dataset, for every model tier given
+(md, lg, trf: see Tagger.TIERS), to pick a tier by speed and accuracy:
+- sentence: the model once per sentence (the /upload path)
+- pipe/N: nlp.pipe in batches of N (the /api/tag path)
+
+For each mode and dataset it reports sentences/sec, the p50/p99 latency
+per sentence and the peak RSS. The labeled datasets
+(datasets/labeled/*/*_labeled_*.csv) carry gold *_form columns, so for
+them it also reports accuracy and Cohen's kappa. Translated datasets
+have no gold labels; for them it reports agreement with the sentence
+mode. In pipe mode the latency is the time between consecutive
+sentences coming out of the pipe, so it also shows the batch
+boundaries.
+
+Every row is appended to --history. With --check, the run is compared
+to the last recorded run of the same model, rule version, mode and
+dataset. The exit status is 1 when accuracy dropped by more than
+--accuracy-tolerance or throughput dropped by more than
+--speed-tolerance. A run with regressions is not recorded, so the
+baseline stays the last good run. This catches a faster mode that tags
+worse before it ships.
+
+    cd server
+    python -m benchmarks.bench_tagger --batch-sizes 16 64 --check
+    python -m benchmarks.bench_tagger --tiers md trf --limit 500
+    python -m benchmarks.bench_tagger --translated ../datasets/translated/*/*_paws.csv
+"""
+import argparse, glob, json, os, sys, time
+from collections import Counter
+from pipelineQT.Tagger import Tagger
+from pipelineQT.Profiler import StageProfiler
+from pipelineQT.Schema import read_dataset
+
+LABELED = "../datasets/labeled/*/*_labeled_*.csv"
+HISTORY = "../cache/benchmarks/bench_tagger.jsonl"
+
+
+def load_sentences(path, limit=None):
+    """(sentences, gold forms or None) of a dataset: every *_form column with its text column, or every text column."""
+    df = read_dataset(path)
+    gold_columns = [column for column in df.columns if column.endswith("_form")]
+    if gold_columns:
+        pairs = [(column[:-len("_form")].replace("_", ""), column) for column in gold_columns]
+        sentences = [text for text_column, _ in pairs for text in df[text_column].tolist()]
+        gold = [int(form) for _, gold_column in pairs for form in df[gold_column].tolist()]
+    else:
+        # XL-Sum articles are tagged sentence by sentence, the summaries already are one
+        columns = [c for c in ("sentence1", "sentence2", "premise", "choice1", "choice2", "summary") if c in df.columns]
+        sentences = [text for column in columns for text in df[column].tolist()]
+        gold = None
+    return sentences[:limit], (gold[:limit] if gold is not None else None)
+
+
+def run_sentence(model, sentences):
+    nlp, _ = Tagger.load_model(model)
+    forms, latencies = [], []
+    for text in sentences:
+        start = time.perf_counter()
+        forms.append(Tagger._doc_form(nlp(text)) if isinstance(text, str) else 2)
+        latencies.append(time.perf_counter() - start)
+    return forms, latencies
+
+
+def run_pipe(model, sentences, batch_size):
+    nlp, _ = Tagger.load_model(model)
+    forms = [2] * len(sentences)
+    valid = [i for i, text in enumerate(sentences) if isinstance(text, str)]
+    latencies = []
+    last = time.perf_counter()
+    for i, doc in zip(valid, nlp.pipe((sentences[i] for i in valid), batch_size=batch_size)):
+        forms[i] = Tagger._doc_form(doc)
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+    return forms, latencies
+
+
+def agreement(forms, reference):
+    """Accuracy and Cohen's kappa of `forms` against `reference`."""
+    n = len(reference)
+    observed = sum(a == b for a, b in zip(forms, reference)) / n
+    predicted, actual = Counter(forms), Counter(reference)
+    expected = sum(predicted[label] * actual[label] for label in set(predicted) | set(actual)) / n ** 2
+    kappa = (observed - expected) / (1 - expected) if expected < 1 else 1.0
+    return observed, kappa
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def check(rows, history_path, accuracy_tolerance, speed_tolerance):
+    """Regressions of `rows` against the last recorded row with the same key."""
+    previous = {}
+    if os.path.exists(history_path):
+        with open(history_path, "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                previous[(row["model"], row["rules"], row["mode"], row["dataset"])] = row
+
+    regressions = []
+    for row in rows:
+        before = previous.get((row["model"], row["rules"], row["mode"], row["dataset"]))
+        if before is None:
+            continue
+        if row["accuracy"] is not None and before["accuracy"] is not None \
+                and row["accuracy"] < before["accuracy"] - accuracy_tolerance:
+            regressions.append(f"{row['mode']} {row['dataset']}: accuracy {before['accuracy']:.3f} -> {row['accuracy']:.3f}")
+        if row["sentences_per_sec"] < before["sentences_per_sec"] * (1 - speed_tolerance):
+            regressions.append(f"{row['mode']} {row['dataset']}: {before['sentences_per_sec']:.0f} -> "
+                               f"{row['sentences_per_sec']:.0f} sentences/sec")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labeled", nargs="*", default=sorted(glob.glob(LABELED)))
+    parser.add_argument("--translated", nargs="*", default=[])
+    parser.add_argument("--tiers", nargs="+", choices=list(Tagger.TIERS), default=list(Tagger.TIERS))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[64])
+    parser.add_argument("--limit", type=int, help="sentences per dataset")
+    parser.add_argument("--history", default=HISTORY)
+    parser.add_argument("--check", action="store_true", help="exit 1 on a regression against --history")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.005)
+    parser.add_argument("--speed-tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    datasets = [(path, *load_sentences(path, args.limit)) for path in args.labeled + args.translated]
+    modes = [("sentence", run_sentence)] + [
+        (f"pipe/{size}", lambda model, sentences, size=size: run_pipe(model, sentences, size))
+        for size in args.batch_sizes
+    ]
+
+    rows = []
+    for tier in args.tiers:
+        model = Tagger.model_of(tier)
+        start = time.perf_counter()
+        try:
+            Tagger.load_model(model)
+        except Exception as e:
+            print(f"Skipping {tier}, {model} did not load: {e}", file=sys.stderr)
+            continue
+        print(f"Loaded {model} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        for path, sentences, gold in datasets:
+            run_sentence(model, sentences[:16]) # warm up
+
+            reference = None
+            for mode, fn in modes:
+                # RSS only, tracemalloc would slow the tagging down
+                profiler = StageProfiler("bench_tagger", allocations=False)
+                with profiler.stage(mode, os.path.basename(path)):
+                    start = time.perf_counter()
+                    forms, latencies = fn(model, sentences)
+                    seconds = time.perf_counter() - start
+                memory = profiler.stages[0]
+
+                if mode == "sentence":
+                    reference = forms
+                accuracy, kappa = agreement(forms, gold) if gold is not None else (None, None)
+                rows.append({
+                    "time": time.time(),
+                    "tier": tier,
+                    "model": model,
+                    "rules": Tagger.RULE_VERSION,
+                    "mode": mode,
+                    "dataset": os.path.relpath(path),
+                    "sentences": len(sentences),
+                    "sentences_per_sec": len(sentences) / seconds,
+                    "p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+                    "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+                    "rss_peak_mb": memory["rss_peak"] / 1024 ** 2,
+                    "accuracy": accuracy,
+                    "kappa": kappa,
+                    "agreement_with_sentence": agreement(forms, reference)[0],
+                    "forms": dict(Counter(forms)),
+                })
+
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    print("| tier | model | mode | dataset | sentences | sentences/s | p50 ms | p99 ms | peak RSS MB | accuracy | kappa "
+          "| agreement with sentence |")
+    print("|---|---|---|---|---|---|---|---|---|---|---|---|")
+    for row in rows:
+        print(f"| {row['tier']} | {row['model']} | {row['mode']} | {row['dataset']} | {row['sentences']} "
+              f"| {row['sentences_per_sec']:.0f} | {fmt(row['p50_ms'], '.2f')} | {fmt(row['p99_ms'], '.2f')} "
+              f"| {row['rss_peak_mb']:.0f} | {fmt(row['accuracy'], '.3f')} | {fmt(row['kappa'], '.3f')} "
+              f"| {row['agreement_with_sentence']:.3f} |")
+
+    regressions = check(rows, args.history, args.accuracy_tolerance, args.speed_tolerance) if args.check else []
+    if regressions:
+        print("\nRegressions:\n" + "\n".join(regressions))
+        sys.exit(1)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Load test of the Flask dev server against the pre-forked gunicorn setup.
+
+Each server is started from server/, warmed up, then hit by `--clients`
+concurrent clients for `--seconds`. The table reports requests/sec,
+latency percentiles and the memory of every serving process: RSS, and USS
+(memory only that process holds). With the models loaded before forking,
+gunicorn workers show a large RSS but a small USS since they share the
+model pages with the master.
+
+    cd server
+    python -m benchmarks.load_test --path /quantify --workers 4 --threads 8
+    python -m benchmarks.load_test --upload ../translated_data_10/google_translated_bcopa.csv
+"""
+import argparse, os, socket, subprocess, sys, threading, time
+import psutil
+import requests
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, workers, threads):
+    env = {**os.environ, "QT_BIND": f"127.0.0.1:{port}", "QT_WORKERS": str(workers), "QT_THREADS": str(threads)}
+    if mode == "dev":
+        command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port)]
+    else:
+        command = [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "wsgi:app"]
+    return subprocess.Popen(command, cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(base_url, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=5).status_code == 200:
+                return
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{base_url} did not come up in {timeout}s")
+
+
+def make_request(session, base_url, args):
+    if args.upload:
+        with open(args.upload, "rb") as f:
+            files = {"file": (os.path.basename(args.upload), f)}
+            return session.post(base_url + "/upload", files=files, headers={"Accept": "application/json"})
+    return session.get(base_url + args.path)
+
+
+def run_load(base_url, args):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+
+    def client():
+        nonlocal errors
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            response = make_request(session, base_url, args)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code < 400:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    clients = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / args.seconds,
+        "p50": latencies[len(latencies) // 2] * 1000 if latencies else float("nan"),
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+def serving_memory(pid):
+    """(RSS, USS) in MB of every process serving requests, the gunicorn master excluded."""
+    parent = psutil.Process(pid)
+    processes = parent.children(recursive=True) or [parent]
+    memory = []
+    for process in processes:
+        info = process.memory_full_info()
+        memory.append((info.rss / 1024 ** 2, info.uss / 1024 ** 2))
+    return memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="dev,gunicorn")
+    parser.add_argument("--path", default="/quantify", help="GET this path on every request")
+    parser.add_argument("--upload", help="POST this CSV to /upload on every request instead")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    rows = []
+    for mode in args.modes.split(","):
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = start_server(mode, port, args.workers, args.threads)
+        try:
+            wait_ready(base_url)
+            make_request(requests.Session(), base_url, args) # warm up (and fill the result cache)
+            stats = run_load(base_url, args)
+            memory = serving_memory(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+
+        rss = sum(m[0] for m in memory) / len(memory)
+        uss = sum(m[1] for m in memory) / len(memory)
+        rows.append((mode, len(memory), stats, rss, uss, sum(m[0] for m in memory)))
+
+    print("| server | processes | req/s | p50 ms | p99 ms | errors | RSS/process MB | USS/process MB | total RSS MB |")
+    print("|---|---|---|---|---|---|---|---|---|")
+    for mode, processes, stats, rss, uss, total in rows:
+        print(f"| {mode} | {processes} | {stats['rps']:.1f} | {stats['p50']:.1f} | {stats['p99']:.1f} "
+              f"| {stats['errors']} | {rss:.0f} | {uss:.0f} | {total:.0f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Production serving, see wsgi.py. Every setting can be overridden with the QT_* variables.
+import os, sys, glob, multiprocessing
+
+chdir = os.path.dirname(os.path.abspath(__file__)) # the app uses paths relative to server/
+bind = os.environ.get("QT_BIND", "0.0.0.0:8000")
+
+# Pre-forked workers sharing the models loaded by the master
+preload_app = True
+workers = int(os.environ.get("QT_WORKERS", min(4, multiprocessing.cpu_count())))
+
+# Threads per worker. Live progress streams hold a thread each while they are open
+worker_class = "gthread"
+threads = int(os.environ.get("QT_THREADS", 8))
+
+# Compute threads per worker (torch, thinc, BLAS). Each library defaults to every core, so
+# QT_WORKERS workers tagging at once would run that many times more threads than cores.
+# Set before the app is preloaded so libraries reading them at import see them, and
+# applied again to torch in every worker (post_fork).
+compute_threads = int(os.environ.get("QT_COMPUTE_THREADS", max(1, multiprocessing.cpu_count() // workers)))
+for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ[variable] = str(compute_threads)
+
+# Pipeline work runs in the job queue, requests themselves stay short
+timeout = int(os.environ.get("QT_TIMEOUT", 120))
+graceful_timeout = 30
+accesslog = "-"
+
+# Workers write their metrics here and /metrics merges them (see pipelineQT/Metrics.py).
+# Set up before the app, and so prometheus_client, is preloaded by the master. Values
+# left by an earlier run would be added to this one's, so remove them. Only the *.db files
+# prometheus_client writes: the directory may be one the operator exported for other uses too.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(chdir, "..", "cache", "metrics"))
+os.makedirs(metrics_dir, exist_ok=True)
+for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+    os.remove(path)
+
+
+def post_fork(server, worker):
+    # Jobs of a worker that died are not picked up by anyone, fail them
+    from app import job_queue
+    job_queue.fail_orphans()
+
+    # torch may have sized its pool in the master, cap it for this worker. A torch
+    # imported later in the worker reads OMP_NUM_THREADS instead
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(compute_threads)
+
+
+def child_exit(server, worker):
+    # Drop the live gauges (queue depths) of the dead worker, its counters are kept
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,134 @@
+import os, shutil, hashlib, tempfile
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.utils import secure_filename
+
+MAX_FILE_BYTES = 200 * 1024 ** 2 # per uploaded file
+SPOOL_BYTES = 8 * 1024 ** 2 # uploads up to this size never touch the disk
+ALLOWED_EXTENSIONS = {".csv"}
+STORE_MAX_BYTES = 1024 ** 3 # stored uploads kept per folder, least recently uploaded removed first
+
+
+class IngestedFile(tempfile.SpooledTemporaryFile):
+    """
+        Upload buffer that hashes and validates the bytes while werkzeug receives them.
+
+        Small files stay in memory, larger ones roll over to an anonymous
+        temporary file. A buffer handed to a job with `keep()` survives the
+        end of the request and is closed by `release()`.
+    """
+
+    def __init__(self, max_bytes=MAX_FILE_BYTES, spool_bytes=SPOOL_BYTES):
+        super().__init__(max_size=spool_bytes)
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.filename = None
+        self.kept = False
+
+    def write(self, data):
+        if self.size == 0 and b"\x00" in data[:1024]:
+            raise UnsupportedMediaType("Uploads must be text (CSV) files.")
+
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"Uploaded files are limited to {self.max_bytes // 1024 ** 2}MB each.")
+
+        self.digest.update(data)
+        return super().write(data)
+
+    @property
+    def sha256(self):
+        return self.digest.hexdigest()
+
+    def keep(self):
+        self.kept = True
+        return self
+
+    def close(self):
+        if not self.kept:
+            super().close()
+
+    def release(self):
+        self.kept = False
+        self.close()
+
+
+class IngestRequest(Request):
+    """Flask request whose uploaded files are received into IngestedFile buffers."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IngestedFile()
+
+
+def _evict(store_dir, max_bytes):
+    """Remove the least recently uploaded files of `store_dir` until it holds at most `max_bytes`."""
+    stored = []
+    for entry in os.scandir(store_dir):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            stored.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in stored)
+    for _, size, path in sorted(stored):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another server process evicted it first
+            pass
+        total -= size
+
+
+def ingest(files, store_dir, max_bytes=STORE_MAX_BYTES):
+    """
+        Validate the uploaded `files` and keep their buffers for the pipeline.
+
+        Every file is also stored once under its content address
+        (<sha256>.csv in `store_dir`), so identical or same-named uploads never
+        overwrite each other. The folder is kept under `max_bytes`, dropping
+        the least recently uploaded files: the jobs read the buffers, the
+        stored copies are only a record. Returns {dataset key: IngestedFile},
+        the key being the last "_" token of the original filename
+        (google_paws.csv -> paws).
+    """
+    uploads = {}
+    for file in files:
+        # Check if user submitted an empty part
+        if file.filename == '':
+            continue
+
+        filename = secure_filename(file.filename)
+        name, ext = os.path.splitext(filename)
+        if ext.lower() not in ALLOWED_EXTENSIONS:
+            raise UnsupportedMediaType(f"{filename}: only {', '.join(sorted(ALLOWED_EXTENSIONS))} files are accepted.")
+
+        buffer = file.stream
+        buffer.filename = filename
+        buffer.seek(0)
+
+        stored_path = os.path.join(store_dir, f"{buffer.sha256}{ext.lower()}")
+        if not os.path.exists(stored_path):
+            fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(buffer, f)
+            os.replace(tmp_path, stored_path)
+            buffer.seek(0)
+        else:
+            # Uploaded again, the least recently uploaded files go first
+            os.utime(stored_path)
+        print(f"Received: {filename} ({buffer.size} bytes, sha256 {buffer.sha256[:12]})")
+
+        key = name.split("_")[-1]
+        if key in uploads:
+            uploads[key].release()
+        uploads[key] = buffer.keep()
+
+    _evict(store_dir, max_bytes)
+    return uploads
+
+
+def release(uploads):
+    for buffer in uploads.values():
+        buffer.release()
@@ -0,0 +1,176 @@
+import os, json, time, uuid, sqlite3, threading, traceback
+from concurrent.futures import ThreadPoolExecutor
+from pipelineQT import Metrics
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFullError(Exception):
+    """Raise when a job is submitted while `max_pending` jobs are already waiting"""
+    pass
+
+
+class JobQueue:
+    """
+        Runs pipeline jobs on a bounded worker pool, off the request thread.
+
+        Job state (queued/running/done/failed, timestamps, error and the JSON
+        result) lives in a SQLite file so it survives restarts and can be
+        read by every server process. Jobs that were queued or running in a
+        process that no longer exists are marked as failed on startup.
+        `on_finish(job_id, status)` is called after every job, e.g. to close
+        its progress channel.
+
+        The latest progress event of every stage of a running job is kept
+        in the same file (record_progress, a ProgressBus sink), so a server
+        process other than the one running the job can stream it too.
+    """
+
+    PROGRESS_INTERVAL = 0.5 # Seconds between writes of the progress of one stage
+
+    def __init__(self, db_path="../cache/jobs.sqlite3", max_workers=2, max_pending=32, on_finish=None):
+        self.db_path = db_path
+        self.on_finish = on_finish
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.progress_written = {} # (job id, stage) -> time of the last write
+        self.depth_gauge = Metrics.QUEUE_DEPTH.labels(queue="jobs")
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    error TEXT,
+                    result TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS progress (
+                    job_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    updated REAL NOT NULL,
+                    event TEXT NOT NULL,
+                    PRIMARY KEY (job_id, stage)
+                )
+            """)
+        self.fail_orphans()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _update(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def fail_orphans(self):
+        """Mark jobs whose process is gone (restart, crashed worker) as failed."""
+        import psutil
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, pid FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+        for row in rows:
+            if row["pid"] == os.getpid() or not psutil.pid_exists(row["pid"]):
+                self._update(row["id"], status=FAILED, finished=time.time(), error="Interrupted by a server restart")
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """Queue `fn(job_id, *args, **kwargs)` and return the job id at once."""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise QueueFullError(f"{self.pending} jobs are already waiting, try again later.")
+            self.pending += 1
+        self.depth_gauge.inc()
+
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, pid, created) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, os.getpid(), time.time()),
+            )
+
+        self.pool.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=RUNNING, started=time.time())
+        status = FAILED
+        try:
+            result = fn(job_id, *args, **kwargs)
+            self._update(job_id, status=DONE, finished=time.time(), result=json.dumps(result))
+            status = DONE
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status=FAILED, finished=time.time(), error=f"{type(e).__name__}: {e}")
+        finally:
+            with self.lock:
+                self.pending -= 1
+            self.depth_gauge.dec()
+            # Late subscribers only need the status from here on
+            with self._connect() as conn:
+                conn.execute("DELETE FROM progress WHERE job_id = ?", (job_id,))
+            with self.lock:
+                for key in [key for key in self.progress_written if key[0] == job_id]:
+                    del self.progress_written[key]
+            if self.on_finish is not None:
+                self.on_finish(job_id, status)
+
+    def record_progress(self, job_id, event):
+        """Keep the latest progress event of a stage, at most every PROGRESS_INTERVAL seconds."""
+        if job_id is None or event.get("type") != "progress":
+            return
+        key = (job_id, event["stage"])
+        now = time.time()
+        finished = event.get("total") and event["n"] >= event["total"]
+        with self.lock:
+            if not finished and now - self.progress_written.get(key, 0) < JobQueue.PROGRESS_INTERVAL:
+                return
+            self.progress_written[key] = now
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO progress (job_id, stage, updated, event) VALUES (?, ?, ?, ?)",
+                    (job_id, event["stage"], now, json.dumps(event)),
+                )
+        except sqlite3.Error:
+            # Progress is best effort, never fail the job over it
+            traceback.print_exc()
+
+    def progress(self, job_id, since=0.0):
+        """[(updated, event)] of the stages of `job_id` that changed after `since`, oldest first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT updated, event FROM progress WHERE job_id = ? AND updated > ? ORDER BY updated",
+                (job_id, since),
+            ).fetchall()
+        return [(row["updated"], json.loads(row["event"])) for row in rows]
+
+    def get(self, job_id):
+        """The job as a dict, or None if the id is unknown."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def depth(self):
+        """Jobs waiting for or running on a worker in this process."""
+        with self.lock:
+            return self.pending
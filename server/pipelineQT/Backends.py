@@ -0,0 +1,356 @@
+import os, csv, json, codecs, random
+import numpy as np
+import psutil
+
+# How each raw dataset is cleaned, independent of the dataframe library:
+# - rows outside [min_len, max_len] characters in any of `length_columns` are dropped
+# - `samples` maps the config keys to the `label_column` value they sample (None = whole dataset)
+# - `columns` is the list of columns written, an int keeps the first n source columns
+# - `sampler` draws the sampled rows (see sample_positions), `sample_at_most` takes the
+#   whole group when it has fewer rows than asked instead of raising
+SPECS = {
+    "paws": {
+        "name": "PAWS",
+        "extension": "csv",
+        "length_columns": ["sentence1", "sentence2"],
+        "min_len": 21,
+        "max_len": 1999,
+        "label_column": "label",
+        "samples": {"true_sample": 1, "false_sample": 0},
+        "columns": 4,
+    },
+    "bcopa": {
+        "name": "Balanced COPA",
+        "extension": "csv",
+        "length_columns": ["premise", "choice1", "choice2"],
+        "min_len": 21,
+        "max_len": 1999,
+        "label_column": "question",
+        "samples": {"cause_sample": "cause", "effect_sample": "effect"},
+        "columns": 7,
+    },
+    "xnli": {
+        "name": "XNLI",
+        "extension": "tsv",
+        "where": {"language": "en"},
+        "length_columns": ["sentence1", "sentence2"],
+        "min_len": 21,
+        "max_len": 1999,
+        "label_column": "gold_label",
+        "samples": {
+            "neutral_sample": "neutral",
+            "contradiction_sample": "contradiction",
+            "entailment_sample": "entailment",
+        },
+        "columns": ["gold_label", "sentence1", "sentence2"],
+    },
+    "xlsum": {
+        "name": "XL-Sum",
+        "extension": "jsonl",
+        "length_columns": ["text", "summary"],
+        "min_len": 20,
+        "max_len": 2000,
+        "label_column": None,
+        "samples": {"pairs_sample": None},
+        "columns": None,
+        # The same rows the original polars cleaner sampled
+        "sampler": "polars",
+        "sample_at_most": True,
+    },
+}
+
+
+def _sample_plan(spec, config):
+    """[(label value, n)] in the order the samples are concatenated."""
+    return [(label, int(config.get(sample_key) or 0)) for sample_key, label in spec["samples"].items()]
+
+
+def _sample_size(spec, size, n):
+    """n, or the whole group for specs that sample at most n. Raises when a group is too small otherwise."""
+    if n > size:
+        if not spec.get("sample_at_most"):
+            raise ValueError(f"Cannot take a sample of {n} rows from the {size} {spec['name']} rows left "
+                             f"after filtering")
+        return size
+    return n
+
+
+def sample_positions(spec, size, n, seed):
+    """
+        Positions of the n rows sampled from a group of `size` filtered rows, in source order.
+
+        Every file backend takes these same positions, so a seed gives the
+        same cleaned dataset whichever backend runs. The default sampler is
+        pandas' DataFrame.sample(n, random_state=seed), the XL-Sum one is
+        polars' DataFrame.sample(n, seed=seed), the samplers of the
+        original cleaners.
+    """
+    n = _sample_size(spec, size, n)
+    if spec.get("sampler") == "polars":
+        import polars as pl
+        return pl.Series(range(size)).sample(n=n, seed=seed).to_numpy()
+    return np.random.RandomState(seed).choice(size, size=n, replace=False)
+
+
+def _output_columns(spec, source_columns):
+    columns = spec["columns"]
+    if columns is None:
+        return list(source_columns)
+    if isinstance(columns, int):
+        return list(source_columns)[:columns]
+    return columns
+
+
+class PandasBackend:
+    """Eager in-memory cleaning, fastest for the small CSVs."""
+
+    name = "pandas"
+
+    def clean(self, spec, source_path, destination_path, config, seed):
+        import pandas as pd
+        from .Schema import read_dataset
+
+        df = read_dataset(
+            source_path,
+            sep="\t" if spec["extension"] == "tsv" else ",",
+            lines=spec["extension"] == "jsonl",
+        )
+        source_columns = df.columns
+
+        for column, value in spec.get("where", {}).items():
+            df = df[df[column] == value]
+
+        mask = pd.Series(True, index=df.index)
+        for column in spec["length_columns"]:
+            # Missing text has no length, fill it so it is filtered out
+            mask &= df[column].str.len().fillna(0).between(spec["min_len"], spec["max_len"])
+        df = df[mask]
+
+        parts = []
+        for label, n in _sample_plan(spec, config):
+            group = df if label is None else df[df[spec["label_column"]] == label]
+            parts.append(group.iloc[sample_positions(spec, len(group), n, seed)])
+
+        df_result = pd.concat(parts, ignore_index=True)
+        df_result[_output_columns(spec, source_columns)].to_csv(destination_path, index=False)
+        return len(df_result)
+
+
+class PolarsBackend:
+    """Multi-threaded columnar cleaning, for files too big for pandas to handle comfortably."""
+
+    name = "polars"
+
+    def clean(self, spec, source_path, destination_path, config, seed):
+        import polars as pl
+
+        if spec["extension"] == "jsonl":
+            # Robustly read NDJSON (newline-delimited) first, fallback to JSON array
+            try:
+                df = pl.read_ndjson(source_path)
+            except Exception:
+                df = pl.read_json(source_path)
+        else:
+            df = pl.read_csv(
+                source_path,
+                separator="\t" if spec["extension"] == "tsv" else ",",
+                infer_schema_length=10000,
+            )
+        source_columns = df.columns
+
+        for column, value in spec.get("where", {}).items():
+            df = df.filter(pl.col(column) == value)
+
+        for column in spec["length_columns"]:
+            # str.lengths was renamed to str.len_chars in newer polars
+            str_ns = pl.col(column).str
+            length = str_ns.len_chars() if hasattr(str_ns, "len_chars") else str_ns.lengths()
+            df = df.filter(length.is_between(spec["min_len"], spec["max_len"]))
+
+        parts = []
+        for label, n in _sample_plan(spec, config):
+            group = df if label is None else df.filter(pl.col(spec["label_column"]) == label)
+            parts.append(group[sample_positions(spec, group.height, n, seed).tolist()])
+
+        df_result = pl.concat(parts)
+        df_result.select(_output_columns(spec, source_columns)).write_csv(destination_path)
+        return df_result.height
+
+
+class SparkBackend:
+    """Local-mode Spark, spills to disk so it handles files larger than memory."""
+
+    name = "spark"
+
+    def __init__(self, get_spark):
+        self.get_spark = get_spark
+
+    def clean(self, spec, source_path, destination_path, config, seed):
+        import pyspark.sql.functions as F
+
+        spark = self.get_spark()
+        if spec["extension"] == "jsonl":
+            df = spark.read.json(source_path)
+        else:
+            df = spark.read.csv(
+                source_path,
+                header=True,
+                sep="\t" if spec["extension"] == "tsv" else ",",
+                multiLine=True,
+                escape='"',
+                inferSchema=True,
+            )
+        source_columns = df.columns
+
+        for column, value in spec.get("where", {}).items():
+            df = df.filter(F.col(column) == value)
+
+        for column in spec["length_columns"]:
+            df = df.filter(F.length(column).between(spec["min_len"], spec["max_len"]))
+
+        df = df.cache()
+        parts = []
+        for label, n in _sample_plan(spec, config):
+            group = df if label is None else df.filter(F.col(spec["label_column"]) == label)
+            parts.append(self._sample(spec, group, n, seed))
+        df.unpersist()
+
+        import pandas as pd
+        df_result = pd.concat(parts, ignore_index=True)
+        df_result[_output_columns(spec, source_columns)].to_csv(destination_path, index=False)
+        return len(df_result)
+
+    def _sample(self, spec, df, n, seed):
+        """
+            The rows at sample_positions, without a global sort.
+
+            zipWithIndex numbers the rows in source order (partition by
+            partition), only the n wanted ones are collected.
+        """
+        import pandas as pd
+
+        positions = sample_positions(spec, df.count(), n, seed).tolist()
+        rank = {position: i for i, position in enumerate(positions)}
+        wanted = df.rdd.context.broadcast(rank)
+        rows = df.rdd.zipWithIndex().filter(lambda row: row[1] in wanted.value).collect()
+        rows.sort(key=lambda row: rank[row[1]])
+        return pd.DataFrame([row.asDict() for row, _ in rows], columns=df.columns)
+
+
+class StreamBackend:
+    """
+        Row-at-a-time cleaning of text lines (CSV, TSV or NDJSON).
+
+        Rows are filtered as they are parsed and kept with per-label
+        reservoir sampling, so memory holds only the samples and the raw
+        file never has to exist on disk. The group sizes are only known at
+        the end, so it cannot take sample_positions: for the same seed it
+        samples other rows than the file backends. A group smaller than its
+        sample raises the same ValueError as they do.
+    """
+
+    name = "stream"
+
+    @staticmethod
+    def iter_lines(chunks, encoding="utf-8"):
+        """Turn an iterable of byte chunks (e.g. response.iter_content) into text lines."""
+        decoder = codecs.getincrementaldecoder(encoding)()
+        pending = ""
+        for chunk in chunks:
+            pending += decoder.decode(chunk)
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                yield line + "\n"
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield pending
+
+    @staticmethod
+    def iter_rows(spec, lines):
+        if spec["extension"] == "jsonl":
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(lines, delimiter="\t" if spec["extension"] == "tsv" else ",")
+
+    @staticmethod
+    def _keep(spec, row):
+        for column, value in spec.get("where", {}).items():
+            if row.get(column) != value:
+                return False
+        for column in spec["length_columns"]:
+            text = row.get(column)
+            length = len(text) if isinstance(text, str) else 0
+            if not spec["min_len"] <= length <= spec["max_len"]:
+                return False
+        return True
+
+    def clean(self, spec, lines, destination_path, config, seed):
+        plan = _sample_plan(spec, config)
+        # Labels are compared as text since CSV values are not typed
+        reservoirs = {None if label is None else str(label): [] for label, _ in plan}
+        sizes = {None if label is None else str(label): n for label, n in plan}
+        seen = dict.fromkeys(reservoirs, 0)
+        rng = random.Random(seed)
+
+        source_columns = None
+        for row in self.iter_rows(spec, lines):
+            if source_columns is None:
+                source_columns = list(row.keys())
+            if not self._keep(spec, row):
+                continue
+
+            label = None if spec["label_column"] is None else str(row.get(spec["label_column"]))
+            if label not in reservoirs:
+                continue
+
+            # Algorithm R: the i-th matching row replaces a kept one with probability n / i
+            seen[label] += 1
+            reservoir = reservoirs[label]
+            if len(reservoir) < sizes[label]:
+                reservoir.append(row)
+            else:
+                j = rng.randrange(seen[label])
+                if j < sizes[label]:
+                    reservoir[j] = row
+
+        for label in reservoirs:
+            _sample_size(spec, seen[label], sizes[label])
+
+        columns = _output_columns(spec, source_columns or [])
+        rows = 0
+        with open(destination_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            for reservoir in reservoirs.values():
+                writer.writerows(reservoir)
+                rows += len(reservoir)
+        return rows
+
+
+# Rough peak memory of a backend relative to the file size on disk
+MEMORY_FACTOR = {"pandas": 6, "polars": 3}
+PANDAS_MAX_BYTES = 200 * 1024 ** 2 # above this polars is faster even when pandas fits
+
+
+def select_backend(source_path, override=None):
+    """
+        Pick a backend name for `source_path`.
+
+        pandas for small files, polars while the file fits in the available
+        memory, local-mode Spark beyond that. `override` wins when given.
+    """
+    if override:
+        if override not in MEMORY_FACTOR and override != "spark":
+            raise ValueError(f"Unknown backend: {override}. Accepted: 'pandas', 'polars', 'spark'")
+        return override
+
+    size = os.path.getsize(source_path)
+    available = psutil.virtual_memory().available
+
+    if size <= PANDAS_MAX_BYTES and size * MEMORY_FACTOR["pandas"] < available:
+        return "pandas"
+    if size * MEMORY_FACTOR["polars"] < available:
+        return "polars"
+    return "spark"
@@ -0,0 +1,124 @@
+import time, queue, threading
+from collections import Counter, deque
+from concurrent.futures import Future
+from . import Metrics
+
+
+class MicroBatcher:
+    """
+        Groups items from concurrent callers into batches for one function.
+
+        The first queued item opens a batch; it is run once `max_batch_size`
+        items are collected or `max_wait` seconds have passed, whichever comes
+        first. `fn` takes a list of items and returns their results in order.
+        Latency per call and the batch sizes are kept for stats(), the items
+        waiting are reported as the `name` queue depth metric.
+    """
+
+    def __init__(self, fn, max_batch_size=64, max_wait=0.005, window=10000, name="batcher"):
+        self.fn = fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window) # seconds, last `window` calls
+        self.batch_sizes = Counter()
+        self.depth_gauge = Metrics.QUEUE_DEPTH.labels(queue=name)
+
+        # Started on first use, threads don't survive a fork
+        self.thread = None
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self.thread.start()
+
+    def submit(self, items):
+        """Queue `items`, returns a Future with the list of their results."""
+        future = Future()
+        if not items:
+            future.set_result([])
+            return future
+
+        call = {
+            "future": future,
+            "results": [None] * len(items),
+            "remaining": len(items),
+            "start": time.perf_counter(),
+        }
+        self._ensure_started()
+        self.depth_gauge.inc(len(items))
+        for index, item in enumerate(items):
+            self.queue.put((call, index, item))
+        return future
+
+    def __call__(self, items, timeout=None):
+        return self.submit(items).result(timeout)
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        self.depth_gauge.dec(len(batch))
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.fn([item for _, _, item in batch])
+            except Exception as e:
+                for call, _, _ in batch:
+                    if not call["future"].done():
+                        call["future"].set_exception(e)
+                continue
+
+            finished = []
+            for (call, index, _), result in zip(batch, results):
+                call["results"][index] = result
+                call["remaining"] -= 1
+                if call["remaining"] == 0:
+                    finished.append(call)
+
+            now = time.perf_counter()
+            with self.lock:
+                self.batch_sizes[len(batch)] += 1
+                self.latencies.extend(now - call["start"] for call in finished)
+            for call in finished:
+                if not call["future"].done():
+                    call["future"].set_result(call["results"])
+
+    def stats(self):
+        """Latency percentiles of recent calls and a histogram of batch sizes (power of two buckets)."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            batch_sizes = dict(self.batch_sizes)
+
+        histogram = Counter()
+        for size, count in batch_sizes.items():
+            histogram[1 << (size - 1).bit_length()] += count
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000 if latencies else None
+
+        batches = sum(batch_sizes.values())
+        return {
+            "calls": len(latencies),
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+            "batches": batches,
+            "mean_batch_size": sum(size * count for size, count in batch_sizes.items()) / batches if batches else None,
+            "batch_size_histogram": [{"le": bucket, "count": histogram[bucket]} for bucket in sorted(histogram)],
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -0,0 +1,408 @@
+import os, json, time, shutil, hashlib, tempfile, threading, contextlib
+import requests
+from collections import OrderedDict
+from filelock import FileLock
+from .Errors import OfflineError
+from . import Metrics
+
+
+class ArtifactCache:
+    """
+        Disk cache for pipeline artifacts (e.g. the cleaned_*.csv files).
+
+        Entries are keyed by a hash of their inputs (source fingerprint,
+        normalized config, seed, ...). A manifest.json inside the cache
+        directory maps every key to its inputs and output files, and the
+        least recently used entries are evicted once the cache grows past
+        `max_bytes`.
+    """
+
+    MANIFEST = "manifest.json"
+    BLOCK_SIZE = 1024 * 1024 # 1MB chunks when hashing
+
+    def __init__(self, cache_dir="../cache/artifacts/", max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Label of the hit/miss metrics, e.g. "artifacts" or "results"
+        self.name = os.path.basename(os.path.normpath(cache_dir))
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        self.manifest_path = os.path.join(self.cache_dir, ArtifactCache.MANIFEST)
+        self.lock = FileLock(self.manifest_path + ".lock")
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"entries": {}, "fingerprints": {}}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+    def fingerprint(self, path):
+        """sha256 of the file content, memoized on (size, mtime) so unchanged files are hashed once."""
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+
+        with self.lock:
+            known = self._load_manifest()["fingerprints"].get(abs_path)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(ArtifactCache.BLOCK_SIZE), b""):
+                digest.update(block)
+
+        with self.lock:
+            manifest = self._load_manifest()
+            manifest["fingerprints"][abs_path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": digest.hexdigest(),
+            }
+            self._save_manifest(manifest)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(**inputs):
+        """Stable key for a set of JSON-serializable inputs."""
+        payload = json.dumps(inputs, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return {filename: cached path} for `key`, or None on a miss."""
+        with self.lock:
+            manifest = self._load_manifest()
+            entry = manifest["entries"].get(key)
+            if entry is None:
+                Metrics.cache_lookup(self.name, hit=False)
+                return None
+
+            entry_dir = os.path.join(self.cache_dir, key)
+            paths = {name: os.path.join(entry_dir, name) for name in entry["outputs"]}
+            if not all(os.path.exists(path) for path in paths.values()):
+                # Someone removed the files behind our back, forget the entry
+                del manifest["entries"][key]
+                self._save_manifest(manifest)
+                Metrics.cache_lookup(self.name, hit=False)
+                return None
+
+            entry["last_used"] = time.time()
+            self._save_manifest(manifest)
+
+        Metrics.cache_lookup(self.name, hit=True)
+        return paths
+
+    def put(self, key, inputs, *paths):
+        """Copy `paths` into the cache under `key` and evict old entries if needed."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        outputs = []
+        size = 0
+        for path in paths:
+            name = os.path.basename(path)
+            shutil.copyfile(path, os.path.join(entry_dir, name))
+            outputs.append(name)
+            size += os.path.getsize(path)
+
+        with self.lock:
+            manifest = self._load_manifest()
+            now = time.time()
+            manifest["entries"][key] = {
+                "inputs": inputs,
+                "outputs": outputs,
+                "size": size,
+                "created": now,
+                "last_used": now,
+            }
+            self._evict(manifest, keep=key)
+            self._save_manifest(manifest)
+
+    def _evict(self, manifest, keep=None):
+        entries = manifest["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+
+        # Least recently used first
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entries[key]["size"]
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            del entries[key]
+
+    def restore(self, key, destination_dir):
+        """Copy a cached entry into `destination_dir`. Returns the restored paths or None on a miss."""
+        paths = self.get(key)
+        if paths is None:
+            return None
+
+        restored = []
+        for name, path in paths.items():
+            destination_path = os.path.join(destination_dir, name)
+            # Replace rather than overwrite, the old file may be hard-linked elsewhere
+            tmp_path = destination_path + ".tmp"
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, destination_path)
+            restored.append(destination_path)
+        return restored
+
+
+class DatasetCache:
+    """
+        Shared local cache of downloaded datasets.
+
+        Files are stored once by content address (objects/<sha256>) and
+        hard-linked into every `local_path` that asks for them, or copied
+        with `link=False` when the caller may later write to that path (a
+        write through a link would change the object for every path). index.json
+        remembers the ETag/Last-Modified of every URL so a cached copy is
+        revalidated with a conditional request instead of downloaded again,
+        and copies younger than `max_age` seconds are used without asking the
+        server at all. With `offline=True` only cached files are served.
+    """
+
+    INDEX = "index.json"
+
+    def __init__(self, cache_dir="../cache/datasets/", max_age=3600, timeout=30):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.timeout = timeout
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        self.staging_dir = os.path.join(self.cache_dir, "staging")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+        self.index_path = os.path.join(self.cache_dir, DatasetCache.INDEX)
+        self.lock = FileLock(self.index_path + ".lock")
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_index(self, index):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+    def _object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256)
+
+    def _cached(self, url):
+        with self.lock:
+            entry = self._load_index().get(url)
+        if entry and os.path.exists(self._object_path(entry["sha256"])):
+            return entry
+        return None
+
+    def _is_fresh(self, url, entry, session):
+        """True when the cached copy of `url` can be used as is."""
+        if time.time() - entry["validated"] < self.max_age:
+            return True
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        if not headers:
+            return False
+
+        try:
+            response = session.head(url, headers=headers, allow_redirects=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            # Cannot revalidate, the cached copy is still better than failing the dataset
+            print(f"Could not revalidate {url} ({e}), using the cached copy.")
+            return True
+        if response.status_code != 304:
+            return False
+
+        with self.lock:
+            index = self._load_index()
+            index[url]["validated"] = time.time()
+            self._save_index(index)
+        return True
+
+    def _link(self, sha256, local_path, link=True):
+        """Hard link the cached object to `local_path`, copying when links are not possible or `link` is off."""
+        object_path = self._object_path(sha256)
+        if os.path.exists(local_path):
+            if link and os.path.samefile(object_path, local_path):
+                return
+            os.remove(local_path)
+        if link:
+            try:
+                os.link(object_path, local_path)
+                return
+            except OSError:
+                # Different filesystem or no hard link support
+                pass
+        tmp_path = local_path + ".tmp"
+        shutil.copyfile(object_path, tmp_path)
+        os.replace(tmp_path, local_path)
+
+    def _store(self, url, staged_path, headers):
+        digest = hashlib.sha256()
+        with open(staged_path, "rb") as f:
+            for block in iter(lambda: f.read(ArtifactCache.BLOCK_SIZE), b""):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+
+        object_path = self._object_path(sha256)
+        if os.path.exists(object_path):
+            os.remove(staged_path)
+        else:
+            os.replace(staged_path, object_path)
+
+        with self.lock:
+            index = self._load_index()
+            index[url] = {
+                "sha256": sha256,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "size": os.path.getsize(object_path),
+                "validated": time.time(),
+            }
+            self._save_index(index)
+        return sha256
+
+    def fetch_all(self, downloader, *jobs, offline=False, link=True):
+        """
+            Make every (url, local_path) pair available, downloading only what changed.
+
+            `downloader` is the DownloadManager used for the actual transfers.
+            Pass `link=False` when a local_path may be written to later.
+            Returns {local_path: None or the exception that stopped it}.
+        """
+        results = {}
+        to_download = []
+        checked = time.time()
+        for url, local_path in jobs:
+            entry = self._cached(url)
+            try:
+                if offline:
+                    if entry is None:
+                        raise OfflineError(f"{url} is not in the dataset cache and offline mode is on.")
+                elif entry is None or not self._is_fresh(url, entry, downloader.session):
+                    Metrics.cache_lookup("datasets", hit=False)
+                    to_download.append((url, local_path))
+                    continue
+                Metrics.cache_lookup("datasets", hit=True)
+                self._link(entry["sha256"], local_path, link)
+                print(f"Using cached {os.path.basename(local_path)}")
+                results[local_path] = None
+            except Exception as e:
+                results[local_path] = e
+
+        if not to_download:
+            return results
+
+        # Stage next to the objects so the final move is a rename, keep the
+        # filename since the checksum manifest is keyed by it
+        staged = {}
+        for url, local_path in to_download:
+            staging_dir = os.path.join(self.staging_dir, hashlib.sha1(url.encode("utf-8")).hexdigest())
+            os.makedirs(staging_dir, exist_ok=True)
+            staged[url] = os.path.join(staging_dir, os.path.basename(local_path))
+
+        # One download of a URL at a time across processes, they would write the same .part file.
+        # Locks are taken in a fixed order so two jobs fetching several URLs cannot deadlock
+        with contextlib.ExitStack() as stack:
+            for url in sorted(staged, key=lambda url: staged[url]):
+                stack.enter_context(FileLock(os.path.dirname(staged[url]) + ".lock"))
+
+            # Whoever held a lock may have stored the object meanwhile, reuse it
+            waiting = []
+            for url, local_path in to_download:
+                entry = self._cached(url)
+                if entry is not None and entry["validated"] >= checked:
+                    self._link(entry["sha256"], local_path, link)
+                    print(f"Using cached {os.path.basename(local_path)}, downloaded by another job")
+                    results[local_path] = None
+                else:
+                    waiting.append((url, local_path))
+
+            errors = downloader.download_all(*[(url, staged[url]) for url, _ in waiting])
+
+            for url, local_path in waiting:
+                err = errors[staged[url]]
+                if err is None:
+                    sha256 = self._store(url, staged[url], downloader.response_headers.get(url, {}))
+                    self._link(sha256, local_path, link)
+                results[local_path] = err
+
+        return results
+
+
+class ResultCache:
+    """
+        Two-level cache for JSON results (e.g. tagger counts and chart HTML).
+
+        Recently used results are kept in memory up to `max_memory_bytes` of
+        serialized JSON, every result is also written to an ArtifactCache on
+        disk bounded by `max_bytes` so it survives restarts.
+    """
+
+    FILENAME = "result.json"
+
+    def __init__(self, cache_dir="../cache/results/", max_bytes=256 * 1024 ** 2, max_memory_bytes=64 * 1024 ** 2):
+        self.disk = ArtifactCache(cache_dir, max_bytes=max_bytes)
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict() # key -> (value, size)
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+
+    make_key = staticmethod(ArtifactCache.make_key)
+
+    def _remember(self, key, value, size):
+        with self.lock:
+            if key in self.memory:
+                self.memory_bytes -= self.memory.pop(key)[1]
+            self.memory[key] = (value, size)
+            self.memory_bytes += size
+
+            # Least recently used first, always keep the newest one
+            while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+                _, (_, old_size) = self.memory.popitem(last=False)
+                self.memory_bytes -= old_size
+
+    def get(self, key):
+        """The cached value for `key`, or None on a miss."""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                Metrics.cache_lookup("results_memory", hit=True)
+                return self.memory[key][0]
+        Metrics.cache_lookup("results_memory", hit=False)
+
+        # The disk level counts its own hits and misses
+        paths = self.disk.get(key)
+        if paths is None:
+            return None
+        with open(paths[ResultCache.FILENAME], "r", encoding="utf-8") as f:
+            payload = f.read()
+
+        value = json.loads(payload)
+        self._remember(key, value, len(payload))
+        return value
+
+    def put(self, key, inputs, value):
+        payload = json.dumps(value, ensure_ascii=False)
+        with tempfile.TemporaryDirectory(dir=self.disk.cache_dir) as staging_dir:
+            path = os.path.join(staging_dir, ResultCache.FILENAME)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            self.disk.put(key, inputs, path)
+
+        self._remember(key, value, len(payload))
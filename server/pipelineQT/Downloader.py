@@ -0,0 +1,202 @@
+import os, sys, json, time, hashlib, threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from .Errors import ChecksumError, IncompleteDownloadError
+from .Progress import ProgressBar
+
+
+def sha256sum(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadManager:
+    """
+        Concurrent, resumable and verified file downloads.
+
+        Every file is streamed into `<output_path>.part` in large chunks. When
+        the connection drops, the next attempt asks for the missing bytes with
+        an HTTP Range request instead of starting over. The request carries
+        If-Range with the ETag (or Last-Modified) the part was started from,
+        so if the remote file changed in between the server sends all of it
+        and the part is rewritten from zero. Finished files are checked
+        against the sha256 in the manifest (filename -> sha256) before they
+        are moved into place. A file the manifest has no entry for is
+        recorded in the `record` manifest on its first download, and every
+        later download of it must match. Such a file is only as good as its
+        first download, so every download of it prints a warning.
+    """
+
+    CHUNK_SIZE = 1024 * 1024 # 1MB chunks
+
+    def __init__(self, max_workers=4, retries=5, timeout=30, backoff=2, manifest=None, record=None, channel=None):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        # Checksums of the first downloads go to `record`, the shipped `manifest` wins over it
+        self.record = record
+        self.record_lock = threading.Lock()
+        self.checksums = self.load_manifest(record) if record and os.path.exists(record) else {}
+        self.pinned = self.load_manifest(manifest) if manifest else {}
+        self.checksums.update(self.pinned)
+        self.session = requests.Session()
+
+        # Progress bus channel (usually the job id) the transfer bars publish to
+        self.channel = channel
+
+        # url -> headers of the last response, for ETag/Last-Modified bookkeeping
+        self.response_headers = {}
+
+    @staticmethod
+    def load_manifest(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def write_manifest(path, *files):
+        """Record the sha256 of known-good `files` so later downloads can be verified."""
+        manifest = {os.path.basename(file): sha256sum(file) for file in files}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
+        return manifest
+
+    @staticmethod
+    def _validator(headers):
+        """What If-Range can compare against: a strong ETag, else Last-Modified."""
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return headers.get("Last-Modified")
+
+    def _fetch(self, url, part_path, desc):
+        """One attempt, appending to whatever is already in `part_path`."""
+        validator_path = part_path + ".validator"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = None
+        if offset and os.path.exists(validator_path):
+            with open(validator_path, "r", encoding="utf-8") as f:
+                validator = f.read().strip() or None
+        if offset and validator is None:
+            # Nothing to tell whether the remote file is still the same, start over
+            offset = 0
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+
+        with self.session.get(url, stream=True, headers=headers, timeout=self.timeout) as response:
+            if response.status_code == 416:
+                # Range starts at the end of the file, nothing left to fetch
+                return
+            response.raise_for_status() # Errors if link is broken (404)
+            self.response_headers[url] = response.headers
+
+            if offset and response.status_code != 206:
+                # The server ignored the Range header or the file changed (If-Range failed), start over
+                offset = 0
+            if not offset:
+                with open(validator_path, "w", encoding="utf-8") as f:
+                    f.write(self._validator(response.headers) or "")
+
+            total_size = offset + int(response.headers.get("content-length", 0))
+
+            with open(part_path, "ab" if offset else "wb", buffering=DownloadManager.CHUNK_SIZE) as file, ProgressBar(
+                desc=desc,
+                channel=self.channel,
+                initial=offset,
+                total=total_size,
+                unit="iB",
+                unit_scale=True,
+                unit_divisor=1024,
+            ) as bar:
+                for data in response.iter_content(DownloadManager.CHUNK_SIZE):
+                    size = file.write(data)
+                    bar.update(size)
+
+        received = os.path.getsize(part_path)
+        if total_size and received < total_size:
+            raise IncompleteDownloadError(f"Received {received} of {total_size} bytes")
+
+    def download(self, url, output_path):
+        filename = os.path.basename(output_path)
+        part_path = output_path + ".part"
+
+        attempt = 0
+        while True:
+            try:
+                self._fetch(url, part_path, filename)
+                break
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout,
+                    IncompleteDownloadError) as err:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                delay = min(30, self.backoff * 2 ** (attempt - 1))
+                print(f"{filename}: {err}. Resuming in {delay}s (attempt {attempt})...")
+                time.sleep(delay)
+
+        validator_path = part_path + ".validator"
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
+
+        if filename not in self.pinned:
+            print(f"WARNING: {filename} has no pinned sha256 in the manifest, it is only checked against its "
+                  f"first download. Pin it with: python -m pipelineQT.Downloader <manifest> <files>", file=sys.stderr)
+
+        expected = self.checksums.get(filename)
+        if expected is None and self.record:
+            self._record(filename, sha256sum(part_path))
+        elif expected is None:
+            print(f"{filename}: no checksum in the manifest, skipping verification.")
+        else:
+            actual = sha256sum(part_path)
+            if actual != expected:
+                os.remove(part_path)
+                raise ChecksumError(f"{filename}: expected sha256 {expected}, got {actual}")
+
+        os.replace(part_path, output_path)
+        print(f"Download complete: {output_path}")
+        return output_path
+
+    def _record(self, filename, digest):
+        """Add a first download to the manifest, later ones must match it."""
+        with self.record_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.record)), exist_ok=True)
+            checksums = self.load_manifest(self.record) if os.path.exists(self.record) else {}
+            checksums[filename] = digest
+            tmp_path = self.record + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(checksums, f, indent=4, sort_keys=True)
+            os.replace(tmp_path, self.record)
+            self.checksums[filename] = digest
+        print(f"{filename}: no checksum in the manifest, recorded sha256 {digest} in {self.record}.")
+
+    def download_all(self, *jobs):
+        """
+            Download (url, output_path) pairs at the same time.
+
+            Returns {output_path: None or the exception that stopped it}.
+        """
+        def run(job):
+            url, output_path = job
+            try:
+                self.download(url, output_path)
+                return output_path, None
+            except Exception as e:
+                return output_path, e
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(pool.map(run, jobs))
+
+
+def main():
+    # python -m pipelineQT.Downloader manifest.json xlsum.jsonl xnli.tsv ...
+    manifest = DownloadManager.write_manifest(sys.argv[1], *sys.argv[2:])
+    print(json.dumps(manifest, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -37,4 +37,24 @@ class FileNameError(TagError):
     - deepl
     - opus
     """
-    pass
\ No newline at end of file
+    pass
+
+class IncorrectTierError(TagError):
+    """Raise when a model tier other than the ones in Tiers.TIERS is asked for"""
+    pass
+
+class ExtractError(Exception):
+    """Use this error for errors found in Extractor.py and Downloader.py"""
+    pass
+
+class IncompleteDownloadError(ExtractError):
+    """Raise when the connection closed before the whole file was received"""
+    pass
+
+class ChecksumError(ExtractError):
+    """Raise when a downloaded file does not match the checksum in the manifest"""
+    pass
+
+class OfflineError(ExtractError):
+    """Raise when a dataset is not cached and offline mode is on"""
+    pass
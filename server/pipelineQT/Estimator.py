@@ -0,0 +1,145 @@
+"""
+    Form proportions of a large corpus estimated from a sample of its rows.
+
+    The charts only need the share of DKA, KA and ambiguous sentences
+    (Tagger.get_counts), not the form of every row. FormEstimator tags the
+    rows in a random order, a batch at a time, and after every batch
+    computes a Wilson score interval for each proportion. It stops once
+    every interval is narrower than `width`. The result has the estimated
+    counts, their intervals and the fraction of rows that were tagged.
+
+    Rows are drawn without replacement, so the intervals are narrowed by
+    the finite population correction. When every row ends up tagged, they
+    collapse onto the exact counts. The three intervals hold jointly at
+    `confidence` (Bonferroni): each one is computed at 1 - (1 - confidence) / 3.
+
+    The sample needed depends on the width, not on the corpus size. A
+    width of 0.02 (±1%) at 95% takes at most about 14,300 rows, so on a
+    million-row input under 1.5% of it is tagged.
+
+    Tagger(estimate_width=...) counts every segment this way (the upload
+    form's "Counts" field), and this module's CLI reports the estimates of
+    one dataset:
+
+        cd server
+        python -m pipelineQT.Estimator ../datasets/translated/google/google_translated_paws.csv --width 0.02
+"""
+import os, time, argparse, tempfile
+from statistics import NormalDist
+import numpy as np
+
+
+def wilson(successes, n, confidence=0.95, population=None):
+    """
+        Wilson score intervals (lower, upper) of the proportions successes / n.
+
+        `successes` may be an array, one interval per entry. With the
+        `population` size, the finite population correction is applied.
+    """
+    p = np.asarray(successes, dtype=float) / n
+    if population is not None:
+        if n >= population:
+            return p, p
+        # Without replacement the variance is that of a larger sample with replacement
+        n = n * (population - 1) / (population - n)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    denominator = 1 + z ** 2 / n
+    center = (p + z ** 2 / (2 * n)) / denominator
+    half = z / denominator * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2))
+    return np.clip(center - half, 0, 1), np.clip(center + half, 0, 1)
+
+
+class FormEstimator:
+    """Estimates Tagger.get_counts of a column by tagging a random sample of it, see the module docstring."""
+
+    def __init__(self, tagger, width=0.02, confidence=0.95, batch_size=256, min_rows=400, seed=42):
+        self.tagger = tagger
+        self.width = width # widest accepted interval, of a proportion (0.02 = ±1%)
+        self.confidence = confidence # of the three intervals together
+        self.batch_size = batch_size
+        self.min_rows = min_rows # no stop before, Wilson intervals of a few rows are too optimistic
+        self.seed = seed
+
+    def estimate(self, texts):
+        """
+            Estimated form counts of `texts` (a list or a Series), tagging as
+            few rows as the target width allows.
+
+            Returns {"rows", "tagged", "fraction_tagged", "stopped" (width or
+            exhausted), "seconds", "counts", "intervals", "proportions",
+            "proportion_intervals"}, with counts keyed like Tagger.get_counts.
+        """
+        texts = texts.tolist() if hasattr(texts, "tolist") else list(texts)
+        rows = len(texts)
+        order = np.random.default_rng(self.seed).permutation(rows)
+        names = list(self.tagger.get_counts([])) # in form code order: DKA, KA, ambiguous
+
+        start = time.perf_counter()
+        sample = np.zeros(len(names), dtype=np.int64)
+        tagged, stopped = 0, "exhausted"
+        lower = upper = np.zeros(len(names))
+        while tagged < rows:
+            batch = order[tagged:tagged + self.batch_size]
+            forms = self.tagger.get_forms([texts[i] for i in batch])
+            sample += np.bincount(forms, minlength=len(names))[:len(names)]
+            tagged += len(batch)
+
+            lower, upper = wilson(sample, tagged, 1 - (1 - self.confidence) / len(names), population=rows)
+            if tagged >= min(self.min_rows, rows) and (upper - lower).max() <= self.width:
+                stopped = "width" if tagged < rows else "exhausted"
+                break
+
+        proportions = sample / tagged if tagged else np.zeros(len(names))
+        result = {
+            "rows": rows,
+            "tagged": tagged,
+            "fraction_tagged": tagged / rows if rows else 0.0,
+            "stopped": stopped,
+            "seconds": time.perf_counter() - start,
+            "confidence": self.confidence,
+            "width": self.width,
+            "counts": {name: round(p * rows) for name, p in zip(names, proportions)},
+            "intervals": {name: [int(np.floor(lo * rows)), int(np.ceil(hi * rows))]
+                          for name, lo, hi in zip(names, lower, upper)},
+            "proportions": {name: float(p) for name, p in zip(names, proportions)},
+            "proportion_intervals": {name: [float(lo), float(hi)] for name, lo, hi in zip(names, lower, upper)},
+        }
+        self.tagger.logger.info(f"Estimated the forms of {rows} rows from {tagged} ({result['fraction_tagged']:.2%}).")
+        return result
+
+
+def main():
+    from .Tagger import Tagger
+    from .Schema import read_dataset, TEXT_COLUMNS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", help="a translated or cleaned dataset CSV")
+    parser.add_argument("--width", type=float, default=0.02)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tier", choices=list(Tagger.TIERS), default=Tagger.TIER)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    tagger = Tagger(tag_dir=tmp, log_file=os.path.join(tmp, "tagger.log"), tier=args.tier)
+    estimator = FormEstimator(tagger, width=args.width, confidence=args.confidence, batch_size=args.batch_size,
+                              seed=args.seed)
+
+    df = read_dataset(args.dataset)
+    print("| column | rows | tagged | form | estimated count | interval |")
+    print("|---|---|---|---|---|---|")
+    for column in [column for column in df.columns if column in TEXT_COLUMNS]:
+        texts = df[column]
+        if column == "text":
+            # XLSUM articles are counted by sentence, as in Tagger.tag_xlsum
+            texts = [sent for article in texts for sent in tagger._get_sentences_calamancy(article)]
+        result = estimator.estimate(texts)
+        for name, count in result["counts"].items():
+            lo, hi = result["intervals"][name]
+            print(f"| {column} | {result['rows']} | {result['tagged']} ({result['fraction_tagged']:.1%}) "
+                  f"| {name} | {count} | {lo}-{hi} |")
+
+
+if __name__ == "__main__":
+    main()
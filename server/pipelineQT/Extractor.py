@@ -1,6 +1,6 @@
 import requests, textwrap, os
-from tqdm import tqdm
 from .Errors import NoDatasetError, IncorrectDatasetError
+from .Downloader import DownloadManager
 
 
 class Extractor:
@@ -12,11 +12,36 @@ class Extractor:
         "xnli": "https://github.com/kimodri/quantifying-translationese/releases/download/v1-dataset/xnli.tsv",
     }
 
-    def __init__(self, download_dir='../datasets_sample/raw/'):
+    # filename -> sha256 of the release assets, update it with: python -m pipelineQT.Downloader <manifest> <files>
+    manifest = os.path.join(os.path.dirname(__file__), "checksums.json")
+    # Assets missing from the manifest are pinned on their first download, in checksums.json
+    # of the dataset cache, never in a download directory the user picked
+    recorded = "checksums.json"
+    record_dir = "../cache/datasets/"
+
+    @classmethod
+    def record_path(cls, cache=None):
+        """Where first downloads are recorded, next to the objects of `cache` when given."""
+        return os.path.join(cache.cache_dir if cache is not None else cls.record_dir, cls.recorded)
+
+    def __init__(self, download_dir='../datasets_sample/raw/', max_workers=4, cache=None, offline=False, channel=None):
         self.download_dir = download_dir
         if not os.path.exists(self.download_dir):
             os.makedirs(self.download_dir)
 
+        # Optional DatasetCache, unchanged files are linked from it instead of downloaded
+        self.cache = cache
+        self.offline = offline
+        if offline and cache is None:
+            raise ValueError("Offline mode needs a DatasetCache to serve the datasets from.")
+
+        self.downloader = DownloadManager(
+            max_workers=max_workers,
+            manifest=Extractor.manifest,
+            record=Extractor.record_path(cache),
+            channel=channel,
+        )
+
     def extract(self, *args):
         print(f"Arguments passed: {args}")
         if len(args) < 1:
@@ -43,40 +68,32 @@ class Extractor:
                             - 'xlsum'
                     """
                 ))
-            else:
-                url = Extractor.datasets.get(arg)
-                filename = url.split("/")[-1]
-                output_path = os.path.join(self.download_dir, filename)
 
-                print(f"Downloading {filename}...")
-                try:
-                    # stream=True is important for large files so they don't load into RAM at once
-                    response = requests.get(url, stream=True)
-                    response.raise_for_status() # Errors if link is broken (404)
+        jobs = []
+        for arg in args:
+            url = Extractor.datasets.get(arg)
+            filename = url.split("/")[-1]
+            jobs.append((url, os.path.join(self.download_dir, filename)))
 
-                    total_size = int(response.headers.get('content-length', 0))
-                    block_size = 1024 # 1KB chunks
+        print(f"Downloading {', '.join(args)}...")
+        if self.cache is not None:
+            results = self.cache.fetch_all(self.downloader, *jobs, offline=self.offline)
+        else:
+            results = self.downloader.download_all(*jobs)
 
-                    with open(output_path, 'wb') as file, tqdm(
-                        desc=filename,
-                        total=total_size,
-                        unit='iB',
-                        unit_scale=True,
-                        unit_divisor=1024,
-                    ) as bar:
-                        for data in response.iter_content(block_size):
-                            size = file.write(data)
-                            bar.update(size)
-                    
-                    print(f"Download complete: {output_path}")
-                    # return output_path
+        downloaded = {}
+        for arg, (url, output_path) in zip(args, jobs):
+            err = results[output_path]
+            if err is None:
+                downloaded[arg] = output_path
+            elif isinstance(err, requests.exceptions.HTTPError):
+                print(f"HTTP Error: {err}")
+                if err.response is not None and err.response.status_code == 404:
+                    print("Check if the Repository is Public. Private repos require authentication.")
+            else:
+                print(f"An error occurred: {err}")
 
-                except requests.exceptions.HTTPError as err:
-                    print(f"HTTP Error: {err}")
-                    if response.status_code == 404:
-                        print("Check if the Repository is Public. Private repos require authentication.")
-                except Exception as e:
-                    print(f"An error occurred: {e}")
+        return downloaded
 
 
 def main():
@@ -0,0 +1,68 @@
+"""
+    Prometheus metrics of the pipeline, served by the /metrics route.
+
+    Every metric is defined here and updated where the work happens (Tagger,
+    Translator, Processor, the caches and queues). Rates are left to
+    Prometheus, e.g. sentences tagged per second:
+
+        rate(qt_tagged_sentences_total[1m])
+        sum by (cache) (rate(qt_cache_requests_total{result="hit"}[5m]))
+            / sum by (cache) (rate(qt_cache_requests_total[5m]))
+
+    Under gunicorn every worker keeps its own values. gunicorn.conf.py sets
+    PROMETHEUS_MULTIPROC_DIR, so the workers write them to files there and
+    export() merges them into one exposition.
+"""
+import os
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# Seconds, from a single short sentence to a large Opus-MT or API batch
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+TAGGED_SENTENCES = Counter(
+    "qt_tagged_sentences", "Sentences tagged with a form", ["model"])
+MODEL_CALL_SECONDS = Histogram(
+    "qt_model_call_seconds", "Latency of one model call: a sentence or a batch", ["model", "call"],
+    buckets=LATENCY_BUCKETS)
+
+TRANSLATE_REQUESTS = Counter(
+    "qt_translate_requests", "Translation requests (API calls or Opus-MT batches)", ["engine"])
+TRANSLATE_CHARACTERS = Counter(
+    "qt_translate_characters", "Source characters sent for translation", ["engine"])
+TRANSLATE_RETRIES = Counter(
+    "qt_translate_retries", "Translation requests retried after a rate limit", ["engine"])
+TRANSLATE_SECONDS = Histogram(
+    "qt_translate_request_seconds", "Latency of one translation request", ["engine"], buckets=LATENCY_BUCKETS)
+
+CLEANED_ROWS = Counter(
+    "qt_cleaned_rows", "Rows written to the cleaned datasets", ["dataset"])
+CLEAN_SECONDS = Histogram(
+    "qt_clean_seconds", "Time to clean one dataset", ["dataset"], buckets=LATENCY_BUCKETS)
+
+CACHE_REQUESTS = Counter(
+    "qt_cache_requests", "Cache lookups by result (hit or miss)", ["cache", "result"])
+
+QUEUE_DEPTH = Gauge(
+    "qt_queue_depth", "Items waiting in a queue, running jobs included", ["queue"], multiprocess_mode="livesum")
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def translation(engine, texts):
+    """Count one translation request of `texts` and time it: `with Metrics.translation("google", batch):`"""
+    TRANSLATE_REQUESTS.labels(engine=engine).inc()
+    TRANSLATE_CHARACTERS.labels(engine=engine).inc(sum(len(text) for text in texts if isinstance(text, str)))
+    return TRANSLATE_SECONDS.labels(engine=engine).time()
+
+
+def export():
+    """(body, content type) of the metrics of this process, or of every worker in multiprocess mode."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
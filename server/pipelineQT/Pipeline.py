@@ -0,0 +1,379 @@
+"""
+End-to-end pipeline runner: extract -> clean -> translate -> tag -> visualize.
+
+One JSON config describes the whole study:
+
+    {
+        "workdir": "../runs/study",
+        "seed": 42,
+        "datasets": {
+            "paws": {"true_sample": 50, "false_sample": 50},
+            "xnli": {"contradiction_sample": 20, "entailment_sample": 20, "neutral_sample": 20}
+        },
+        "engines": {
+            "opus": {},
+            "deepl": {"key": "$DEEPL_KEY"},
+            "azure": {"key": "$AZURE_KEY", "region": "southeastasia", "endpoint": "$AZURE_ENDPOINT"}
+        },
+        "tier": "md",
+        "max_workers": 4,
+        "concurrency": {"translate": 2, "tag": 1}
+    }
+
+Values starting with "$" are read from the environment. "tier" is the
+calamancy model of the tag stages (md, lg or trf, see Tagger.TIERS):
+md for exploratory runs, trf for the final numbers. Every
+(dataset x engine) branch is its own chain of stages, so a dataset is
+translated and tagged as soon as it is cleaned, while other branches run.
+Stage outputs are cached by the fingerprint of their inputs, so running the
+same config again only redoes what changed:
+
+    cd server
+    python -m pipelineQT.Pipeline study.json
+
+The last stage writes <workdir>/report.html with the engine charts and
+<workdir>/statistics.json with the paired tests between the engines (see
+Statistics.py).
+
+With --profile the stages run one at a time and the peak memory of each
+is written to <workdir>/profiles/ (see Profiler.py).
+"""
+import os, sys, json, time, argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .Cache import ArtifactCache, DatasetCache
+from .Errors import IncorrectDatasetError, NoDatasetError
+from .Backends import SPECS
+
+ENGINES = ["opus", "google", "azure", "deepl"]
+SECRETS = {"key", "region", "endpoint"} # never part of a cache key
+
+# Stages of one kind running at the same time, the models are shared per process
+CONCURRENCY = {"extract": 4, "clean": 2, "translate": 2, "tag": 1, "visualize": 1}
+
+
+class Stage:
+    """One node of the pipeline DAG. `fn(*upstream_outputs)` returns the list of files it wrote."""
+
+    def __init__(self, stage_id, kind, fn, deps=(), inputs=None, cacheable=True):
+        self.id = stage_id
+        self.kind = kind
+        self.fn = fn
+        self.deps = list(deps)
+        self.inputs = inputs or {}
+        self.cacheable = cacheable
+
+
+class Pipeline:
+
+    def __init__(self, config, profiler=None):
+        self.config = self._resolve_env(config)
+        if not self.config.get("datasets"):
+            raise NoDatasetError("Specify the datasets of the study under 'datasets'.")
+        for dataset in self.config["datasets"]:
+            if dataset not in SPECS:
+                raise IncorrectDatasetError(f"{dataset} is not a valid dataset.")
+        for engine in self.config.get("engines", {}):
+            if engine not in ENGINES:
+                raise ValueError(f"{engine} is not a supported engine. Accepted: {', '.join(ENGINES)}")
+
+        self.workdir = self.config.get("workdir", "../runs/default")
+        self.seed = self.config.get("seed", 42)
+        from .Tagger import Tagger
+        self.tier = self.config.get("tier", Tagger.TIER)
+        Tagger.model_of(self.tier) # IncorrectTierError before any stage runs
+        self.max_workers = self.config.get("max_workers", 4)
+        # Optional StageProfiler. Stages then run one at a time, so no stage's memory includes another's
+        self.profiler = profiler
+        if profiler is not None:
+            self.max_workers = 1
+        self.concurrency = {**CONCURRENCY, **self.config.get("concurrency", {})}
+
+        self.raw_dir = os.path.join(self.workdir, "raw")
+        self.cleaned_dir = os.path.join(self.workdir, "cleaned")
+        self.translated_dir = os.path.join(self.workdir, "translated")
+        self.tagged_dir = os.path.join(self.workdir, "tagged")
+        for directory in (self.raw_dir, self.cleaned_dir, self.translated_dir, self.tagged_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        # Stage outputs by input fingerprint, raw downloads shared with the web app
+        self.cache = ArtifactCache(os.path.join(self.workdir, ".stages"))
+        self.dataset_cache = DatasetCache(self.config.get("dataset_cache", "../cache/datasets"))
+        self.store = None
+
+    @staticmethod
+    def _resolve_env(value):
+        if isinstance(value, dict):
+            return {k: Pipeline._resolve_env(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [Pipeline._resolve_env(v) for v in value]
+        if isinstance(value, str) and value.startswith("$"):
+            return os.environ.get(value[1:], "")
+        return value
+
+    def build(self):
+        """The stages of the study by id, in dependency order."""
+        stages = {}
+        engines = self.config.get("engines", {})
+
+        for dataset, samples in self.config["datasets"].items():
+            stages[f"extract:{dataset}"] = Stage(
+                f"extract:{dataset}", "extract", lambda dataset=dataset: self._extract(dataset),
+                # Always asked, the dataset cache answers unchanged files with a conditional request
+                cacheable=False,
+            )
+            stages[f"clean:{dataset}"] = Stage(
+                f"clean:{dataset}", "clean", lambda raw, dataset=dataset: self._clean(dataset, raw),
+                deps=[f"extract:{dataset}"],
+                inputs={"samples": samples, "seed": self.seed},
+            )
+            for engine, params in engines.items():
+                stages[f"translate:{dataset}:{engine}"] = Stage(
+                    f"translate:{dataset}:{engine}", "translate",
+                    lambda cleaned, dataset=dataset, engine=engine: self._translate(dataset, engine, cleaned),
+                    deps=[f"clean:{dataset}"],
+                    inputs={"params": {k: v for k, v in params.items() if k not in SECRETS}},
+                )
+                stages[f"tag:{dataset}:{engine}"] = Stage(
+                    f"tag:{dataset}:{engine}", "tag",
+                    lambda translated, dataset=dataset, engine=engine: self._tag(dataset, engine, translated),
+                    deps=[f"translate:{dataset}:{engine}"],
+                    inputs=self._tagger_version(),
+                )
+
+        tags = [stage_id for stage_id in stages if stage_id.startswith("tag:")]
+        if tags:
+            stages["visualize"] = Stage("visualize", "visualize", lambda *tagged: self._visualize(*tagged), deps=tags,
+                                        cacheable=False)
+        return stages
+
+    def _tagger_version(self):
+        from .Tagger import Tagger
+        return {"tier": self.tier, "model": Tagger.model_of(self.tier), "rules": Tagger.RULE_VERSION}
+
+    def run(self):
+        """
+            Run every stage whose dependencies are done, up to `max_workers` at a time.
+
+            Returns {stage id: {"status": done/cached/failed/skipped, ...}}. A
+            failed stage skips its dependents but not the other branches.
+        """
+        stages = self.build()
+        outputs = {}
+        report = {}
+        pending = dict(stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                busy = {}
+                for stage in running.values():
+                    busy[stage.kind] = busy.get(stage.kind, 0) + 1
+
+                for stage_id, stage in list(pending.items()):
+                    if any(report.get(dep, {}).get("status") in ("failed", "skipped") for dep in stage.deps):
+                        report[stage_id] = {"status": "skipped"}
+                        del pending[stage_id]
+                        print(f"[pipeline] {stage_id} skipped")
+                    elif all(dep in outputs for dep in stage.deps) and busy.get(stage.kind, 0) < self.concurrency[stage.kind]:
+                        busy[stage.kind] = busy.get(stage.kind, 0) + 1
+                        del pending[stage_id]
+                        running[pool.submit(self._run_stage, stage, [outputs[dep] for dep in stage.deps])] = stage
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        status, paths, seconds = future.result()
+                        outputs[stage.id] = paths
+                        report[stage.id] = {"status": status, "seconds": seconds}
+                    except Exception as e:
+                        report[stage.id] = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+                    print(f"[pipeline] {stage.id} {report[stage.id]['status']}")
+
+        return {stage_id: report[stage_id] for stage_id in stages if stage_id in report}
+
+    def _run_stage(self, stage, upstream):
+        start = time.perf_counter()
+        if not stage.cacheable:
+            paths = stage.fn(*upstream)
+            return "done", paths, time.perf_counter() - start
+
+        inputs = {
+            "stage": stage.id,
+            **stage.inputs,
+            "upstream": [self.cache.fingerprint(path) for paths in upstream for path in paths],
+        }
+        key = self.cache.make_key(**inputs)
+        output_dir = self._output_dir(stage)
+
+        restored = self.cache.restore(key, output_dir)
+        if restored is not None:
+            if stage.kind == "tag":
+                self._record_counts(restored[0])
+            return "cached", restored, time.perf_counter() - start
+
+        paths = stage.fn(*upstream)
+        self.cache.put(key, inputs, *paths)
+        return "done", paths, time.perf_counter() - start
+
+    def _output_dir(self, stage):
+        if stage.kind == "clean":
+            return self.cleaned_dir
+        if stage.kind == "translate":
+            return self.translated_dir
+        return os.path.join(self.tagged_dir, stage.id.split(":")[2])
+
+    def _extract(self, dataset):
+        from .Extractor import Extractor
+
+        extractor = Extractor(self.raw_dir, cache=self.dataset_cache)
+        downloaded = extractor.extract(dataset)
+        if dataset not in downloaded:
+            raise RuntimeError(f"Could not download {dataset}")
+        return [downloaded[dataset]]
+
+    def _clean(self, dataset, raw):
+        from .Processor import Processor
+
+        processor = Processor(self.cleaned_dir, profiler=self.profiler)
+        processor.random_seed = self.seed
+        report = processor.process(**{dataset: {**self.config["datasets"][dataset], "path": raw[0]}})
+        if report[dataset]["status"] == "failed":
+            raise RuntimeError(f"Could not clean {dataset}: {report[dataset]['error']}")
+        return [os.path.join(self.cleaned_dir, f"cleaned_{dataset}.csv")]
+
+    def _translate(self, dataset, engine, cleaned):
+        from .Translator import Translator
+
+        params = self.config["engines"][engine]
+        translator = Translator(self.translated_dir, profiler=self.profiler)
+        files = {dataset: cleaned[0]}
+
+        if engine == "opus":
+            translator.opus_translate(**files)
+        elif engine == "azure":
+            azure_cred = {"key": params.get("key"), "region": params.get("region"), "endpoint": params.get("endpoint")}
+            translator.azure_translate(azure_cred, **files)
+        elif engine == "google":
+            translator.google_translate(key=params.get("key"), **files)
+        else:
+            translator.deepl_translate(key=params.get("key"), **files)
+
+        return [os.path.join(self.translated_dir, f"{engine}_translated_{dataset}.csv")]
+
+    def _get_store(self):
+        if self.store is None:
+            from .Store import ResultsStore
+            self.store = ResultsStore(os.path.join(self.workdir, "results.sqlite3"))
+        return self.store
+
+    def _tag(self, dataset, engine, translated):
+        from .Tagger import Tagger
+
+        tag_dir = os.path.join(self.tagged_dir, engine)
+        tagger = Tagger(tag_dir, log_file=os.path.join(self.workdir, "tagger_process.log"), store=self._get_store(),
+                        profiler=self.profiler, tier=self.tier)
+        results = tagger(False, **{dataset: translated[0]})
+
+        # A cached tag stage restores these counts and the tagged CSV
+        counts_path = os.path.join(tag_dir, f"{dataset}_counts.json")
+        with open(counts_path, "w", encoding="utf-8") as f:
+            json.dump({"engine": engine, "results": results}, f, indent=4)
+        return [counts_path, os.path.join(tag_dir, f"{dataset}.csv")]
+
+    def _record_counts(self, counts_path):
+        """Record the counts of a restored tag stage, so the store's latest run is this one."""
+        with open(counts_path, "r", encoding="utf-8") as f:
+            counts = json.load(f)
+        tagger_version = self._tagger_version()
+        self._get_store().record(counts["results"], {dataset: counts["engine"] for dataset in counts["results"]},
+                                 tagger_version["model"], tagger_version["rules"])
+
+    def _visualize(self, *tagged):
+        """Report of this run, from the ([counts_path, tagged_csv]) outputs of its tag stages."""
+        from . import visualizor, Statistics
+
+        counts = {}
+        tagged_paths = {}
+        for counts_path, csv_path in tagged:
+            with open(counts_path, "r", encoding="utf-8") as f:
+                stage_counts = json.load(f)
+            for dataset, segments in stage_counts["results"].items():
+                counts.setdefault(dataset, {})[stage_counts["engine"]] = segments
+                tagged_paths.setdefault(dataset, {})[stage_counts["engine"]] = csv_path
+
+        figures = visualizor.generate_engine_charts(counts=counts)
+
+        # Paired tests between the engines, from the per-row forms of the tagged CSVs
+        statistics = {}
+        for dataset, paths in tagged_paths.items():
+            if len(paths) > 1:
+                statistics[dataset] = Statistics.compare(paths, seed=self.seed)
+        statistics_path = os.path.join(self.workdir, "statistics.json")
+        with open(statistics_path, "w", encoding="utf-8") as f:
+            json.dump(statistics, f, indent=4)
+
+        report_path = os.path.join(self.workdir, "report.html")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write("<html><head><meta charset='utf-8'><title>Pipeline report</title></head><body>")
+            for index, fig in enumerate(figures.values()):
+                # plotly.js embedded once so the report opens offline
+                f.write(fig.to_html(full_html=False, include_plotlyjs=index == 0))
+            if statistics:
+                f.write("<h3>Difference in DKA rate between engines (paired bootstrap, 95% interval)</h3>"
+                        "<table border='1' cellpadding='4'><tr><th>Dataset</th><th>Segment</th><th>Engines</th>"
+                        "<th>Difference</th><th>Interval</th><th>p</th></tr>")
+                for dataset, segments in statistics.items():
+                    for segment, result in segments.items():
+                        for pair, difference in result["bootstrap"]["differences"].items():
+                            low, high = difference["interval"]
+                            f.write(f"<tr><td>{dataset}</td><td>{segment}</td><td>{pair}</td>"
+                                    f"<td>{difference['difference']:+.3f}</td><td>{low:+.3f} to {high:+.3f}</td>"
+                                    f"<td>{difference['p_value']:.4f}</td></tr>")
+                f.write("</table>")
+            f.write("</body></html>")
+        print(f"Report written to {report_path}")
+        return [report_path, statistics_path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("config", help="JSON config of the study")
+    parser.add_argument("--dry-run", action="store_true", help="list the stages and exit")
+    parser.add_argument("--profile", action="store_true", help="record the peak memory of every stage")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    profiler = None
+    if args.profile:
+        from .Profiler import StageProfiler
+        profiler = StageProfiler(time.strftime("pipeline-%Y%m%d-%H%M%S"))
+    pipeline = Pipeline(config, profiler=profiler)
+
+    if args.dry_run:
+        for stage in pipeline.build().values():
+            print(f"{stage.id} <- {', '.join(stage.deps) or '-'}")
+        return
+
+    report = pipeline.run()
+    print("| stage | status | seconds |")
+    print("|---|---|---|")
+    for stage_id, status in report.items():
+        print(f"| {stage_id} | {status['status']} | {status.get('seconds', 0):.1f} |")
+    if profiler is not None:
+        path = profiler.write(os.path.join(pipeline.workdir, "profiles", f"{profiler.run_id}.json"))
+        print(f"Memory profile written to {path}")
+
+    if any(status["status"] in ("failed", "skipped") for status in report.values()):
+        for stage_id, status in report.items():
+            if status["status"] == "failed":
+                print(f"{stage_id}: {status['error']}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,35 @@
 from .Errors import IncorrectDatasetError, NoDatasetError, UnexpectedFileError
-import os, textwrap
-import pandas as pd
+from .Backends import SPECS, PandasBackend, PolarsBackend, SparkBackend, StreamBackend, select_backend
+from .Downloader import DownloadManager
+from .Progress import ProgressBar
+from . import Metrics, Profiler
+import os, textwrap, time
 import platform
+import multiprocessing
 import requests
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 class Processor:
     
     random_seed = 42
 
-    def __init__(self, clean_dir='../datasets_sample/cleaned/'):
+    def __init__(self, clean_dir='../datasets_sample/cleaned/', cache=None, backend=None, channel=None, profiler=None):
         self.clean_dir = clean_dir
         if not os.path.exists(self.clean_dir):
             os.makedirs(self.clean_dir)
+
+        # Optional ArtifactCache, cleaned outputs are reused when the source, config and seed match
+        self.cache = cache
+
+        # 'pandas', 'polars' or 'spark', None picks one per file (see Backends.select_backend)
+        self.backend = backend
         
+        # Progress bus channel (usually the job id) per-dataset and streaming progress is published to
+        self.channel = channel
+
+        # Optional StageProfiler recording the memory of every dataset cleaned
+        self.profiler = profiler
+
         # Don't initialize Spark until needed
         self.spark = None
 
@@ -56,7 +72,7 @@ class Processor:
             
             if issues:
                 error_msg = textwrap.dedent("""
-                Cannot process XL-Sum dataset. The following requirements are missing:
+                Cannot use the Spark backend. The following requirements are missing:
                 
                 """)
                 for i, issue in enumerate(issues, 1):
@@ -64,8 +80,8 @@ class Processor:
                 
                 error_msg += textwrap.dedent("""
                 
-                XL-Sum Processing Requirements:
-                ================================
+                Spark Backend Requirements:
+                ===========================
                 - Java JDK 8 or 11+ (system requirement)
                 - PySpark 3.2.0+ (Python package)
                 - Linux, macOS, or WSL (Windows Subsystem for Linux)
@@ -73,11 +89,12 @@ class Processor:
                 Alternative Options:
                 ====================
                 If you cannot install these requirements:
-                1. Process XL-Sum on Google Colab (free, has all requirements)
-                2. Use a cloud VM (AWS, Azure, GCP)
-                3. Ask a colleague with Linux/Mac to process it for you
+                1. Use the 'polars' or 'pandas' backend instead
+                2. Process the dataset on Google Colab (free, has all requirements)
+                3. Use a cloud VM (AWS, Azure, GCP)
+                4. Ask a colleague with Linux/Mac to process it for you
                 
-                Note: PAWS, BCOPA, and XNLI work on all platforms without these requirements.
+                Note: the pandas and polars backends work on all platforms without these requirements.
                 """)
                 
                 raise RuntimeError(error_msg)
@@ -86,6 +103,7 @@ class Processor:
                 from pyspark.sql import SparkSession
                 self.spark = (
                     SparkSession.builder
+                    .master("local[*]")
                     .config("spark.hadoop.io.native.lib.available", "false")
                     .getOrCreate()
                 )
@@ -94,64 +112,195 @@ class Processor:
         
         return self.spark
 
-    def process(self, **kwargs):
+    def process(self, parallel=False, max_workers=None, **kwargs):
+        """
+            Clean the given datasets and return a status report per dataset.
+
+            With `parallel=True` every cleaner runs in its own worker process.
+            Either way a failing dataset is reported as 'failed' with its
+            error instead of stopping the others.
+        """
         if not kwargs:
             raise NoDatasetError(textwrap.dedent("""
                 Specify the datasets to be cleaned.
                 Accepted: 'paws', 'bcopa', 'xnli', 'xlsum'
             """))
         
-        # Map strings to functions
-        dispatch = {
-            'paws': self._clean_paws,
-            'bcopa': self._clean_bcopa,
-            'xlsum': self._clean_xlsum,
-            'xnli': self._clean_xnli
-        }
+        for key in kwargs:
+            if key not in SPECS:
+                raise IncorrectDatasetError(f"{key} is not a valid dataset.")
+
+        report = {}
+        pending = {}
+        cache_keys = {}
 
         for key, args in kwargs.items():
-            if key not in dispatch:
+            # Resolve the backend once so the cache key matches the backend that runs
+            args = {**args, "backend": self._backend_name(key, args)}
+            cache_inputs = self._cache_inputs(key, args)
+            if cache_inputs is not None:
+                cache_keys[key] = (self.cache.make_key(**cache_inputs), cache_inputs)
+                if self.cache.restore(cache_keys[key][0], self.clean_dir):
+                    print(f"Using cached cleaned_{key}.csv")
+                    report[key] = {"status": "cached", "seconds": 0.0}
+                    continue
+            pending[key] = args
+
+        if parallel and len(pending) > 1:
+            workers = max_workers or min(len(pending), os.cpu_count() or 1)
+            # Every worker process profiles its own cleaner, the records come back with the result
+            profile = None if self.profiler is None else {
+                "run_id": self.profiler.run_id, "allocations": self.profiler.allocations, "top": self.profiler.top,
+            }
+            # Spawned, not forked: this runs in server threads, a fork could copy a lock another thread holds
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = {
+                    pool.submit(_run_cleaner, self.clean_dir, self.random_seed, key, args, profile): key
+                    for key, args in pending.items()
+                }
+                done = ProgressBar(as_completed(futures), total=len(futures), desc="Cleaning",
+                                   unit="dataset", channel=self.channel)
+                for future in done:
+                    key = futures[future]
+                    try:
+                        seconds, rows, records = future.result()
+                        report[key] = {"status": "done", "seconds": seconds, "rows": rows}
+                        for record in records:
+                            self.profiler.add(record)
+                    except Exception as e:
+                        print(f"Failed to clean {key}: {e}")
+                        report[key] = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+        else:
+            for key, args in pending.items():
+                start = time.perf_counter()
+                try:
+                    with Profiler.stage(self.profiler, "clean", key):
+                        rows = self._clean(key, args)
+                    report[key] = {"status": "done", "seconds": time.perf_counter() - start, "rows": rows}
+                except Exception as e:
+                    print(f"Failed to clean {key}: {e}")
+                    report[key] = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+
+        # Recorded here since the parallel cleaners run in other processes
+        for key in pending:
+            if report[key]["status"] == "done":
+                Metrics.CLEANED_ROWS.labels(dataset=key).inc(report[key]["rows"])
+                Metrics.CLEAN_SECONDS.labels(dataset=key).observe(report[key]["seconds"])
+
+        for key in pending:
+            if key in cache_keys and report[key]["status"] == "done":
+                destination_path = os.path.join(self.clean_dir, f"cleaned_{key}.csv")
+                self.cache.put(*cache_keys[key], destination_path)
+
+        # Keep the order the datasets were requested in
+        return {key: report[key] for key in kwargs}
+
+    def stream(self, max_workers=4, **kwargs):
+        """
+            Download and clean the given datasets in one pass.
+
+            The HTTP response is parsed as it arrives and filtered/sampled on
+            the fly (see Backends.StreamBackend), so the raw file is never
+            written to disk. Each config may carry a 'url', the released
+            dataset is used otherwise. Returns a status report like process().
+            Streamed runs are not cached since there is no raw file to hash.
+        """
+        from .Extractor import Extractor
+
+        if not kwargs:
+            raise NoDatasetError(textwrap.dedent("""
+                Specify the datasets to be cleaned.
+                Accepted: 'paws', 'bcopa', 'xnli', 'xlsum'
+            """))
+
+        for key in kwargs:
+            if key not in SPECS:
                 raise IncorrectDatasetError(f"{key} is not a valid dataset.")
-            
-            # Call the function with the CORRECT arguments
-            # Passing 'key' explicitly to match your definitions
-            dispatch[key](key, args)
-    
-    def get_xlsum_100(self):
 
+        def run(item):
+            key, config = item
+            url = config.get("url") or Extractor.datasets[key]
+            start = time.perf_counter()
+            try:
+                with Profiler.stage(self.profiler, "clean", key):
+                    rows = self._clean_stream(key, url, config)
+                seconds = time.perf_counter() - start
+                Metrics.CLEANED_ROWS.labels(dataset=key).inc(rows)
+                Metrics.CLEAN_SECONDS.labels(dataset=key).observe(seconds)
+                return key, {"status": "done", "seconds": seconds, "rows": rows}
+            except Exception as e:
+                print(f"Failed to stream {key}: {e}")
+                return key, {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+
+        # Downloads are IO bound and the parsers release the GIL while waiting on the socket
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            report = dict(pool.map(run, kwargs.items()))
+
+        return {key: report[key] for key in kwargs}
+
+    def _clean_stream(self, key, url, config):
+        spec = SPECS[key]
+        destination_path = os.path.join(self.clean_dir, f"cleaned_{key}.csv")
+
+        print(f"Streaming {spec['name']} from {url}...")
+        with requests.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status() # Errors if link is broken (404)
+
+            with ProgressBar(desc=f"Streaming {key}", total=int(response.headers.get("content-length", 0)),
+                             unit="iB", unit_scale=True, unit_divisor=1024, channel=self.channel) as bar:
+                def chunks():
+                    for chunk in response.iter_content(DownloadManager.CHUNK_SIZE):
+                        bar.update(len(chunk))
+                        yield chunk
+
+                lines = StreamBackend.iter_lines(chunks())
+                rows = StreamBackend().clean(spec, lines, destination_path, config, self.random_seed)
+
+        print(f"Successfully processed {rows} samples to {destination_path}")
+        return rows
+
+    def _cache_inputs(self, key, config):
+        """Everything that decides the content of cleaned_{key}.csv, None when caching is off."""
+        source_path = config.get("path")
+        if self.cache is None or not source_path or not os.path.exists(source_path):
+            return None
+
+        return {
+            "dataset": key,
+            "source": self.cache.fingerprint(source_path),
+            "config": {k: int(v) for k, v in sorted(config.items()) if k in SPECS[key]["samples"]},
+            "seed": self.random_seed,
+            # The resolved backend (see process): the backends sample the same rows, but each writes its own CSV
+            "backend": config.get("backend") or self._backend_name(key, config),
+        }
+    
+    def get_xlsum_100(self, dataset_cache=None, offline=False):
+        """Download the released 100-pair cleaned XL-Sum sample, through `dataset_cache` when given."""
         url = "https://github.com/kimodri/quantifying-translationese/releases/download/v1-dataset/cleaned_xlsum.csv"
         filename = url.split("/")[-1]
         destination_path = os.path.join(self.clean_dir, filename)
 
         print(f"Downloading {filename}...")
-        try:
-            # stream=True is important for large files so they don't load into RAM at once
-            response = requests.get(url, stream=True)
-            response.raise_for_status() # Errors if link is broken (404)
+        from .Extractor import Extractor
+        # Same release as the raw datasets, verified against the same manifest
+        downloader = DownloadManager(manifest=Extractor.manifest, record=Extractor.record_path(dataset_cache),
+                                     channel=self.channel)
+        if dataset_cache is not None:
+            # Copied, not linked: cleaning or a cache restore rewrites files in clean_dir
+            results = dataset_cache.fetch_all(downloader, (url, destination_path), offline=offline, link=False)
+        else:
+            results = downloader.download_all((url, destination_path))
 
-            total_size = int(response.headers.get('content-length', 0))
-            block_size = 1024 # 1KB chunks
-
-            with open(destination_path, 'wb') as file, tqdm(
-                desc=filename,
-                total=total_size,
-                unit='iB',
-                unit_scale=True,
-                unit_divisor=1024,
-            ) as bar:
-                for data in response.iter_content(block_size):
-                    size = file.write(data)
-                    bar.update(size)
-            
-            print(f"Download complete: {destination_path}")
+        err = results[destination_path]
+        if err is None:
             return destination_path
 
-        except requests.exceptions.HTTPError as err:
+        if isinstance(err, requests.exceptions.HTTPError):
             print(f"HTTP Error: {err}")
-            if response.status_code == 404:
+            if err.response is not None and err.response.status_code == 404:
                 print("Check if the Repository is Public. Private repos require authentication.")
-        except Exception as e:
-            print(f"An error occurred: {e}")
+        else:
+            print(f"An error occurred: {err}")
 
     @staticmethod
     def _check_extension(source_path, expected_ext, dataset):
@@ -163,198 +312,57 @@ class Processor:
                 textwrap.dedent(f"The expected file extension for {dataset} is: {expected_ext}")
             ))
         
-    def _clean_paws(self, key, config):
-
-        source_path = config.get("path")
-        self._check_extension(source_path, 'csv', 'PAWS')
-        
-        destination_path = os.path.join(self.clean_dir, f"cleaned_{key}.csv")
-        df_paws = pd.read_csv(source_path)
-
-        df_paws['sentence1_length'] = df_paws['sentence1'].apply(len)
-        df_paws['sentence2_length'] = df_paws['sentence2'].apply(len)
-
-        # Filter
-        mask = (
-            (df_paws['sentence1_length'].between(21, 1999)) & 
-            (df_paws['sentence2_length'].between(21, 1999))
-        )
-        df_paws = df_paws[mask]
-
-        # Sample
-        df_true = df_paws[df_paws['label'] == 1].sample(n=config.get('true_sample'), random_state=self.random_seed)
-        df_false = df_paws[df_paws['label'] == 0].sample(n=config.get('false_sample'), random_state=self.random_seed)
-
-        df_result = pd.concat([df_true, df_false], ignore_index=True)
-        df_result.iloc[:, 0:4].to_csv(destination_path, index=False)
-
-    def _clean_bcopa(self, key, config):
-
-        source_path = config.get("path")
-        self._check_extension(source_path, 'csv', 'Balanced COPA')
-
-        destination_path = os.path.join(self.clean_dir, f"cleaned_{key}.csv")
-        df_bcopa = pd.read_csv(source_path)
-
-        df_bcopa['premise_length'] = df_bcopa['premise'].apply(len)
-        df_bcopa['choice1_length'] = df_bcopa['choice1'].apply(len)
-        df_bcopa['choice2_length'] = df_bcopa['choice2'].apply(len)
-
-        # First filter
-        first_filter_bcopa = (
-            df_bcopa['premise_length'].between(21, 1999) &
-            df_bcopa['choice1_length'].between(21, 1999) &
-            df_bcopa['choice2_length'].between(21, 1999)
-        )
-
-        df_bcopa = df_bcopa[first_filter_bcopa]
-        df_cause = df_bcopa[df_bcopa['question'] == 'cause'].sample(n=config.get("cause_sample"), random_state=self.random_seed)
-        df_effect = df_bcopa[df_bcopa['question'] == 'effect'].sample(n=config.get("effect_sample"), random_state=self.random_seed)
-
-        df_result = pd.concat([df_cause, df_effect], ignore_index=True)
-        df_result.iloc[:, 0:7].to_csv(destination_path, index=False)
-    
-    def _clean_xlsum(self, key, config):
+    def _backend_name(self, key, config):
+        override = config.get("backend") or self.backend
+        if not os.path.exists(config.get("path") or ""):
+            # Let the cleaner report the missing file
+            return override or "pandas"
+
+        name = select_backend(config.get("path"), override)
+
+        if name == "spark" and override is None and self._check_pyspark_requirements():
+            print(f"{key} is larger than the available memory but Spark is unavailable, falling back to polars.")
+            name = "polars"
+        return name
+
+    def _get_backend(self, name):
+        if name == "pandas":
+            return PandasBackend()
+        if name == "polars":
+            return PolarsBackend()
+        return SparkBackend(self._get_spark)
+
+    def _clean(self, key, config):
         """
-            Clean XL-Sum dataset using Polars.
+            Clean one dataset following its entry in Backends.SPECS.
 
-            Behaviour mirrors the original PySpark version:
-            - reads JSON (ndjson or JSON array)
-            - keeps only rows where len(text) and len(summary) are in [20, 2000]
-            - reproducible sampling using `self.random_seed`
-            - writes result to {self.clean_dir}/{key}.csv
+            The backend comes from `config['backend']`, then `self.backend`,
+            and is otherwise chosen from the file size and available memory.
         """
-        import os
-        import polars as pl
-
+        spec = SPECS[key]
         source_path = config.get("path")
-
-        # keep same extension check as before
-        self._check_extension(source_path, "jsonl", "XL-Sum")
+        if not source_path or not os.path.exists(source_path):
+            raise FileNotFoundError(f"No {spec['name']} file to clean at '{source_path}'")
+        self._check_extension(source_path, spec["extension"], spec["name"])
         destination_path = os.path.join(self.clean_dir, f"cleaned_{key}.csv")
 
-        # Robustly read NDJSON (newline-delimited) first, fallback to JSON array
-        try:
-            df = pl.read_ndjson(source_path)
-        except Exception:
-            df = pl.read_json(source_path)
-
-        # Validate required fields
-        required = {"text", "summary"}
-        if not required.issubset(set(df.columns)):
-            raise ValueError(f"XL-Sum JSON must contain columns {required}. Found: {df.columns}")
-
-       # compute lengths in a version-compatible way
-        str_ns = pl.col("summary").str
-        if hasattr(str_ns, "len_chars"):
-            summary_len_expr = pl.col("summary").str.len_chars().alias("summary_len")
-            text_len_expr = pl.col("text").str.len_chars().alias("text_len")
-        elif hasattr(str_ns, "lengths"):
-            # older polars
-            summary_len_expr = pl.col("summary").str.lengths().alias("summary_len")
-            text_len_expr = pl.col("text").str.lengths().alias("text_len")
-        else:
-            # worst-case fallback (slower): apply Python len
-            summary_len_expr = pl.col("summary").apply(lambda s: len(s) if s is not None else 0).alias("summary_len")
-            text_len_expr = pl.col("text").apply(lambda s: len(s) if s is not None else 0).alias("text_len")
-
-        df = df.with_columns([summary_len_expr, text_len_expr])
-        df = df.filter(
-            (pl.col("summary_len") >= 20) & (pl.col("text_len") >= 20) &
-            (pl.col("summary_len") <= 2000) & (pl.col("text_len") <= 2000)
-        )
-
-        # sample reproducibly
-        n = min(int(config.get("pairs_sample")), df.height)
-        df_sample = df.sample(n=n, seed=self.random_seed)
-
-        # drop helper columns once and write csv
-        df_sample = df_sample.drop(["summary_len", "text_len"])
-        df_sample.write_csv(destination_path)
-
-    def _clean_xlsum_spark(self, key, config):
-        """
-        Clean XL-Sum dataset.
-        
-        Requirements:
-        - Java JDK 8 or 11+
-        - PySpark 3.2.0+
-        - Linux, macOS, or WSL
-        
-        Args:
-            source_path: Path to the JSON file
-            key: Dataset key
-            sample: Number of samples to extract
-        """
-        # Import PySpark only when this method is called
-        import pyspark.sql.functions as F
-        from pyspark.sql.functions import rand
-        from pyspark.sql.types import StructType, StructField, StringType
-        source_path = config.get("path")
-        self._check_extension(source_path, 'json', 'XL-Sum') 
-        destination_path = os.path.join(self.clean_dir, f"{key}.csv")
-
-        schema = StructType([
-            StructField("text", StringType(), False),
-            StructField("summary", StringType(), False)
-        ])
-
-        spark = self._get_spark()
-        df_xlsum = spark.read.schema(schema).json(source_path)
-
-        df_xlsum = df_xlsum.withColumn("summary_len", F.length("summary"))
-        df_xlsum = df_xlsum.withColumn("text_len", F.length("text"))
-
-        df_xlsum = df_xlsum.filter(
-            ((F.col("summary_len") >= 20) & (F.col("text_len") >= 20)) &
-            ((F.col("summary_len") <= 2000) & (F.col("text_len") <= 2000))
-        )
-
-        # Reproducible sampling
-        df_shuffled = df_xlsum.withColumn("rand_sort_key", rand(seed=self.random_seed))
-        df_sorted = df_shuffled.orderBy("rand_sort_key")
-        df_reproducible = df_sorted.limit(config.get("pairs_sample"))
-        df_reproducible = df_reproducible.drop("rand_sort_key", "summary_len", "text_len")
-
-        pdf = df_reproducible.toPandas()
-        pdf.to_csv(destination_path, index=False)
-        
-        print(f"Successfully processed {config.get('pairs_sample')} samples to {destination_path}")
-
-    def _clean_xnli(self, key, config):
-        source_path = config.get("path")
-        self._check_extension(source_path, 'tsv', 'XNLI')
-        
-        destination_path = os.path.join(self.clean_dir, f"cleaned_{key}.csv")
-        
-        df_xnli = pd.read_csv(source_path, sep="\t")
-
-        df_xnli = df_xnli[df_xnli["language"] == "en"]
-
-        df_xnli = df_xnli[["gold_label", "sentence1", "sentence2"]]
-        df_xnli["sentence1_len"] = df_xnli["sentence1"].apply(len)
-        df_xnli["sentence2_len"] = df_xnli["sentence2"].apply(len)
-
-        first_filter_xnli = (
-            ((df_xnli['sentence1_len'] > 20) & (df_xnli['sentence1_len'] < 2000)) & 
-            ((df_xnli['sentence2_len'] > 20) & (df_xnli['sentence2_len'] < 2000))
-        )
-
-        df_xnli = df_xnli[first_filter_xnli]
-
-        df_xnli_neutral = df_xnli[df_xnli["gold_label"] == "neutral"]
-        df_xnli_contradiction = df_xnli[df_xnli["gold_label"] == "contradiction"]
-        df_xnli_entailment = df_xnli[df_xnli["gold_label"] == "entailment"]
-
-        df_xnli_neutral_sample = df_xnli_neutral.sample(config.get("neutral_sample"), random_state=Processor.random_seed)
-        df_xnli_contradiction_sample = df_xnli_contradiction.sample(config.get("contradiction_sample"), random_state=Processor.random_seed)
-        df_xnli_entailment_sample = df_xnli_entailment.sample(config.get("entailment_sample"), random_state=Processor.random_seed)
-
-        df_xnli_neutral_contradiction = pd.concat([df_xnli_neutral_sample, df_xnli_contradiction_sample], ignore_index=True)
-        df_xnli_neutral_contadiction_entailment = pd.concat([df_xnli_neutral_contradiction, df_xnli_entailment_sample], ignore_index=True)
-        df_xnli = df_xnli_neutral_contadiction_entailment.drop(columns=['sentence1_len', 'sentence2_len'])
-
-        df_xnli.to_csv(destination_path, index=False)
+        backend = self._get_backend(self._backend_name(key, config))
+        print(f"Cleaning {spec['name']} with {backend.name}...")
+        rows = backend.clean(spec, source_path, destination_path, config, self.random_seed)
+        print(f"Successfully processed {rows} samples to {destination_path}")
+        return rows
+
+
+def _run_cleaner(clean_dir, random_seed, key, config, profile=None):
+    """Entry point of the worker processes used by Processor.process(parallel=True)."""
+    start = time.perf_counter()
+    # Class attributes are not shared with spawned workers, so set the seed again
+    Processor.random_seed = random_seed
+    profiler = Profiler.StageProfiler(**profile) if profile is not None else None
+    processor = Processor(clean_dir)
+    with Profiler.stage(profiler, "clean", key):
+        rows = processor._clean(key, config)
+    return time.perf_counter() - start, rows, profiler.stages if profiler is not None else []
 
 
 def main():
@@ -0,0 +1,189 @@
+"""
+    Opt-in memory profiling of the pipeline stages (clean, translate, tag).
+
+    A StageProfiler is passed to Processor, Translator and Tagger like the
+    progress channel. Every stage and dataset they run is recorded with:
+    - its peak RSS, sampled with psutil while it runs
+    - from tracemalloc, the peak of Python allocations and the sites whose
+      live allocations grew the most over the stage (what it left behind)
+    The run is then written as one JSON report, to size containers and
+    compare runs for memory regressions.
+
+    tracemalloc slows allocation-heavy code down a few times, which is
+    why profiling is opt-in (QT_PROFILE=1 for the server, --profile for
+    Pipeline). QT_PROFILE_ALLOCATIONS=0 keeps only the cheap RSS sampling.
+    RSS belongs to the whole process: stages that ran at the same time
+    in one process are marked "overlapped", and their numbers include
+    each other's. This covers stages of other profilers too, e.g. two jobs
+    running at once.
+"""
+import os, sys, json, time, platform, functools, threading, tracemalloc
+from contextlib import contextmanager, nullcontext
+import psutil
+
+REPORT_DIR = os.environ.get("QT_PROFILE_DIR", "../cache/profiles/")
+
+# Stages running in this process, across every profiler: RSS and tracemalloc are per process
+_lock = threading.Lock()
+_active = 0
+_started = 0 # bumped whenever a stage starts, a stage overlapped if it changed while it ran
+_started_tracing = False
+
+
+class StageProfiler:
+    """Peak memory of the stages of one run (a job, a pipeline run), see the module docstring."""
+
+    def __init__(self, run_id, report_dir=REPORT_DIR, allocations=True, top=10, interval=0.02):
+        self.run_id = run_id
+        self.report_dir = report_dir
+        self.allocations = allocations
+        self.top = top
+        self.interval = interval # seconds between RSS samples
+
+        self.process = psutil.Process()
+        self.created = time.time()
+        self.stages = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, run_id):
+        """A profiler for `run_id` when QT_PROFILE=1, None otherwise."""
+        if os.environ.get("QT_PROFILE", "0") != "1":
+            return None
+        return cls(run_id, allocations=os.environ.get("QT_PROFILE_ALLOCATIONS", "1") == "1")
+
+    def _sample_rss(self, stop, peak):
+        while not stop.wait(self.interval):
+            peak[0] = max(peak[0], self.process.memory_info().rss)
+
+    def _start_tracing(self):
+        global _started_tracing
+        with _lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started_tracing = True
+            tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot()
+
+    def _stop_tracing(self, before):
+        global _started_tracing
+        after = tracemalloc.take_snapshot()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*")]
+        growth = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+        top = [
+            {"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+             "size": stat.size, "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in sorted(growth, key=lambda stat: stat.size_diff, reverse=True)[:self.top]
+            if stat.size_diff > 0
+        ]
+        with _lock:
+            # Only stop what this module started, and not under another stage
+            if _started_tracing and _active == 0:
+                tracemalloc.stop()
+                _started_tracing = False
+        return traced_peak, top
+
+    @contextmanager
+    def stage(self, stage, dataset=None):
+        """Record the block as one stage of the run: `with profiler.stage("tag", "paws"):`"""
+        global _active, _started
+        with _lock:
+            overlapped = _active > 0
+            _active += 1
+            _started += 1
+            started = _started
+
+        before = self._start_tracing() if self.allocations else None
+        rss_start = self.process.memory_info().rss
+        peak = [rss_start]
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_rss, args=(stop, peak), daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        status = "failed"
+        try:
+            yield
+            status = "done"
+        finally:
+            seconds = time.perf_counter() - start
+            stop.set()
+            sampler.join()
+            rss_end = self.process.memory_info().rss
+            with _lock:
+                _active -= 1
+                overlapped = overlapped or _started != started
+
+            record = {
+                "stage": stage,
+                "dataset": dataset,
+                "status": status,
+                "pid": os.getpid(),
+                "seconds": seconds,
+                "rss_start": rss_start,
+                "rss_peak": max(peak[0], rss_end),
+                "rss_end": rss_end,
+                "rss_peak_delta": max(peak[0], rss_end) - rss_start,
+                "overlapped": overlapped,
+            }
+            if before is not None:
+                record["traced_peak"], record["top_allocations"] = self._stop_tracing(before)
+            self.add(record)
+
+    def add(self, record):
+        """Add a stage recorded elsewhere, e.g. by a profiler in a worker process."""
+        with self.lock:
+            self.stages.append(record)
+
+    def report(self):
+        with self.lock:
+            stages = list(self.stages)
+        return {
+            "run": self.run_id,
+            "created": self.created,
+            "pid": os.getpid(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "total_memory": psutil.virtual_memory().total,
+            "allocations": self.allocations,
+            "peak_rss": max((stage["rss_peak"] for stage in stages), default=None),
+            "stages": stages,
+        }
+
+    def write(self, path=None):
+        """Write the report as JSON, to `report_dir`/<run id>.json by default. Returns the path."""
+        path = path or os.path.join(self.report_dir, f"{self.run_id}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+
+def stage(profiler, name, dataset=None):
+    """profiler.stage(name, dataset), or a no-op when profiling is off (profiler is None)."""
+    return profiler.stage(name, dataset) if profiler is not None else nullcontext()
+
+
+def each_dataset(name, datasets):
+    """
+        Profile a `method(self, ..., **datasets)` one dataset at a time.
+
+        For methods that handle every dataset keyword on its own, like the
+        Translator engines. With `self.profiler` set, the method is called
+        once per dataset inside its own stage. Keywords that are not
+        datasets go to every call. Otherwise it runs unchanged.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            names = [key for key in kwargs if key in datasets]
+            if self.profiler is None or not names:
+                return method(self, *args, **kwargs)
+
+            options = {key: value for key, value in kwargs.items() if key not in datasets}
+            for dataset in names:
+                with self.profiler.stage(name, dataset):
+                    method(self, *args, **options, **{dataset: kwargs[dataset]})
+        return wrapper
+    return decorator
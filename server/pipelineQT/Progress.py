@@ -0,0 +1,120 @@
+import time, queue, threading
+from collections import OrderedDict
+from tqdm import tqdm
+
+
+class ProgressBus:
+    """
+        In-process publish/subscribe of progress events, one channel per job.
+
+        Subscribers get a bounded queue. A slow subscriber loses the oldest
+        events instead of slowing down the pipeline. The latest event of every
+        stage is kept so late subscribers start from the current state.
+        Sinks (`add_sink`) get every event too, e.g. to share it with other
+        server processes through the jobs database.
+    """
+
+    MAX_QUEUED = 256
+    MAX_CLOSED = 256 # finished channels remembered for late subscribers
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.latest = OrderedDict()
+        self.sinks = []
+
+    def add_sink(self, sink):
+        """Call `sink(channel, event)` for every published event."""
+        self.sinks.append(sink)
+
+    def publish(self, channel, event):
+        with self.lock:
+            self.latest.setdefault(channel, OrderedDict())[event.get("stage")] = event
+            subscribers = list(self.subscribers.get(channel, ()))
+
+        for sink in self.sinks:
+            sink(channel, event)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(event)
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue(maxsize=ProgressBus.MAX_QUEUED)
+        with self.lock:
+            self.subscribers.setdefault(channel, []).append(subscriber)
+            for event in self.latest.get(channel, {}).values():
+                subscriber.put_nowait(event)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(channel, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self.subscribers.pop(channel, None)
+
+    def close(self, channel, status="done"):
+        """Tell the subscribers of `channel` that no more events will come."""
+        self.publish(channel, {"type": "end", "stage": None, "status": status})
+        with self.lock:
+            # Only the end event is needed after this, forget the oldest channels
+            self.latest[channel] = OrderedDict({None: self.latest[channel][None]})
+            self.latest.move_to_end(channel)
+            while len(self.latest) > ProgressBus.MAX_CLOSED:
+                self.latest.popitem(last=False)
+
+
+bus = ProgressBus()
+
+
+class ProgressBar(tqdm):
+    """
+        tqdm bar that also publishes its state to `bus` on `channel`.
+
+        Events carry the stage name, items done, total, unit, throughput and
+        ETA, and are sent at most every `publish_interval` seconds. Without a
+        channel it is a plain tqdm bar.
+    """
+
+    def __init__(self, *args, channel=None, publish_interval=0.1, **kwargs):
+        self.channel = channel
+        self.publish_interval = publish_interval
+        self.last_publish = 0.0
+        super().__init__(*args, **kwargs)
+
+    def _publish(self):
+        info = self.format_dict
+        rate = info["rate"] or (info["n"] / info["elapsed"] if info["elapsed"] else None)
+        total = info["total"]
+        bus.publish(self.channel, {
+            "type": "progress",
+            "stage": info["prefix"] or "Working",
+            "n": info["n"],
+            "total": total,
+            "unit": info["unit"],
+            "rate": rate,
+            "eta": (total - info["n"]) / rate if rate and total else None,
+            "elapsed": info["elapsed"],
+        })
+
+    def update(self, n=1):
+        displayed = super().update(n)
+        if self.channel is not None:
+            now = time.monotonic()
+            if now - self.last_publish >= self.publish_interval:
+                self.last_publish = now
+                self._publish()
+        return displayed
+
+    def close(self):
+        if self.channel is not None and not self.disable:
+            self._publish()
+        super().close()
@@ -0,0 +1,84 @@
+import sys
+import pandas as pd
+
+# Columns shared by the raw, cleaned, translated and tagged datasets
+TEXT_COLUMNS = {"sentence1", "sentence2", "premise", "choice1", "choice2", "text", "summary"}
+LABEL_COLUMNS = {"label", "gold_label", "question", "mirrored", "language"}
+FORM_DTYPE = "int8" # 0 = DKA, 1 = KA, 2 = Ambiguous
+
+
+def string_dtype():
+    """Arrow-backed strings when pyarrow is installed, pandas' own string dtype otherwise."""
+    try:
+        import pyarrow  # noqa: F401
+        return "string[pyarrow]"
+    except ImportError:
+        return "string"
+
+
+def apply_schema(df):
+    """
+        Convert a loaded dataset to compact dtypes.
+
+        - text columns become (Arrow-backed) strings
+        - labels become categoricals
+        - *_form columns become int8
+        - the remaining integer columns (e.g. id) are downcast
+    """
+    text_dtype = string_dtype()
+    for column in df.columns:
+        if column in TEXT_COLUMNS:
+            df[column] = df[column].astype(text_dtype)
+        elif column in LABEL_COLUMNS:
+            df[column] = df[column].astype("category")
+        elif column.endswith("_form"):
+            df[column] = df[column].astype(FORM_DTYPE)
+        elif pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
+
+
+def read_dataset(source, sep=",", lines=False):
+    """
+        Load a dataset (path or file-like) with the compact dtypes.
+
+        Set `lines=True` for NDJSON, otherwise the source is read as CSV/TSV.
+    """
+    if lines:
+        df = pd.read_json(source, lines=True)
+    else:
+        df = pd.read_csv(source, sep=sep)
+    return apply_schema(df)
+
+
+def memory_report(source, sep=",", lines=False):
+    """Bytes per row of `source` with the default pandas dtypes and with the schema applied."""
+    if lines:
+        df = pd.read_json(source, lines=True)
+    else:
+        df = pd.read_csv(source, sep=sep)
+
+    rows = max(len(df), 1)
+    before = int(df.memory_usage(deep=True).sum())
+    after = int(apply_schema(df).memory_usage(deep=True).sum())
+
+    return {
+        "rows": len(df),
+        "bytes_per_row_before": before / rows,
+        "bytes_per_row_after": after / rows,
+        "reduction": 1 - after / before if before else 0.0,
+    }
+
+
+def main():
+    print("| file | rows | bytes/row before | bytes/row after | saved |")
+    print("|---|---|---|---|---|")
+    for path in sys.argv[1:]:
+        report = memory_report(path, sep="\t" if path.endswith(".tsv") else ",", lines=path.endswith(".jsonl"))
+        print(
+            f"| {path} | {report['rows']} | {report['bytes_per_row_before']:.0f} "
+            f"| {report['bytes_per_row_after']:.0f} | {report['reduction']:.0%} |"
+        )
+
+if __name__ == "__main__":
+    main()
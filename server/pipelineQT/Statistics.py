@@ -0,0 +1,235 @@
+"""
+    Significance of the form differences between translation engines.
+
+    The tagged CSVs of one dataset have a form code per row for every
+    engine (0 = DKA, 1 = KA, 2 = ambiguous, see Schema.FORM_DTYPE). Their
+    rows are the same source sentences, matched on the `id` column, so the
+    engines are compared paired:
+    - bootstrap() resamples the rows and gives, per engine, an interval of
+      the DKA rate and, per pair of engines, an interval and p-value of
+      the difference between their rates
+    - chi_square() tests whether the form distribution is the same for
+      every engine, from the counts alone
+
+    Resampling rows only changes how often each combination of forms
+    (one form per engine) occurs. With K engines there are at most 3**K
+    combinations. A bootstrap resample of n rows is therefore one
+    multinomial draw of n over the combinations, at their observed
+    frequencies. All resamples are drawn as one (resamples x combinations)
+    array, so 10,000 resamples cost the same for 1,000 rows as for a
+    million.
+
+        cd server
+        python -m pipelineQT.Statistics paws google=../runs/study/tagged/google/paws.csv \\
+            deepl=../runs/study/tagged/deepl/paws.csv opus=../runs/study/tagged/opus/paws.csv
+"""
+import math, argparse
+from itertools import combinations
+import numpy as np
+
+FORMS = ["di_karaniwang_ayos", "karaniwang_ayos", "ambiguous"] # by form code, as in Tagger.get_counts
+RESAMPLES = 10000
+
+
+def load_forms(paths):
+    """
+        Per-row form codes of tagged CSVs, given as {engine: path}.
+
+        Returns ({segment: {engine: int8 array}}, paired), segments named
+        like the Tagger results (sentence_1_form -> tags_sentence_1).
+
+        When every CSV has the same unique ids, the rows are put in the
+        order of the first CSV's ids and `paired` is True. Different ids
+        leave the rows as they are and `paired` False. Datasets without an
+        `id` column (xlsum, xnli) are paired by position when the row
+        counts match, as the tagged CSVs of a run all keep the row order of
+        the same cleaned CSV.
+    """
+    from .Schema import read_dataset
+
+    frames = {engine: read_dataset(path) for engine, path in paths.items()}
+    has_id = ["id" in df.columns for df in frames.values()]
+    if all(has_id) and frames:
+        ids = [df["id"] for df in frames.values()]
+        reference = ids[0]
+        paired = reference.is_unique and all(
+            other.is_unique and len(other) == len(reference) and other.isin(reference).all() for other in ids[1:]
+        )
+        if paired:
+            frames = {engine: df.set_index("id").loc[reference].reset_index() for engine, df in frames.items()}
+    elif any(has_id):
+        paired = False
+    else:
+        paired = len({len(df) for df in frames.values()}) == 1
+
+    forms = {}
+    for engine, df in frames.items():
+        for column in df.columns:
+            if column.endswith("_form"):
+                segment = "tags_" + column[:-len("_form")]
+                forms.setdefault(segment, {})[engine] = df[column].to_numpy(dtype=np.int8)
+    return forms, paired
+
+
+def _percentiles(samples, confidence):
+    return np.quantile(samples, [(1 - confidence) / 2, (1 + confidence) / 2], axis=0)
+
+
+def bootstrap(forms, form=0, resamples=RESAMPLES, confidence=0.95, seed=42, paired=True):
+    """
+        Paired bootstrap of the rate of `form` (DKA by default) across engines.
+
+        `forms` is {engine: form codes}, rows at the same position being
+        the same sentence (see load_forms). The engines are paired row by
+        row when `paired` and they have the same number of rows, resampled
+        independently otherwise. An engine without rows has NaN for its
+        rate, interval and differences.
+
+        Returns {"paired", "rows", "rates": {engine: rate}, "intervals":
+        {engine: [low, high]}, "differences": {"a-b": {"difference",
+        "interval", "p_value"}}}. A difference is rate(a) - rate(b), and its
+        p-value is two-sided, from the share of resamples on the other side
+        of 0 (never below 2 / (resamples + 1)).
+    """
+    engines = list(forms)
+    codes = [np.asarray(forms[engine], dtype=np.int64) for engine in engines]
+    rng = np.random.default_rng(seed)
+    sizes = {len(c) for c in codes}
+    paired = paired and len(sizes) == 1 and 0 not in sizes
+
+    if paired:
+        n = len(codes[0])
+        # Combination of forms of every row, as a base-3 number with one digit per engine
+        combination = sum(c * 3 ** k for k, c in enumerate(codes))
+        observed, frequency = np.unique(combination, return_counts=True)
+        draws = rng.multinomial(n, frequency / n, size=resamples)
+        # has_form[i, k]: combination i has `form` for engine k
+        has_form = np.stack([(observed // 3 ** k) % 3 == form for k in range(len(engines))], axis=1)
+        samples = draws @ has_form / n
+    else:
+        samples = np.stack([rng.binomial(len(c), np.mean(c == form), size=resamples) / len(c) if len(c)
+                            else np.full(resamples, np.nan) for c in codes], axis=1)
+
+    rates = np.array([np.mean(c == form) if len(c) else np.nan for c in codes])
+    low, high = _percentiles(samples, confidence)
+    result = {
+        "paired": paired,
+        "rows": {engine: len(c) for engine, c in zip(engines, codes)},
+        "rates": {engine: float(rate) for engine, rate in zip(engines, rates)},
+        "intervals": {engine: [float(lo), float(hi)] for engine, lo, hi in zip(engines, low, high)},
+        "differences": {},
+    }
+    for a, b in combinations(range(len(engines)), 2):
+        difference = samples[:, a] - samples[:, b]
+        lo, hi = _percentiles(difference, confidence)
+        tail = min(np.count_nonzero(difference <= 0), np.count_nonzero(difference >= 0))
+        p_value = min(1.0, 2 * (tail + 1) / (resamples + 1)) if np.isfinite(rates[[a, b]]).all() else np.nan
+        result["differences"][f"{engines[a]}-{engines[b]}"] = {
+            "difference": float(rates[a] - rates[b]),
+            "interval": [float(lo), float(hi)],
+            "p_value": float(p_value),
+        }
+    return result
+
+
+def count_intervals(counts, resamples=RESAMPLES, confidence=0.95, seed=42):
+    """
+        Bootstrap intervals of the counts of one engine and segment, from the counts alone.
+
+        `counts` is {category: count} as in Tagger.get_counts. Returns
+        {category: [low, high]}.
+    """
+    names = list(counts)
+    values = np.array([counts[name] for name in names], dtype=np.int64)
+    n = values.sum()
+    if n == 0:
+        return {name: [0, 0] for name in names}
+    draws = np.random.default_rng(seed).multinomial(n, values / n, size=resamples)
+    low, high = _percentiles(draws, confidence)
+    return {name: [float(lo), float(hi)] for name, lo, hi in zip(names, low, high)}
+
+
+def chi2_sf(x, df):
+    """
+        P(X >= x) for X chi-square with an integer `df`, without scipy.
+
+        Starts from the closed forms for 1 and 2 degrees of freedom and adds
+        Q(k + 2) = Q(k) + (x/2)^(k/2) e^(-x/2) / Gamma(k/2 + 1).
+    """
+    if x <= 0:
+        return 1.0
+    half = x / 2
+    if df % 2:
+        q, k = math.erfc(math.sqrt(half)), 1
+    else:
+        q, k = math.exp(-half), 2
+    while k < df:
+        q += math.exp(k / 2 * math.log(half) - half - math.lgamma(k / 2 + 1))
+        k += 2
+    return min(1.0, q)
+
+
+def chi_square(counts):
+    """
+        Chi-square test that every engine has the same form distribution.
+
+        `counts` is {engine: {category: count}}. Categories no engine has
+        are left out. Returns {"statistic", "df", "p_value"}. It treats the
+        engines as independent samples, so with paired rows it is the
+        conservative, counts-only check next to bootstrap().
+    """
+    categories = sorted({category for by_category in counts.values() for category in by_category})
+    table = np.array([[by_category.get(category, 0) for category in categories] for by_category in counts.values()],
+                     dtype=float)
+    table = table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+    df = (table.shape[0] - 1) * (table.shape[1] - 1) if table.size else 0
+    if df == 0:
+        return {"statistic": 0.0, "df": 0, "p_value": 1.0}
+
+    expected = table.sum(axis=1, keepdims=True) * table.sum(axis=0, keepdims=True) / table.sum()
+    statistic = float(((table - expected) ** 2 / expected).sum())
+    return {"statistic": statistic, "df": df, "p_value": chi2_sf(statistic, df)}
+
+
+def compare(paths, resamples=RESAMPLES, confidence=0.95, seed=42):
+    """
+        bootstrap() and chi_square() of every segment of a dataset, tagged CSVs given as {engine: path}.
+
+        Returns {segment: {"bootstrap": ..., "chi_square": ...}}.
+    """
+    results = {}
+    by_segment, paired = load_forms(paths)
+    for segment, forms in by_segment.items():
+        counts = {engine: dict(zip(FORMS, np.bincount(codes, minlength=len(FORMS)).tolist()))
+                  for engine, codes in forms.items()}
+        results[segment] = {
+            "bootstrap": bootstrap(forms, resamples=resamples, confidence=confidence, seed=seed, paired=paired),
+            "chi_square": chi_square(counts),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", help="name shown in the table, e.g. paws")
+    parser.add_argument("tagged", nargs="+", help="engine=path of a tagged CSV")
+    parser.add_argument("--resamples", type=int, default=RESAMPLES)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    paths = dict(item.split("=", 1) for item in args.tagged)
+    results = compare(paths, resamples=args.resamples, confidence=args.confidence, seed=args.seed)
+
+    print("| dataset | segment | engines | DKA rate difference | interval | bootstrap p | chi-square | chi-square p |")
+    print("|---|---|---|---|---|---|---|---|")
+    for segment, result in results.items():
+        chi = result["chi_square"]
+        for pair, difference in result["bootstrap"]["differences"].items():
+            lo, hi = difference["interval"]
+            print(f"| {args.dataset} | {segment} | {pair} | {difference['difference']:+.3f} | {lo:+.3f} to {hi:+.3f} "
+                  f"| {difference['p_value']:.4f} | {chi['statistic']:.2f} (df {chi['df']}) | {chi['p_value']:.4f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import os, time, sqlite3
+from collections import defaultdict
+
+
+class ResultsStore:
+    """
+        SQLite store of the per-segment counts of every tagging run.
+
+        A run is one Tagger call, stamped with the model and rule version.
+        Every count row carries its engine, dataset, segment and category,
+        indexed so cross-engine/dataset queries are answered from the store
+        without reading the tagged CSVs again.
+    """
+
+    def __init__(self, db_path="../cache/results.sqlite3"):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created REAL NOT NULL,
+                    model TEXT NOT NULL,
+                    rules INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS counts (
+                    run_id INTEGER NOT NULL REFERENCES runs (id),
+                    engine TEXT NOT NULL,
+                    dataset TEXT NOT NULL,
+                    segment TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    count INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS counts_engine_dataset ON counts (engine, dataset, run_id);
+                CREATE INDEX IF NOT EXISTS counts_dataset_segment ON counts (dataset, segment);
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, results, engines, model, rules):
+        """
+            Store one tagging run and return its id.
+
+            `results` is the Tagger output ({dataset: {segment: {category: count}}})
+            and `engines` maps every dataset to the engine that translated it.
+        """
+        with self._connect() as conn:
+            run_id = conn.execute(
+                "INSERT INTO runs (created, model, rules) VALUES (?, ?, ?)", (time.time(), model, rules)
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO counts (run_id, engine, dataset, segment, category, count) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (run_id, engines[dataset], dataset, segment, category, int(count))
+                    for dataset, segments in results.items()
+                    for segment, counts in segments.items()
+                    for category, count in counts.items()
+                ],
+            )
+        return run_id
+
+    def query(self, datasets=None, engines=None, model=None):
+        """
+            Latest counts of every (engine, dataset), optionally filtered.
+
+            Returns {dataset: {engine: {segment: {category: count}}}}.
+        """
+        filters, params = [], []
+        for column, values in (("dataset", datasets), ("engine", engines)):
+            if values:
+                filters.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        if model:
+            filters.append("run_id IN (SELECT id FROM runs WHERE model = ?)")
+            params.append(model)
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+
+        with self._connect() as conn:
+            rows = conn.execute(f"""
+                SELECT c.engine, c.dataset, c.segment, c.category, c.count
+                FROM counts c
+                JOIN (
+                    SELECT engine, dataset, MAX(run_id) AS run_id
+                    FROM counts {where}
+                    GROUP BY engine, dataset
+                ) latest USING (engine, dataset, run_id)
+            """, params).fetchall()
+
+        nested = defaultdict(lambda: defaultdict(dict))
+        for row in rows:
+            nested[row["dataset"]][row["engine"]].setdefault(row["segment"], {})[row["category"]] = row["count"]
+        return {dataset: dict(engines) for dataset, engines in nested.items()}
+
+    def runs(self, limit=50):
+        """The most recent runs with the engines and datasets they covered."""
+        with self._connect() as conn:
+            rows = conn.execute("""
+                SELECT r.id, r.created, r.model, r.rules,
+                       GROUP_CONCAT(DISTINCT c.engine) AS engines,
+                       GROUP_CONCAT(DISTINCT c.dataset) AS datasets
+                FROM runs r JOIN counts c ON c.run_id = r.id
+                GROUP BY r.id
+                ORDER BY r.id DESC
+                LIMIT ?
+            """, (limit,)).fetchall()
+        return [dict(row) for row in rows]
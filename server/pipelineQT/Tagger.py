@@ -1,13 +1,70 @@
-import calamancy, os, textwrap
+import os, time, textwrap, threading
+import numpy as np
 import pandas as pd
 from .Errors import FileNameError, NoDatasetError, IncorrectDatasetError
+from .Schema import read_dataset, FORM_DTYPE
+from .Progress import ProgressBar
+from .Estimator import FormEstimator
+from . import Metrics, Profiler, Tiers
 from collections import Counter
 import json
 import logging  # Import logging library
 
 class Tagger:
 
-    def __init__(self, tag_dir="../datasets_sample/tagged/", log_file="tagger_process.log"):
+    # calamanCy model per tier, fastest first (see Tiers.py)
+    TIERS = Tiers.TIERS
+    TIER = Tiers.TIER
+    MODEL = TIERS[TIER]
+    # The form rule only reads tokens and their POS (tagger/morphologizer), these are never loaded
+    EXCLUDE = ["parser", "ner", "lemmatizer", "trainable_lemmatizer"]
+    # Bump when the form rule in _get_sentence_form changes, cached results keyed on it are dropped.
+    # 2: the parser is excluded, sentences are split by the sentencizer alone
+    RULE_VERSION = 2
+    # Sentences _tag_forms hands to get_forms (and nlp.pipe) at a time, the progress bar moves once per chunk
+    CHUNK_SIZE = 1024
+
+    # model name -> (nlp, tagger), shared by every Tagger in the process. Loaded
+    # before forking (see wsgi.py), the workers share it copy-on-write.
+    _models = {}
+    _models_lock = threading.Lock()
+
+    # Doc.to_array columns the form rule reads, and the ORTH and POS of "ay" it looks for.
+    # Set by the first load_model, spaCy is only imported there
+    _RULE_ATTRS = None
+    _AY = None
+    _PART = None
+
+    model_of = staticmethod(Tiers.model_of)
+    installed_tiers = staticmethod(Tiers.installed_tiers)
+
+    @classmethod
+    def load_model(cls, model=None):
+        """The calamancy pipeline and tagger for `model`, loaded once per process."""
+        model = model or cls.MODEL
+        with cls._models_lock:
+            if model not in cls._models:
+                # Imported here, spaCy alone takes seconds: processes that never tag don't pay for it
+                import calamancy
+
+                nlp = calamancy.load(model, exclude=cls.EXCLUDE)
+                if cls._RULE_ATTRS is None:
+                    from spacy.attrs import ORTH, POS
+                    from spacy.symbols import PART
+                    cls._AY, cls._PART = np.uint64(nlp.vocab.strings["ay"]), np.uint64(PART)
+                    cls._RULE_ATTRS = [ORTH, POS]
+                if "sentencizer" not in nlp.pipe_names:
+                    nlp.add_pipe("sentencizer", first=True)
+
+                # Same output as calamancy.Tagger(model), which would load a second, full copy of the model
+                def tagger(text, nlp=nlp):
+                    return [(token.text, (token.pos_, token.tag_)) for token in nlp(text)]
+
+                cls._models[model] = (nlp, tagger)
+        return cls._models[model]
+
+    def __init__(self, tag_dir="../datasets_sample/tagged/", log_file="tagger_process.log", channel=None, store=None,
+                 profiler=None, tier=None, estimate_width=None):
         # Configure logging to write to a file and the console
         logging.basicConfig(
             level=logging.INFO,
@@ -20,18 +77,31 @@ class Tagger:
         self.logger = logging.getLogger(__name__)
         
         # --- 2. INITIALIZATION LOGS ---
+        # Progress bus channel (usually the job id) the tagging loops publish to
+        self.channel = channel
+        # Optional ResultsStore every run's counts are recorded in
+        self.store = store
+        # Optional StageProfiler recording the memory of every dataset tagged
+        self.profiler = profiler
         self.tag_dir = tag_dir
         if not os.path.exists(self.tag_dir):
             self.logger.info(f"Directory {self.tag_dir} not found. Creating it.")
             os.makedirs(self.tag_dir)
 
-        self.logger.info("Loading Calamancy model (tl_calamancy_md-0.2.0)...")
-        self.nlp = calamancy.load("tl_calamancy_md-0.2.0")
-        self.tagger = calamancy.Tagger("tl_calamancy_md-0.2.0")
-        
-        if "sentencizer" not in self.nlp.pipe_names:
-            self.logger.debug("Adding 'sentencizer' to pipeline.")
-            self.nlp.add_pipe("sentencizer", first=True)
+        # Speed/accuracy trade-off of this tagger, one of TIERS
+        self.tier = tier or Tagger.TIER
+        self.model = Tagger.model_of(self.tier)
+        self.logger.info(f"Loading Calamancy model ({self.model})...")
+        self.nlp, self.tagger = Tagger.load_model(self.model)
+        # Bound once, labels() per sentence would cost more than the observation
+        self._sentence_seconds = Metrics.MODEL_CALL_SECONDS.labels(model=self.model, call="sentence")
+        self._batch_seconds = Metrics.MODEL_CALL_SECONDS.labels(model=self.model, call="batch")
+        self._tagged_sentences = Metrics.TAGGED_SENTENCES.labels(model=self.model)
+
+        # With a width (e.g. 0.02 = ±1%) the counts are estimated from a sample of every segment,
+        # see Estimator.py. The intervals and the fraction tagged of the last run are in `estimates`
+        self.estimator = FormEstimator(self, width=estimate_width) if estimate_width else None
+        self.estimates = {}
             
         self.logger.info("Tagger initialized successfully.")
 
@@ -54,6 +124,7 @@ class Tagger:
         }
 
         all_results = {}
+        self.estimates = {}
 
         for key, args in kwargs.items():
             if key not in dispatch:
@@ -64,7 +135,8 @@ class Tagger:
             self.logger.info(f"Processing dataset '{key}' from source: {source_path}")
             
             try:
-                dataset_output = dispatch[key](source_path, key, is_csv=is_csv)
+                with Profiler.stage(self.profiler, "tag", key):
+                    dataset_output = dispatch[key](source_path, key, is_csv=is_csv)
                 all_results[key] = dataset_output
                 self.logger.info(f"Completed processing '{key}'.")
             except Exception as e:
@@ -75,19 +147,38 @@ class Tagger:
         self.logger.debug(f"Source paths processed: {values}")
         
         try:
-            value_name = values[0].split("/")[-1].split("_")[0]
+            value_name = self._engine(values[0])
             destination_path = os.path.join(self.tag_dir, f"{value_name}result.json")
 
             self.logger.info(f"Writing results to JSON at {destination_path}")
             with open(destination_path, "w", encoding="utf-8") as f:
                 json.dump(all_results, f, indent=4, ensure_ascii=False)
+            if self.estimates:
+                estimates_path = os.path.join(self.tag_dir, f"{value_name}estimates.json")
+                with open(estimates_path, "w", encoding="utf-8") as f:
+                    json.dump(self.estimates, f, indent=4)
         except Exception as e:
             self.logger.error(f"Error saving JSON results: {e}")
             raise e
 
+        if self.store is not None and self.estimator is not None:
+            # The store holds exact counts only, /compare would mix the two
+            self.logger.info("Estimated counts are not recorded in the results store.")
+        elif self.store is not None:
+            engines = {key: self._engine(source) for key, source in kwargs.items()}
+            run_id = self.store.record(all_results, engines, self.model, Tagger.RULE_VERSION)
+            self.logger.info(f"Recorded run {run_id} in the results store.")
+
         self.logger.info("Tagging process completed successfully.")
         return all_results
 
+    @staticmethod
+    def _engine(source):
+        """The engine prefix of a source name, e.g. google_translated_paws.csv -> google."""
+        # Sources are paths or uploaded buffers that carry their original filename
+        source_name = source if isinstance(source, str) else getattr(source, "filename", "")
+        return source_name.split("/")[-1].split("_")[0]
+
     @staticmethod
     def get_counts(tag_list):
         counts = Counter(tag_list)
@@ -110,8 +201,15 @@ class Tagger:
             # self.logger.warning(f"Encountered non-string text input: {text}")
             return 2 
 
-        data = list(self.tagger(text))
-        first_index = next((i for i, (word, (pos, _)) in enumerate(data) if word == "ay" and pos == "PART"), None)
+        start = time.perf_counter()
+        doc = self.nlp(text)
+        self._sentence_seconds.observe(time.perf_counter() - start)
+        return self._doc_form(doc)
+
+    @staticmethod
+    def _form(tokens):
+        """The form of a sentence given its (word, POS) pairs. The reference for _doc_form(s)."""
+        first_index = next((i for i, (word, pos) in enumerate(tokens) if word == "ay" and pos == "PART"), None)
 
         if first_index is None:
             return 1 # KA
@@ -121,18 +219,96 @@ class Tagger:
             else:
                 return 2 # Ambiguous
 
+    @staticmethod
+    def _doc_form(doc):
+        """_form of a parsed Doc, read from its ORTH/POS array instead of Token objects."""
+        if len(doc) == 0:
+            return 1 # KA
+        array = doc.to_array(Tagger._RULE_ATTRS)
+        hits = (array[:, 0] == Tagger._AY) & (array[:, 1] == Tagger._PART)
+        first = int(hits.argmax())
+        if not hits[first]:
+            return 1 # KA
+        return 2 if first == 0 else 0 # Ambiguous, DKA
+
+    @staticmethod
+    def _doc_forms(docs):
+        """
+            _form of many parsed Docs at once.
+
+            The ORTH/POS arrays of the batch are stacked, the "ay" particles
+            found in one pass, and each doc's first one located with a
+            searchsorted over the doc start offsets.
+        """
+        arrays = [doc.to_array(Tagger._RULE_ATTRS) for doc in docs]
+        if not arrays:
+            return []
+        lengths = np.fromiter((len(array) for array in arrays), dtype=np.int64, count=len(arrays))
+        starts = np.cumsum(lengths) - lengths
+        array = np.concatenate(arrays)
+        hits = np.flatnonzero((array[:, 0] == Tagger._AY) & (array[:, 1] == Tagger._PART))
+
+        # First hit at or after each start, the sentinel past the end when there is none
+        first = np.append(hits, lengths.sum())[np.searchsorted(hits, starts)]
+        found = first < starts + lengths
+        return np.where(found, np.where(first == starts, 2, 0), 1).tolist()
+
+    def get_forms(self, texts, batch_size=64):
+        """_get_sentence_form for many texts, run through the model together with nlp.pipe."""
+        forms = [2] * len(texts)
+        valid = [i for i, text in enumerate(texts) if isinstance(text, str)]
+
+        start = time.perf_counter()
+        docs = list(self.nlp.pipe((texts[i] for i in valid), batch_size=batch_size))
+        for i, form in zip(valid, self._doc_forms(docs)):
+            forms[i] = form
+        self._batch_seconds.observe(time.perf_counter() - start)
+        self._tagged_sentences.inc(len(texts))
+        return forms
+
+    def _tag_forms(self, texts, desc):
+        """get_forms over a column in chunks, publishing progress when the tagger has a channel."""
+        values = texts.to_list()
+        forms = []
+        with ProgressBar(total=len(values), desc=desc, unit="sentence",
+                         channel=self.channel, disable=self.channel is None) as bar:
+            for start in range(0, len(values), Tagger.CHUNK_SIZE):
+                chunk = values[start:start + Tagger.CHUNK_SIZE]
+                forms.extend(self.get_forms(chunk))
+                bar.update(len(chunk))
+        return pd.Series(forms, index=texts.index, dtype=FORM_DTYPE)
+
+    def _estimate_segments(self, dataset, **segments):
+        """
+            get_counts of every segment (name -> texts) estimated from a sample,
+            their intervals and fraction tagged go to estimates[dataset].
+        """
+        counts = {}
+        for segment, texts in segments.items():
+            result = self.estimator.estimate(texts)
+            counts[segment] = result.pop("counts")
+            for key in ("proportions", "proportion_intervals", "seconds"):
+                result.pop(key)
+            self.estimates.setdefault(dataset, {})[segment] = result
+        self.logger.info(f"Estimated the {dataset} counts, no tagged CSV is written for a sample.")
+        return counts
+
     def tag_bcopa(self, source, filename, is_csv=False):
         # Specific logging for file operations
         self.logger.info(f"Reading BCOPA file: {source}")
         self.validate_filename(filename)
         destination_path = os.path.join(self.tag_dir, f"{filename}.csv")
         
-        df_bcopa = pd.read_csv(source)
+        df_bcopa = read_dataset(source)
         self.logger.info(f"Loaded BCOPA dataframe with {len(df_bcopa)} rows.")
 
-        df_bcopa["premise_form"] = df_bcopa["premise"].apply(self._get_sentence_form)
-        df_bcopa["choice1_form"] = df_bcopa["choice1"].apply(self._get_sentence_form)
-        df_bcopa["choice2_form"] = df_bcopa["choice2"].apply(self._get_sentence_form)
+        if self.estimator is not None:
+            return self._estimate_segments(filename, tags_premise=df_bcopa["premise"],
+                                           tags_choice1=df_bcopa["choice1"], tags_choice2=df_bcopa["choice2"])
+
+        df_bcopa["premise_form"] = self._tag_forms(df_bcopa["premise"], "Tagging BCOPA premise")
+        df_bcopa["choice1_form"] = self._tag_forms(df_bcopa["choice1"], "Tagging BCOPA choice1")
+        df_bcopa["choice2_form"] = self._tag_forms(df_bcopa["choice2"], "Tagging BCOPA choice2")
 
         if is_csv == False:
             self.logger.info(f"Saving tagged BCOPA CSV to {destination_path}")
@@ -149,11 +325,15 @@ class Tagger:
         self.validate_filename(filename)
         destination_path = os.path.join(self.tag_dir, f"{filename}.csv")
         
-        df_paws = pd.read_csv(source)
+        df_paws = read_dataset(source)
         self.logger.info(f"Loaded PAWS dataframe with {len(df_paws)} rows.")
 
-        df_paws["sentence_1_form"] = df_paws["sentence1"].apply(self._get_sentence_form)
-        df_paws["sentence_2_form"] = df_paws["sentence2"].apply(self._get_sentence_form)
+        if self.estimator is not None:
+            return self._estimate_segments(filename, tags_sentence_1=df_paws["sentence1"],
+                                           tags_sentence_2=df_paws["sentence2"])
+
+        df_paws["sentence_1_form"] = self._tag_forms(df_paws["sentence1"], "Tagging PAWS sentence1")
+        df_paws["sentence_2_form"] = self._tag_forms(df_paws["sentence2"], "Tagging PAWS sentence2")
 
         if is_csv == False:
             self.logger.info(f"Saving tagged PAWS CSV to {destination_path}")
@@ -169,11 +349,15 @@ class Tagger:
         self.validate_filename(filename)
         destination_path = os.path.join(self.tag_dir, f"{filename}.csv")
         
-        df_xnli = pd.read_csv(source)
+        df_xnli = read_dataset(source)
         self.logger.info(f"Loaded XNLI dataframe with {len(df_xnli)} rows.")
 
-        df_xnli["sentence_1_form"] = df_xnli["sentence1"].apply(self._get_sentence_form)
-        df_xnli["sentence_2_form"] = df_xnli["sentence2"].apply(self._get_sentence_form)
+        if self.estimator is not None:
+            return self._estimate_segments(filename, tags_sentence_1=df_xnli["sentence1"],
+                                           tags_sentence_2=df_xnli["sentence2"])
+
+        df_xnli["sentence_1_form"] = self._tag_forms(df_xnli["sentence1"], "Tagging XNLI sentence1")
+        df_xnli["sentence_2_form"] = self._tag_forms(df_xnli["sentence2"], "Tagging XNLI sentence2")
 
         if is_csv == False:
             self.logger.info(f"Saving tagged XNLI CSV to {destination_path}")
@@ -195,16 +379,22 @@ class Tagger:
         self.validate_filename(filename)
         destination_path = os.path.join(self.tag_dir, f"{filename}.csv")
         
-        df_xlsum = pd.read_csv(source)
+        df_xlsum = read_dataset(source)
         self.logger.info(f"Loaded XLSUM dataframe with {len(df_xlsum)} rows.")
 
         df_xlsum['sentences_list'] = df_xlsum['text'].apply(self._get_sentences_calamancy) 
-        df_xlsum['summary_form'] = df_xlsum['summary'].apply(self._get_sentence_form)
+
+        if self.estimator is not None:
+            # Sampled from the sentences of every article, like the exact counts
+            return self._estimate_segments(filename, tags_text=[sent for sublist in df_xlsum['sentences_list']
+                                                                for sent in sublist],
+                                           tags_summary=df_xlsum['summary'])
+        df_xlsum['summary_form'] = self._tag_forms(df_xlsum['summary'], "Tagging XLSUM summary")
 
         all_sentences = [sent for sublist in df_xlsum['sentences_list'] for sent in sublist]
         df_xlsum.drop(columns=['sentences_list'], inplace=True)
 
-        tags_text = [self._get_sentence_form(sentence) for sentence in all_sentences]
+        tags_text = self._tag_forms(pd.Series(all_sentences, dtype=object), "Tagging XLSUM text").to_list()
         tags_summarize = df_xlsum['summary_form'].to_list()
 
         if is_csv == False: 
@@ -0,0 +1,47 @@
+"""
+    calamanCy model tiers of the tagger, importable without pandas, numpy or spaCy.
+
+    md for exploratory runs and reports, up to trf (transformer) for final
+    numbers. calamanCy has no small model. Tagger exposes these as
+    Tagger.TIERS, Tagger.TIER, Tagger.model_of and Tagger.installed_tiers;
+    pages that only list the tiers import this module instead, so they
+    don't pull in the Tagger.
+"""
+from importlib.metadata import distribution, PackageNotFoundError
+from .Errors import IncorrectTierError
+
+# calamanCy model per tier, fastest first. The version is the one of the hash-pinned wheel in
+# requirements.txt: calamancy.load only checks that a package of the name is installed and
+# loads it whatever its version, so naming another version here would mislabel the results
+TIERS = {
+    "md": "tl_calamancy_md-0.1.0",
+    "lg": "tl_calamancy_lg-0.1.0",
+    "trf": "tl_calamancy_trf-0.1.0",
+}
+TIER = "md"
+
+
+def model_of(tier=None):
+    """The model name of `tier`, the default tier when None."""
+    tier = tier or TIER
+    if tier not in TIERS:
+        raise IncorrectTierError(f"{tier} is not a model tier. Accepted: {', '.join(TIERS)}")
+    return TIERS[tier]
+
+
+def installed_tiers():
+    """
+        The tiers whose model package is installed, in TIERS order.
+
+        calamancy.load installs any other model from the network on first
+        use, which fails in the offline image, so the server only offers
+        these. Same check as spacy.util.is_package, without importing spaCy.
+    """
+    tiers = []
+    for tier, model in TIERS.items():
+        try:
+            distribution(model.split("-")[0])
+        except PackageNotFoundError:
+            continue
+        tiers.append(tier)
+    return tiers
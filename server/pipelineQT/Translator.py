@@ -3,14 +3,26 @@ from pathlib import Path
 from typing import List
 import pandas as pd
 from .Errors import MissingKeysError, ExtraKeysError, NoDatasetError
-from tqdm import tqdm
+from .Schema import read_dataset
+from .Progress import ProgressBar
+from . import Metrics, Profiler
 
 class Translator:
 
     ACCEPTED_DATASETS = ['paws', 'xnli', 'xlsum', 'bcopa']
+    OPUS_MODEL = "Helsinki-NLP/opus-mt-en-tl"
+    # Local model cache the Opus-MT files are downloaded to (Hugging Face's default when unset)
+    MODEL_CACHE = os.environ.get("QT_MODEL_CACHE")
 
-    def __init__(self, translate_dir="../datasets_sample_translated/"):
+    # (tokenizer, model) shared by every Translator in the process, see load_opus
+    _opus = None
+
+    def __init__(self, translate_dir="../datasets_sample_translated/", channel=None, profiler=None):
         self.translate_dir = translate_dir
+        # Progress bus channel (usually the job id) the batch loops publish to
+        self.channel = channel
+        # Optional StageProfiler, every engine call is then profiled per dataset
+        self.profiler = profiler
         if not os.path.exists(self.translate_dir):
             os.makedirs(self.translate_dir)
 
@@ -34,7 +46,8 @@ class Translator:
 
         params = {"key": key}
 
-        response = requests.post(url, params=params, json=payload)
+        with Metrics.translation("google", source_texts):
+            response = requests.post(url, params=params, json=payload)
 
         try:
             response_json = response.json()
@@ -60,7 +73,7 @@ class Translator:
 
         translated_texts = []
 
-        for i in tqdm(range(0, len(source_texts), batch_size), desc="Translating"):
+        for i in ProgressBar(range(0, len(source_texts), batch_size), desc="Translating", unit="batch", channel=self.channel):
             batch = source_texts[i : i + batch_size]
             batch_result = self._google_translate(key, batch)
 
@@ -68,6 +81,7 @@ class Translator:
         
         return translated_texts
 
+    @Profiler.each_dataset("translate:google", ACCEPTED_DATASETS)
     def google_translate(self, key, batch_size=20, **kwargs):
         
         if not kwargs:
@@ -81,7 +95,7 @@ class Translator:
         self._validate_args(datasets, Translator.ACCEPTED_DATASETS)
 
         if 'paws' in datasets:
-            df_paws = pd.read_csv(kwargs['paws'])  # Error here if the path provided cannot be used
+            df_paws = read_dataset(kwargs['paws'])  # Error here if the path provided cannot be used
             sentence1 = df_paws['sentence1'].to_list()
             sentence2 = df_paws['sentence2'].to_list()
 
@@ -95,7 +109,7 @@ class Translator:
             print("Successfully translated PAWS!")
 
         if 'bcopa' in datasets:
-            df_bcopa = pd.read_csv(kwargs['bcopa'])
+            df_bcopa = read_dataset(kwargs['bcopa'])
             premise = df_bcopa['premise'].to_list()
             choice1 = df_bcopa['choice1'].to_list()
             choice2 = df_bcopa['choice2'].to_list()
@@ -112,7 +126,7 @@ class Translator:
             print("Successfully translated BCOPA!")
 
         if 'xnli' in datasets:
-            df_xnli = pd.read_csv(kwargs['xnli'])
+            df_xnli = read_dataset(kwargs['xnli'])
             xnli_sentence1 = df_xnli["sentence1"].to_list()
             xnli_sentence2 = df_xnli["sentence2"].to_list()
 
@@ -126,7 +140,7 @@ class Translator:
             print("Successfully translated XNLI!")
 
         if 'xlsum' in datasets:
-            df_xlsum = pd.read_csv(kwargs['xlsum'])
+            df_xlsum = read_dataset(kwargs['xlsum'])
             xlsum_text = df_xlsum["text"].to_list()
             xlsum_summary = df_xlsum["summary"].to_list()
 
@@ -160,7 +174,8 @@ class Translator:
         print("DEBUG: headers:", {k: (masked_key if k == "Ocp-Apim-Subscription-Key" else v) for k, v in headers.items()})
         print("DEBUG: payload sample:", payload[:1])
 
-        response = requests.post(url, params=params, headers=headers, json=payload)
+        with Metrics.translation("azure", texts):
+            response = requests.post(url, params=params, headers=headers, json=payload)
         print("DEBUG: status_code:", response.status_code)
         print("DEBUG: response.text (first 1000 chars):", response.text[:1000])
 
@@ -187,7 +202,7 @@ class Translator:
         
         result_texts = []
 
-        for i in tqdm(range(0, len(source_texts), batch_size), desc="Translating"):
+        for i in ProgressBar(range(0, len(source_texts), batch_size), desc="Translating", unit="batch", channel=self.channel):
             batch = source_texts[i : i + batch_size]
             attempt = 0
             while True:
@@ -199,6 +214,7 @@ class Translator:
                     if "429" in err_text or "request limits" in err_text:
                         backoff = min(60, 5 * (attempt + 1))
                         print(f"Hit rate limit; sleeping {backoff}s then retrying (attempt {attempt + 1})...")
+                        Metrics.TRANSLATE_RETRIES.labels(engine="azure").inc()
                         time.sleep(backoff)
                         attempt += 1
                         if attempt >= 5:
@@ -209,6 +225,7 @@ class Translator:
 
         return result_texts
 
+    @Profiler.each_dataset("translate:azure", ACCEPTED_DATASETS)
     def azure_translate(self, key: dict, batch_size=20, **kwargs) -> list:
 
         if not kwargs:
@@ -231,7 +248,7 @@ class Translator:
         
         # Translate the given datasets
         if 'paws' in datasets:
-            df_paws = pd.read_csv(kwargs['paws'])
+            df_paws = read_dataset(kwargs['paws'])
             sentence1 = df_paws['sentence1'].to_list()
             sentence2 = df_paws['sentence2'].to_list()
 
@@ -245,7 +262,7 @@ class Translator:
             print("Successfully translated PAWS!")
 
         if 'bcopa' in datasets:
-            df_bcopa = pd.read_csv(kwargs['bcopa'])
+            df_bcopa = read_dataset(kwargs['bcopa'])
             premise = df_bcopa['premise'].to_list()
             choice1 = df_bcopa['choice1'].to_list()
             choice2 = df_bcopa['choice2'].to_list()
@@ -262,7 +279,7 @@ class Translator:
             print("Successfully translated BCOPA!")
 
         if 'xnli' in datasets:
-            df_xnli = pd.read_csv(kwargs['xnli'])
+            df_xnli = read_dataset(kwargs['xnli'])
             xnli_sentence1 = df_xnli["sentence1"].to_list()
             xnli_sentence2 = df_xnli["sentence2"].to_list()
 
@@ -276,7 +293,7 @@ class Translator:
             print("Successfully translated XNLI!")
 
         if 'xlsum' in datasets:
-            df_xlsum = pd.read_csv(kwargs['xlsum'])
+            df_xlsum = read_dataset(kwargs['xlsum'])
             xlsum_text = df_xlsum["text"].to_list()
             xlsum_summary = df_xlsum["summary"].to_list()
 
@@ -292,10 +309,11 @@ class Translator:
     def _deepl_translate(self, texts, translator, batch_size=20):
         translations = []
 
-        for i in tqdm(range(0, len(texts), batch_size), desc="Translating"):
+        for i in ProgressBar(range(0, len(texts), batch_size), desc="Translating", unit="batch", channel=self.channel):
             batch = texts[i : i + batch_size]
             
-            result_objects = translator.translate_text(batch, target_lang="TL")
+            with Metrics.translation("deepl", batch):
+                result_objects = translator.translate_text(batch, target_lang="TL")
 
             batch_strings = [r.text for r in result_objects]
 
@@ -303,6 +321,7 @@ class Translator:
 
         return translations
 
+    @Profiler.each_dataset("translate:deepl", ACCEPTED_DATASETS)
     def deepl_translate(self, key, **kwargs):
         import deepl
         translator = deepl.Translator(key)
@@ -319,7 +338,7 @@ class Translator:
         
         # Translate the given datasets
         if 'paws' in datasets:
-            df_paws = pd.read_csv(kwargs['paws'])
+            df_paws = read_dataset(kwargs['paws'])
             sentence1 = df_paws['sentence1'].to_list()
             sentence2 = df_paws['sentence2'].to_list()
 
@@ -333,7 +352,7 @@ class Translator:
             print("PAWS successfully translated!")
 
         if 'bcopa' in datasets:
-            df_bcopa = pd.read_csv(kwargs['bcopa'])
+            df_bcopa = read_dataset(kwargs['bcopa'])
             premise = df_bcopa['premise'].to_list()
             choice1 = df_bcopa['choice1'].to_list()
             choice2 = df_bcopa['choice2'].to_list()
@@ -350,7 +369,7 @@ class Translator:
             print("Succesfully translated BCOPA")
 
         if 'xnli' in datasets:
-            df_xnli = pd.read_csv(kwargs['xnli'])
+            df_xnli = read_dataset(kwargs['xnli'])
             xnli_sentence1 = df_xnli["sentence1"].to_list()
             xnli_sentence2 = df_xnli["sentence2"].to_list()
 
@@ -364,7 +383,7 @@ class Translator:
             print("Successfully translated XNLI")
 
         if 'xlsum' in datasets:
-            df_xlsum = pd.read_csv(kwargs['xlsum'])
+            df_xlsum = read_dataset(kwargs['xlsum'])
             xlsum_text = df_xlsum["text"].to_list()
             xlsum_summary = df_xlsum["summary"].to_list()
 
@@ -379,21 +398,31 @@ class Translator:
 
     def _opus_translate(self, sentences, tokenizer, model, batch_size=20):
         translations = []
-        for i in tqdm(range(0, len(sentences), batch_size), desc="Translating"):
+        for i in ProgressBar(range(0, len(sentences), batch_size), desc="Translating", unit="batch", channel=self.channel):
             batch = sentences[i:i+batch_size]
-            inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True)
-            outputs = model.generate(**inputs)
+            with Metrics.translation("opus", batch), \
+                 Metrics.MODEL_CALL_SECONDS.labels(model=Translator.OPUS_MODEL, call="batch").time():
+                inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True)
+                outputs = model.generate(**inputs)
             decoded = tokenizer.batch_decode(outputs, skip_special_tokens=True)
             translations.extend(decoded)
 
         return translations
         
+    @classmethod
+    def load_opus(cls):
+        """The Opus-MT tokenizer and model, loaded once per process."""
+        if cls._opus is None:
+            from transformers import MarianMTModel, MarianTokenizer
+            tokenizer = MarianTokenizer.from_pretrained(cls.OPUS_MODEL, cache_dir=cls.MODEL_CACHE)
+            model = MarianMTModel.from_pretrained(cls.OPUS_MODEL, cache_dir=cls.MODEL_CACHE)
+            cls._opus = (tokenizer, model)
+        return cls._opus
+
+    @Profiler.each_dataset("translate:opus", ACCEPTED_DATASETS)
     def opus_translate(self, **kwargs):
        
-        from transformers import MarianMTModel, MarianTokenizer
-        model_name = "Helsinki-NLP/opus-mt-en-tl"
-        tokenizer = MarianTokenizer.from_pretrained(model_name)
-        model = MarianMTModel.from_pretrained(model_name)
+        tokenizer, model = Translator.load_opus()
 
         if not kwargs:
             raise NoDatasetError(textwrap.dedent("""
@@ -407,7 +436,7 @@ class Translator:
         
         # Translate the given datasets
         if 'paws' in datasets:
-            df_paws = pd.read_csv(kwargs['paws'])
+            df_paws = read_dataset(kwargs['paws'])
             sentence1 = df_paws['sentence1'].to_list()
             sentence2 = df_paws['sentence2'].to_list()
 
@@ -421,7 +450,7 @@ class Translator:
             print("PAWS successfully translated!")
 
         if 'bcopa' in datasets:
-            df_bcopa = pd.read_csv(kwargs['bcopa'])
+            df_bcopa = read_dataset(kwargs['bcopa'])
             premise = df_bcopa['premise'].to_list()
             choice1 = df_bcopa['choice1'].to_list()
             choice2 = df_bcopa['choice2'].to_list()
@@ -438,7 +467,7 @@ class Translator:
             print("BCOPA successfully translated!")
 
         if 'xnli' in datasets:
-            df_xnli = pd.read_csv(kwargs['xnli'])
+            df_xnli = read_dataset(kwargs['xnli'])
             xnli_sentence1 = df_xnli["sentence1"].to_list()
             xnli_sentence2 = df_xnli["sentence2"].to_list()
 
@@ -452,7 +481,7 @@ class Translator:
             print("XNLI successfully translated!")
 
         if 'xlsum' in datasets:
-            df_xlsum = pd.read_csv(kwargs['xlsum'])
+            df_xlsum = read_dataset(kwargs['xlsum'])
             xlsum_text = df_xlsum["text"].to_list()
             xlsum_summary = df_xlsum["summary"].to_list()
 
@@ -0,0 +1,144 @@
+"""
+    Model prefetch and warmup, so a new container serves its first request warm.
+
+    prefetch() downloads the models into the local model cache. calamancy
+    installs its model package on first load, and Opus-MT goes to
+    QT_MODEL_CACHE. Run it when the image is built.
+
+    warmup() loads the models in this process and runs a few inferences, so
+    lazy initialization and kernel selection happen before any request.
+    Then it marks the process ready and writes the readiness file.
+
+        cd server
+        python -m pipelineQT.Warmup --prefetch --opus   # image build
+        python -m pipelineQT.Warmup --opus              # check a container
+"""
+import os, json, time, argparse, threading
+
+READY_FILE = os.environ.get("QT_READY_FILE", "../cache/ready.json")
+
+# A few sentences of different lengths, so more than one batch shape is seen
+TAGALOG_SENTENCES = [
+    "Kumain ang bata.",
+    "Ang bata ay kumain ng mansanas kahapon.",
+    "Pumunta kami sa palengke upang bumili ng isda at gulay para sa hapunan.",
+    "Si Maria ay nagbasa ng libro habang naghihintay sa istasyon ng tren.",
+]
+ENGLISH_SENTENCES = [
+    "The child ate.",
+    "We went to the market to buy fish and vegetables for dinner.",
+]
+
+_state = {"ready": False, "models": {}, "seconds": None, "error": None}
+_state_lock = threading.Lock()
+_started = False # warmup() running or done in this process
+
+
+def prefetch(opus=False):
+    """Fill the local model cache. Returns {model: seconds taken}."""
+    from .Tagger import Tagger
+
+    timings = {}
+    start = time.perf_counter()
+    Tagger.load_model()
+    timings[Tagger.MODEL] = time.perf_counter() - start
+
+    if opus:
+        from .Translator import Translator
+        start = time.perf_counter()
+        Translator.load_opus()
+        timings[Translator.OPUS_MODEL] = time.perf_counter() - start
+    return timings
+
+
+def warmup(opus=False, ready_file=READY_FILE):
+    """
+        Load the models, run the warmup inferences and mark the process ready.
+
+        The readiness file is removed first, so a file left by an earlier
+        container never reports this one ready. Errors are kept in the
+        status and raised again.
+    """
+    from .Tagger import Tagger
+
+    global _started
+    with _state_lock:
+        _started = True
+
+    if ready_file and os.path.exists(ready_file):
+        os.remove(ready_file)
+
+    start = time.perf_counter()
+    try:
+        models = prefetch(opus=opus)
+
+        nlp, _ = Tagger.load_model()
+        for batch_size in (1, len(TAGALOG_SENTENCES)):
+            docs = nlp.pipe(TAGALOG_SENTENCES, batch_size=batch_size)
+            Tagger._doc_forms(list(docs))
+
+        if opus:
+            from .Translator import Translator
+            tokenizer, model = Translator.load_opus()
+            for batch in (ENGLISH_SENTENCES[:1], ENGLISH_SENTENCES):
+                inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True)
+                model.generate(**inputs)
+    except Exception as e:
+        with _state_lock:
+            _state["error"] = f"{type(e).__name__}: {e}"
+        raise
+
+    with _state_lock:
+        _state.update(ready=True, models=models, seconds=time.perf_counter() - start, error=None)
+        snapshot = dict(_state)
+
+    if ready_file:
+        os.makedirs(os.path.dirname(os.path.abspath(ready_file)), exist_ok=True)
+        with open(ready_file, "w") as f:
+            json.dump({**snapshot, "pid": os.getpid(), "time": time.time()}, f, indent=2)
+    return snapshot
+
+
+def start(opus=False):
+    """Run warmup() in a background thread, unless it already ran or is running in this process."""
+    global _started
+    with _state_lock:
+        if _started:
+            return
+        _started = True
+
+    def run():
+        try:
+            warmup(opus=opus)
+        except Exception:
+            pass # kept in status(), /healthz reports it
+
+    threading.Thread(target=run, daemon=True, name="warmup").start()
+
+
+def status():
+    """{"ready", "models": {model: load seconds}, "seconds", "error"} of this process."""
+    with _state_lock:
+        return dict(_state)
+
+
+def is_ready():
+    return _state["ready"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--opus", action="store_true", help="also fetch and warm up Opus-MT")
+    parser.add_argument("--prefetch", action="store_true", help="only fill the model cache, no warmup")
+    parser.add_argument("--ready-file", default=READY_FILE)
+    args = parser.parse_args()
+
+    if args.prefetch:
+        for model, seconds in prefetch(opus=args.opus).items():
+            print(f"Fetched {model} in {seconds:.1f}s")
+    else:
+        print(json.dumps(warmup(opus=args.opus, ready_file=args.ready_file), indent=2))
+
+
+if __name__ == "__main__":
+    main()
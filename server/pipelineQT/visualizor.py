@@ -1,10 +1,12 @@
-import pandas as pd
-import plotly.express as px
 import json
+from . import Statistics
 
 def generate_charts(data):
     """
     Takes the nested JSON data and returns a dictionary of Plotly Figures.
+
+    Every bar has the 95% bootstrap interval of its count in the hover (an
+    error bar on a stacked bar would sit on the cumulative height).
     
     Args:
         data (dict): The input JSON dictionary containing dataset metrics.
@@ -12,6 +14,10 @@ def generate_charts(data):
     Returns:
         dict: Keys are dataset names (str), Values are Plotly Figure objects.
     """
+    # pandas and plotly are imported on first use so importing the server stays cheap
+    import pandas as pd
+    import plotly.express as px
+
     figures = {}
 
     # Iterate through each top-level dataset (e.g., 'bcopa', 'paws')
@@ -21,14 +27,17 @@ def generate_charts(data):
         for segment_key, counts in segments.items():
             # Clean the segment name (e.g., 'tags_premise' -> 'Premise')
             clean_segment = segment_key.replace("tags_", "").replace("_", " ").title()
+            intervals = Statistics.count_intervals(counts)
             
             for category, count in counts.items():
                 # Filter out 0 counts to keep the chart clean
                 if count > 0:
+                    low, high = intervals[category]
                     rows.append({
                         "Segment": clean_segment,
                         "Category": category.replace("_", " ").title(), # Clean 'di_karaniwang_ayos'
-                        "Count": count
+                        "Count": count,
+                        "Interval": f"{low:.0f}-{high:.0f}",
                     })
         
         # If no data exists for this dataset (e.g. all zeros), skip it
@@ -46,6 +55,7 @@ def generate_charts(data):
             color="Category",
             title=f"Sentence Structure Distribution: {dataset_name.upper()}",
             text_auto=True, # Show values inside bars
+            hover_data={"Interval": True},
             color_discrete_map={
                 "Karaniwang Ayos": "#2E86C1",     # Blue
                 "Di Karaniwang Ayos": "#E74C3C",  # Red
@@ -69,6 +79,123 @@ def generate_charts(data):
     return figures
 
 
+def generate_engine_charts(store=None, datasets=None, engines=None, counts=None):
+    """
+    Builds one cross-engine comparison chart per dataset from a ResultsStore.
+
+    Uses the latest run of every engine and dataset, so no CSV is read,
+    or the given `counts` of one run.
+    Bars show the share of each structure type per segment and engine, so
+    engines with different sample sizes stay comparable; the counts are in
+    the hover. Built with graph_objects on a two-level category axis
+    (segment, engine) since plotly express facets are much slower.
+
+    Every share has its 95% bootstrap interval in the hover (the bars are
+    stacked, so error bars would read as intervals of the cumulative
+    height), and the subtitle has a chi-square test per segment of whether
+    the engines differ. Paired tests need the per-row forms, see Statistics.compare.
+
+    Args:
+        store (ResultsStore): The store the tagging runs were recorded in.
+        datasets (list): Only these datasets (all when None).
+        engines (list): Only these engines (all when None).
+        counts (dict): {dataset: {engine: {segment: {category: count}}}} to
+            chart instead of querying the store.
+
+    Returns:
+        dict: Keys are dataset names (str), Values are Plotly Figure objects.
+    """
+    import plotly.graph_objects as go
+
+    colors = {
+        "Karaniwang Ayos": "#2E86C1",     # Blue
+        "Di Karaniwang Ayos": "#E74C3C",  # Red
+        "Ambiguous": "#95A5A6"            # Grey
+    }
+    figures = {}
+
+    by_dataset = counts if counts is not None else store.query(datasets=datasets, engines=engines)
+
+    for dataset_name, by_engine in by_dataset.items():
+
+        # Category -> bars on the (segment, engine) axis
+        bars = {}
+        by_segment = {}
+        for engine, segments in sorted(by_engine.items()):
+            for segment_key, counts in segments.items():
+                clean_segment = segment_key.replace("tags_", "").replace("_", " ").title()
+                total = sum(counts.values()) or 1
+                intervals = Statistics.count_intervals(counts)
+                by_segment.setdefault(clean_segment, {})[engine] = counts
+
+                for category, count in counts.items():
+                    bar = bars.setdefault(category.replace("_", " ").title(),
+                                          {"x": [[], []], "y": [], "hover": []})
+                    low, high = intervals[category]
+                    bar["x"][0].append(clean_segment)
+                    bar["x"][1].append(engine.title())
+                    bar["y"].append(round(100 * count / total, 1))
+                    bar["hover"].append([count, round(100 * low / total, 1), round(100 * high / total, 1)])
+
+        tests = []
+        for segment, counts in by_segment.items():
+            if len(counts) > 1:
+                test = Statistics.chi_square(counts)
+                tests.append(f"{segment}: χ²({test['df']}) = {test['statistic']:.1f}, p = {test['p_value']:.3g}")
+
+        fig = go.Figure([
+            go.Bar(
+                name=category,
+                x=bar["x"],
+                y=bar["y"],
+                customdata=bar["hover"],
+                text=bar["y"],
+                marker_color=colors.get(category),
+                hovertemplate="%{x}<br>%{y}% (%{customdata[0]})<br>95% interval %{customdata[1]}-%{customdata[2]}%"
+                              "<extra>" + category + "</extra>",
+            )
+            for category, bar in bars.items()
+        ])
+
+        fig.update_layout(
+            title=f"Sentence Structure by Engine: {dataset_name.upper()}"
+                  + (f"<br><sup>{' · '.join(tests)}</sup>" if tests else ""),
+            barmode='stack',
+            yaxis_title="Share (%)",
+            legend_title="Structure Type",
+            autosize=True,
+            margin=dict(l=20, r=20, t=70 if tests else 50, b=20)
+        )
+
+        figures[dataset_name] = fig
+
+    return figures
+
+
+def figure_specs(figures):
+    """
+    Turns the figures of generate_charts into compact JSON specs for Plotly.newPlot.
+
+    Every figure uses the same layout template, so it is sent once for the
+    whole page instead of once per chart.
+
+    Args:
+        figures (dict): Dataset names (str) to Plotly Figure objects.
+
+    Returns:
+        dict: {"template": the shared layout template,
+               "figures": {dataset name: {"data": [...], "layout": {...}}}}
+    """
+    template = None
+    specs = {}
+    for name, fig in figures.items():
+        spec = json.loads(fig.to_json())
+        template = spec["layout"].pop("template", template)
+        specs[name] = {"data": spec["data"], "layout": spec["layout"]}
+
+    return {"template": template, "figures": specs}
+
+
 def _read_json(path):
 # Open and read a JSON file
     with open(path, "r") as file:
@@ -0,0 +1,106 @@
+// LIVE JOB PROGRESS
+// Pipeline forms run as background jobs. These helpers submit a form as a job,
+// follow its progress events (/jobs/<id>/progress) inside a loading overlay and
+// open the result page once the job is done.
+
+function formatSeconds(seconds) {
+    if (seconds === null || seconds === undefined) return '?';
+    seconds = Math.round(seconds);
+    return seconds >= 60 ? `${Math.floor(seconds / 60)}m ${seconds % 60}s` : `${seconds}s`;
+}
+
+function formatProgress(event) {
+    const done = event.total ? `${event.n} / ${event.total} ${event.unit}` : `${event.n} ${event.unit}`;
+    const rate = event.rate ? ` · ${event.rate.toFixed(1)} ${event.unit}/s` : '';
+    const eta = event.total ? ` · ETA ${formatSeconds(event.eta)}` : '';
+    return done + rate + eta;
+}
+
+function progressElements(overlay) {
+    let bar = overlay.querySelector('.loading-progress');
+    if (!bar) {
+        bar = document.createElement('progress');
+        bar.className = 'loading-progress';
+        overlay.appendChild(bar);
+    }
+    return {
+        text: overlay.querySelector('.loading-text'),
+        subtext: overlay.querySelector('.loading-subtext'),
+        spinner: overlay.querySelector('.spinner'),
+        bar: bar,
+    };
+}
+
+function showFailure(elements, message) {
+    elements.spinner.style.display = 'none';
+    elements.bar.style.display = 'none';
+    elements.text.textContent = 'Failed';
+    elements.subtext.textContent = message;
+}
+
+// Ask for the final state of the job, go to its result or show its error
+async function finishJob(jobId, elements) {
+    const response = await fetch(`/jobs/${jobId}/status`, { headers: { 'Accept': 'application/json' } });
+    const job = await response.json();
+
+    if (job.status === 'done') {
+        window.location = job.result_url;
+    } else if (job.status === 'failed') {
+        showFailure(elements, job.error);
+    } else {
+        // Still queued or running (e.g. the event stream was cut), check again shortly
+        elements.text.textContent = job.status === 'queued' ? 'Waiting for a free worker...' : 'Running...';
+        setTimeout(() => finishJob(jobId, elements), 1000);
+    }
+}
+
+function followJob(jobId, overlay) {
+    const elements = progressElements(overlay);
+    const source = new EventSource(`/jobs/${jobId}/progress`);
+
+    source.onmessage = function(message) {
+        const event = JSON.parse(message.data);
+        if (event.type === 'end') {
+            source.close();
+            finishJob(jobId, elements);
+            return;
+        }
+
+        elements.text.textContent = event.stage;
+        elements.subtext.textContent = formatProgress(event);
+        if (event.total) {
+            elements.bar.max = event.total;
+            elements.bar.value = event.n;
+        } else {
+            elements.bar.removeAttribute('value'); // Indeterminate
+        }
+    };
+
+    // No live progress (connection lost, proxy without streaming...), fall back to polling
+    source.onerror = function() {
+        source.close();
+        finishJob(jobId, elements);
+    };
+}
+
+async function submitJob(form, overlay) {
+    overlay.style.display = 'flex';
+    const response = await fetch(form.action, {
+        method: 'POST',
+        body: new FormData(form),
+        headers: { 'Accept': 'application/json' },
+    });
+
+    if (!response.ok) {
+        showFailure(progressElements(overlay), await response.text());
+        return;
+    }
+
+    const job = await response.json();
+    if (job.result_url) {
+        // Answered from the result cache, nothing to wait for
+        window.location = job.result_url;
+        return;
+    }
+    followJob(job.job_id, overlay);
+}
@@ -0,0 +1,94 @@
+"""
+    DownloadManager against the local stand-in release server of
+    benchmarks/bench_downloads.py, which drops connections part-way through.
+
+        cd server
+        python -m pytest tests
+"""
+import hashlib, json, os, random, threading
+from http.server import ThreadingHTTPServer
+import pytest
+from benchmarks.bench_downloads import make_handler
+from pipelineQT.Downloader import DownloadManager, sha256sum
+from pipelineQT.Errors import ChecksumError
+
+
+@pytest.fixture
+def files():
+    rng = random.Random(0)
+    return {"xlsum.jsonl": rng.randbytes(3 * 1024 ** 2), "xnli.tsv": rng.randbytes(1024 ** 2)}
+
+
+def serve(files, drops=0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(files, drops, rate=1024 ** 3))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def write_manifest(path, files):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({name: hashlib.sha256(body).hexdigest() for name, body in files.items()}, f)
+    return path
+
+
+def test_resumes_after_disconnects(files, tmp_path):
+    server, base_url = serve(files, drops=3)
+    try:
+        manager = DownloadManager(backoff=0, manifest=write_manifest(tmp_path / "checksums.json", files))
+        jobs = [(f"{base_url}/{name}", str(tmp_path / name)) for name in files]
+        errors = manager.download_all(*jobs)
+    finally:
+        server.shutdown()
+
+    assert not any(errors.values()), errors
+    for name, body in files.items():
+        assert (tmp_path / name).read_bytes() == body
+        assert not os.path.exists(tmp_path / f"{name}.part")
+        assert not os.path.exists(tmp_path / f"{name}.part.validator")
+
+
+def test_restarts_when_the_remote_file_changed(files, tmp_path):
+    # A part left over from an older version of the file, with its ETag
+    old = files["xnli.tsv"]
+    part_path = tmp_path / "xnli.tsv.part"
+    part_path.write_bytes(old[:len(old) // 2])
+    (tmp_path / "xnli.tsv.part.validator").write_text('"' + hashlib.sha256(old).hexdigest()[:16] + '"')
+
+    files["xnli.tsv"] = bytes(reversed(old))
+    server, base_url = serve(files)
+    try:
+        DownloadManager(backoff=0).download(f"{base_url}/xnli.tsv", str(tmp_path / "xnli.tsv"))
+    finally:
+        server.shutdown()
+
+    assert (tmp_path / "xnli.tsv").read_bytes() == files["xnli.tsv"]
+
+
+def test_rejects_a_checksum_mismatch(files, tmp_path):
+    manifest = write_manifest(tmp_path / "checksums.json", {"xnli.tsv": b"something else"})
+    server, base_url = serve(files, drops=1)
+    try:
+        with pytest.raises(ChecksumError):
+            DownloadManager(backoff=0, manifest=manifest).download(f"{base_url}/xnli.tsv", str(tmp_path / "xnli.tsv"))
+    finally:
+        server.shutdown()
+
+    assert not os.path.exists(tmp_path / "xnli.tsv")
+    assert not os.path.exists(tmp_path / "xnli.tsv.part")
+
+
+def test_records_the_first_download(files, tmp_path, capsys):
+    record = str(tmp_path / "recorded.json")
+    server, base_url = serve(files)
+    try:
+        DownloadManager(backoff=0, record=record).download(f"{base_url}/xnli.tsv", str(tmp_path / "xnli.tsv"))
+        assert DownloadManager.load_manifest(record) == {"xnli.tsv": sha256sum(tmp_path / "xnli.tsv")}
+        assert "no pinned sha256" in capsys.readouterr().err
+
+        # The pinned checksum catches a later change of the asset
+        files["xnli.tsv"] = b"tampered"
+        with pytest.raises(ChecksumError):
+            os.makedirs(tmp_path / "again")
+            DownloadManager(backoff=0, record=record).download(f"{base_url}/xnli.tsv", str(tmp_path / "again" / "xnli.tsv"))
+    finally:
+        server.shutdown()
@@ -0,0 +1,23 @@
+"""
+    WSGI entry point for production serving:
+
+        gunicorn --config gunicorn.conf.py wsgi:app
+
+    gunicorn.conf.py sets preload_app, so this module is imported once in
+    the gunicorn master. The models are loaded and warmed up here (see
+    pipelineQT/Warmup.py) before the workers are forked: every worker
+    shares their memory copy-on-write instead of loading its own copy, and
+    starts ready. gunicorn only binds once this is done, so /healthz never
+    answers from a cold worker. app.py imports the pipeline lazily, the
+    modules every worker ends up using are imported here so they are
+    shared too.
+"""
+import os, gc
+from app import app
+from pipelineQT import visualizor, Warmup
+
+Warmup.warmup(opus=os.environ.get("QT_PRELOAD_OPUS", "0") == "1")
+visualizor.generate_charts({}) # pulls in pandas and plotly
+
+# Keep the garbage collector from touching (and so un-sharing) everything loaded so far
+gc.freeze()